@@ -0,0 +1,209 @@
+# app_listing.py
+import json
+import re
+
+import requests
+from bs4 import BeautifulSoup
+
+from downloader import get_session, get_validators, DEFAULT_TIMEOUT
+
+DOWNLOAD_CLASS = 'btn-bs-arrow--secondary'
+RELEASE_CLASS = 'btn-bs-arrow--secondary-outline'
+BUTTON_CONTAINER_CLASS = 'qnap-bs-btn-container'
+PACKAGE_URL_PATTERN = re.compile(r'^https?://\S+\.(qpkg|zip)(\?\S*)?$', re.IGNORECASE)
+NAME_KEYS = ('name', 'title', 'displayName', 'app_name')
+VERSION_KEYS = ('version', 'ver', 'app_version')
+# 内嵌JSON中表示应用总数的字段
+COUNT_KEYS = ('total', 'count', 'totalCount', 'total_count')
+
+# 在浏览器中一次读取列表页所有应用的名称、版本、下载链接和release链接。
+# 规则与parse_button_containers相同；按钮区不在DOM中的应用download_url为空字符串
+EXTRACT_SCRIPT = '''
+var downloadClass = arguments[0], releaseClass = arguments[1], containerClass = arguments[2];
+return Array.prototype.map.call(document.querySelectorAll('.items-container li'), function (li) {
+    var result = {name: '', version: '', download_url: '', release_url: 'None'};
+    var container = li.querySelector('div.' + containerClass);
+    var version = li.querySelector('[class*="version"]');
+    if (version) {
+        result.version = version.textContent.trim();
+    }
+    var clone = li.cloneNode(true);
+    var cloneContainer = clone.querySelector('div.' + containerClass);
+    if (cloneContainer) {
+        cloneContainer.remove();
+    }
+    result.name = clone.textContent.replace(/\\s+/g, ' ').trim();
+    if (!container) {
+        return result;
+    }
+    var links = container.querySelectorAll('a');
+    var last = links[links.length - 1];
+    if (last && last.classList.contains(downloadClass) && last.href) {
+        result.download_url = last.href;
+        if (links[0].classList.contains(releaseClass) && links[0].href) {
+            result.release_url = links[0].href;
+        }
+    }
+    return result;
+});
+'''
+
+
+class AppItem:
+    def __init__(self, name: str, version: str, download_url: str, release_url: str = "None"):
+        self.name = name
+        self.version = version
+        self.download_url = download_url
+        self.release_url = release_url
+
+    def __str__(self) -> str:
+        return f"AppItem(name={self.name}, version={self.version}, download_url={self.download_url})"
+
+    def __eq__(self, other):
+        return isinstance(other, AppItem) and self.download_url == other.download_url
+
+    def __hash__(self):
+        return hash(self.download_url)
+
+
+def _first_str(data: dict, keys):
+    for key in keys:
+        value = data.get(key)
+        if isinstance(value, str) and value:
+            return value
+    return ""
+
+
+def _walk_json(data, items):
+    # 在页面内嵌的JSON中查找带有安装包链接的对象，每个这样的对象视为一个应用
+    if isinstance(data, dict):
+        download_url = ""
+        release_url = "None"
+        for key, value in data.items():
+            if not isinstance(value, str):
+                continue
+            if not download_url and PACKAGE_URL_PATTERN.match(value):
+                download_url = value
+            elif value.startswith('http') and ('release' in key.lower() or 'note' in key.lower()):
+                release_url = value
+        if download_url:
+            items.append(AppItem(_first_str(data, NAME_KEYS), _first_str(data, VERSION_KEYS), download_url,
+                                 release_url))
+        for value in data.values():
+            _walk_json(value, items)
+    elif isinstance(data, list):
+        for value in data:
+            _walk_json(value, items)
+
+
+def _iter_embedded_json(soup):
+    for script in soup.find_all('script', type='application/json'):
+        try:
+            yield json.loads(script.string or "")
+        except ValueError:
+            continue
+
+
+def parse_embedded_json(soup):
+    items = []
+    for data in _iter_embedded_json(soup):
+        _walk_json(data, items)
+    return items
+
+
+def _find_count(data):
+    if isinstance(data, dict):
+        for key in COUNT_KEYS:
+            value = data.get(key)
+            if isinstance(value, int) and not isinstance(value, bool):
+                return value
+        values = data.values()
+    elif isinstance(data, list):
+        values = data
+    else:
+        return None
+    for value in values:
+        count = _find_count(value)
+        if count is not None:
+            return count
+    return None
+
+
+def expected_count(soup):
+    """
+    页面上应有的应用数量：优先数列表容器中的条目，列表由前端渲染时取内嵌JSON中明确给出的总数。
+    两者都没有时返回None，此时无法判断解析结果是否完整。
+    """
+    rendered = len(soup.select('.items-container li'))
+    if rendered:
+        return rendered
+    for data in _iter_embedded_json(soup):
+        count = _find_count(data)
+        if count is not None:
+            return count
+    return None
+
+
+def parse_button_containers(soup):
+    # 与Selenium路径相同的规则：最后一个a为下载链接，第一个a为release notes
+    items = []
+    for item in soup.select('.items-container li'):
+        container = item.find('div', class_=BUTTON_CONTAINER_CLASS)
+        if container is None:
+            continue
+        links = container.find_all('a')
+        if not links or DOWNLOAD_CLASS not in links[-1].get('class', []):
+            continue
+        release_url = "None"
+        if RELEASE_CLASS in links[0].get('class', []) and links[0].get('href'):
+            release_url = links[0]['href']
+        # 名称取按钮区之外的文字
+        container.extract()
+        items.append(AppItem(item.get_text(' ', strip=True), "", links[-1]['href'], release_url))
+    return items
+
+
+def extract_listing(driver):
+    """
+    在已打开的列表页上执行一次脚本，按页面顺序返回每个应用的AppItem；
+    按钮区不在DOM中、需要打开弹窗才能读取的应用对应位置为None。
+    """
+    items = []
+    for data in driver.execute_script(EXTRACT_SCRIPT, DOWNLOAD_CLASS, RELEASE_CLASS, BUTTON_CONTAINER_CLASS) or []:
+        if data.get('download_url'):
+            items.append(AppItem(data['name'], data['version'], data['download_url'], data['release_url']))
+        else:
+            items.append(None)
+    return items
+
+
+def parse_listing(html):
+    """
+    从应用中心列表页的HTML中解析应用及下载链接。
+    页面中的应用数量未知或与解析结果对不上时返回None，由调用方退回到浏览器方式。
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    expected = expected_count(soup)
+    if expected is None:
+        return None
+    for parser in (parse_embedded_json, parse_button_containers):
+        items = list(dict.fromkeys(parser(soup)))
+        if items and len(items) >= expected:
+            return items
+    return None
+
+
+def fetch_listing(url, session=None, headers=None):
+    """
+    请求列表页并解析，返回 (状态码, 缓存校验头, 应用列表)。
+    headers中可带条件请求头，页面未变化时状态码为304、应用列表为None。
+    """
+    session = session or get_session()
+    try:
+        with session.get(url, headers=headers, timeout=DEFAULT_TIMEOUT) as resp:
+            if resp.status_code != 200:
+                return resp.status_code, get_validators(resp.headers), None
+            return resp.status_code, get_validators(resp.headers), parse_listing(resp.text)
+    except requests.RequestException as e:
+        print(f"获取列表页失败：{e}")
+        return 0, get_validators({}), None
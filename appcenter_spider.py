@@ -6,9 +6,11 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.service import Service
-from sphinx.util import requests
 from webdriver_manager.chrome import ChromeDriverManager
-import time
+
+from downloader import download_file
+from ledger import open_ledger
+from waits import wait_for_dom_quiet, wait_for_element_stable, wait_for_network_idle, wait_stats
 
 
 def get_options(set):
@@ -39,32 +41,12 @@ def get_options_for_select(wait_select):
     return options
 
 
-def download_file(url, local_path):
-    response = requests.get(url, stream=True)
-    if response.status_code == 200:
-        with open(local_path, 'wb') as file:
-            for chunk in response.iter_content(chunk_size=1024):
-                file.write(chunk)
-        print(f"文件已下载至：{local_path}")
-    else:
-        print(f"下载失败，状态码：{response.status_code}")
-
-
 def file_name_exists(file_name, folder_path):
-    record_file_path = os.path.join(folder_path, 'record_app_center.txt')
-    if os.path.exists(record_file_path):
-        with open(record_file_path, 'r') as file:
-            for line in file:
-                record_file_name = line.strip()
-                if record_file_name == file_name:
-                    return True
-    return False
+    return open_ledger(folder_path).find_by_name(file_name) is not None
 
 
-def save_file_name(file_name, folder_path):
-    record_file_path = os.path.join(folder_path, 'record_app_center.txt')
-    with open(record_file_path, 'a') as file:
-        file.write(f"{file_name}\n")
+def save_file_name(file_name, folder_path, file_path="", url=""):
+    open_ledger(folder_path).add(file_name, file_path=file_path, url=url)
 
 
 def wait_for_search_sets():
@@ -86,11 +68,12 @@ def click_close_button():
     close_button.click()
 
 
-def scroll(element, wait_seconds):
+def scroll(element):
     driver.execute_script("arguments[0].scrollIntoView({behavior: 'smooth', block: 'center'});",
                           element)
     WebDriverWait(driver, 10).until(EC.element_to_be_clickable(model_set))
-    time.sleep(wait_seconds)
+    # 等待平滑滚动结束
+    wait_for_element_stable(driver, element, 'scroll')
 
 
 if __name__ == '__main__':
@@ -115,7 +98,7 @@ if __name__ == '__main__':
     driver.get(download_center_url)
 
     # 等待页面加载
-    time.sleep(2)
+    wait_for_network_idle(driver, 'page_load')
 
     search_sets = wait_for_search_sets()
 
@@ -129,12 +112,12 @@ if __name__ == '__main__':
 
     # 依次点击选择所有product_option
     for i in range(len(product_options)):
-        scroll(product_set, 5)
+        scroll(product_set)
         wait_for_search_sets()
         # 打开product下拉框
         product_set.click()
-        # 等待下拉框可见
-        time.sleep(2)
+        # 等待下拉框渲染完成
+        wait_for_dom_quiet(driver, 'dropdown_open')
         # 重新获取下拉菜单和选项的最新引用
         product_options = get_options_for_select(wait_product_select)
         product_folder = product_options[i].text.strip()
@@ -143,10 +126,10 @@ if __name__ == '__main__':
         # Version
         version_options, wait_version_select = get_options(version_set)
         for j in range(len(version_options)):
-            scroll(version_set, 5)
+            scroll(version_set)
             wait_for_search_sets()
             version_set.click()
-            time.sleep(2)
+            wait_for_dom_quiet(driver, 'dropdown_open')
             version_options = get_options_for_select(wait_version_select)
             version_folder = version_options[j].text.strip()
             version_options[j].click()
@@ -154,10 +137,10 @@ if __name__ == '__main__':
             # Bay
             bay_options, wait_bay_select = get_options(bay_set)
             for k in range(len(bay_options)):
-                scroll(bay_set, 5)
+                scroll(bay_set)
                 wait_for_search_sets()
                 bay_set.click()
-                time.sleep(2)
+                wait_for_dom_quiet(driver, 'dropdown_open')
                 bay_options = get_options_for_select(wait_bay_select)
                 bay_folder = bay_options[k].text.strip()
                 bay_options[k].click()
@@ -165,9 +148,9 @@ if __name__ == '__main__':
                 # Model
                 model_options, wait_model_select = get_options(model_set)
                 for n in range(len(model_options)):
-                    scroll(model_set, 5)
+                    scroll(model_set)
                     model_set.click()
-                    time.sleep(2)
+                    wait_for_dom_quiet(driver, 'dropdown_open')
                     model_options = get_options_for_select(wait_model_select)
                     model_folder = model_options[n].text.strip()
                     model_options[n].click()
@@ -181,7 +164,7 @@ if __name__ == '__main__':
                         arrow = item.find_element(By.CSS_SELECTOR, 'div.arrow')
                         # 滚动到arrow元素可见
                         try:
-                            scroll(arrow, 2)
+                            scroll(arrow)
                             wait_arrow = WebDriverWait(driver, 20)
                         except Exception as e:
                             print('failed:  ' + item.text.strip())
@@ -229,8 +212,8 @@ if __name__ == '__main__':
                             local_file_path = os.path.join(folder_name, file_name)
 
                             if not file_name_exists(file_name, download_path):
-                                download_file(download_url, local_file_path)
-                                save_file_name(file_name, download_path)
+                                if download_file(download_url, local_file_path):
+                                    save_file_name(file_name, download_path, local_file_path, download_url)
                             else:
                                 print(f"文件名 {file_name} 已存在，跳过下载。")
 
@@ -239,3 +222,4 @@ if __name__ == '__main__':
                         click_close_button()
 
     driver.quit()
+    wait_stats.print_report()
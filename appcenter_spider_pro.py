@@ -1,15 +1,58 @@
+import argparse
 import os
-import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from sphinx.util import requests
-from webdriver_manager.chrome import ChromeDriverManager
-import time
+
+from downloader import QUARANTINE_DIR_NAME, DEFAULT_WORKERS
+from driver_pool import DriverPool, DEFAULT_POOL_SIZE, DEFAULT_MAX_USES
+from ledger import open_ledger
+from blob_store import open_blob_store
+from app_listing import fetch_listing, extract_listing, AppItem
+from snapshot import SnapshotStore, CrawlSummary
+from waits import wait_for_element_stable, wait_stats
+from page_cache import PageCache, DEFAULT_TTL_HOURS
+from pipeline import CrawlPipeline, DEFAULT_PAGE_QUEUE_SIZE
+from metrics import metrics, PROFILE_DIR_NAME
+from host_scheduler import scheduler, DEFAULT_RATE, DEFAULT_CONCURRENCY
+from crawl_journal import CrawlJournal, PAGE_DONE, PAGE_LISTED
+from catalog import open_catalog
+
+APP_CENTER_URL = 'https://www.qnap.com/en-us/app-center'
+ENUMERATION_URL = f'{APP_CENTER_URL}?os=qts&version=5.2.1'
+MENU_SELECTOR = 'div.css-13gtfdj-menu'
+# 一次读取已展开的react-select菜单中所有选项的文字
+OPTION_LABELS_SCRIPT = '''
+var menu = document.querySelector(arguments[0]);
+if (!menu) {
+    return null;
+}
+return Array.prototype.map.call(menu.querySelectorAll('div[role="option"]'), function (option) {
+    return option.innerText.trim();
+});
+'''
+# 在已展开的菜单中按文字点击选项，找不到时返回false
+SELECT_OPTION_SCRIPT = '''
+var menu = document.querySelector(arguments[0]);
+var options = menu ? menu.querySelectorAll('div[role="option"]') : [];
+for (var i = 0; i < options.length; i++) {
+    if (options[i].innerText.trim() === arguments[1]) {
+        options[i].scrollIntoView({block: 'nearest'});
+        options[i].click();
+        return true;
+    }
+}
+return false;
+'''
+# 增量模式的状态，由 --incremental 开启
+snapshots = None
+summary = None
+# 抓取进度，--resume 时从中断处继续
+journal = None
 
 
 class Page:
@@ -37,63 +80,47 @@ class Page:
     def get_file_path(self, base_path):
         return f"{base_path}/{self._operation_system}/{self._version}/{self._bay}/{self._model}"
 
+    def to_tuple(self) -> tuple:
+        return self._operation_system, self._version, self._bay, self._model
+
+    def get_key(self) -> str:
+        return f"{self._operation_system}/{self._version}/{self._bay}/{self._model}"
 
-def get_options(set, close):
+    def get_url(self) -> str:
+        return f"{APP_CENTER_URL}?os={self._operation_system}&version={self._version}&model={self._model}"
+
+
+def open_menu(set, driver_enum):
     # 修改aria-hidden属性，使其可交互
-    driver.execute_script("arguments[0].setAttribute('aria-hidden', 'false');", set)
-    # 打开下拉框
-    wait_and_click(set)
-    # 定位到div.css-13gtfdj-menu
-    wait_select = WebDriverWait(driver, 3)
-    select = wait_select.until(
-        EC.presence_of_element_located((By.CSS_SELECTOR, 'div.css-13gtfdj-menu')))
-    # 在div.css-13gtfdj-menu中找到div.css-uvrstl
-    options_select = select.find_element(By.CSS_SELECTOR, 'div.css-uvrstl')
-    # 获取所有的product_option元素
-    options = wait_select.until(EC.presence_of_all_elements_located((By.CSS_SELECTOR, 'div[role="option"]')))
-    if close:
-        # 关闭product下拉框
-        wait_and_click(set)
-    return options, wait_select
-
-
-def download_file(url, local_path):
-    response = requests.get(url, stream=True)
-    if response.status_code == 200:
-        with open(local_path, 'wb') as file:
-            for chunk in response.iter_content(chunk_size=1024):
-                file.write(chunk)
-        print(f"文件已下载至：{local_path}")
-    else:
-        print(f"下载失败，状态码：{response.status_code}")
+    driver_enum.execute_script("arguments[0].setAttribute('aria-hidden', 'false');", set)
+    # 打开下拉框，等待div.css-13gtfdj-menu中的选项出现
+    with metrics.timer('dropdown_open'):
+        wait_and_click(set, driver_enum)
+        WebDriverWait(driver_enum, 3).until(
+            EC.presence_of_element_located((By.CSS_SELECTOR, f'{MENU_SELECTOR} div[role="option"]')))
 
 
 def file_name_exists(file_name, folder_path):
-    record_file_path = os.path.join(folder_path, 'record_app_center.txt')
-    if os.path.exists(record_file_path):
-        with open(record_file_path, 'r') as file:
-            for line in file:
-                record_file_name, record_file_path, release_url = line.strip().split('|')
-                if record_file_name == file_name:
-                    return record_file_path  # 返回存在的文件路径
+    entry = open_ledger(folder_path).find_by_name(file_name)
+    if entry:
+        return entry.file_path  # 返回存在的文件路径
     return ""
 
 
-def save_file_name(file_name, folder_path, file_path, release_url):
-    record_file_path = os.path.join(folder_path, 'record_app_center.txt')
-    with open(record_file_path, 'a') as file:
-        file.write(f"{file_name}|{file_path}|{release_url}\n")
+def save_file_name(file_name, folder_path, file_path, release_url, url="", md5="", sha256=""):
+    open_ledger(folder_path).add(file_name, file_path=file_path, url=url, release_url=release_url, md5=md5,
+                                 sha256=sha256)
 
 
-def wait_for_search_sets():
+def wait_for_search_sets(driver_enum):
     # 等待所有div.css-xn98a3加载完成并且可交互
-    wait_search_sets = WebDriverWait(driver, 5)
+    wait_search_sets = WebDriverWait(driver_enum, 5)
     search_sets = wait_search_sets.until(EC.presence_of_all_elements_located((By.CSS_SELECTOR, 'div.css-xn98a3')))
     return search_sets
 
 
-def click_close_button():
-    wait_for_close_button = WebDriverWait(driver, 5)
+def click_close_button(driver_close):
+    wait_for_close_button = WebDriverWait(driver_close, 5)
     # 首先，等待div元素出现
     wait_for_close_button.until(
         EC.presence_of_element_located((By.CSS_SELECTOR, 'div.modal.fade.show')))
@@ -104,198 +131,531 @@ def click_close_button():
     close_button.click()
 
 
-def get_options_for_select(wait_select):
-    select = wait_select.until(
-        EC.presence_of_element_located((By.CSS_SELECTOR, 'div.css-13gtfdj-menu')))
-    options_select = select.find_element(By.CSS_SELECTOR, 'div.css-uvrstl')
-    options = options_select.find_elements(By.CSS_SELECTOR, 'div[role="option"]')
-    return options
-
-
-def wait_and_click(element):
-    WebDriverWait(driver, 3).until(EC.element_to_be_clickable(element))
+def wait_and_click(element, driver_click):
+    WebDriverWait(driver_click, 3).until(EC.element_to_be_clickable(element))
     element.click()
 
 
-def process_bay_and_model(bay_set, model_set, product_folder, version_folder, wait_bay_select, k):
+def process_bay_and_model(bay_set, model_set, product_folder, version_folder, bay_folder, pages, driver_enum):
     try:
         # 处理Bay选项
-        wait_and_click(bay_set)
-        bay_options = get_options_for_select(wait_bay_select)
-        bay_folder = bay_options[k].text.strip()
-        wait_and_click(bay_options[k])
+        if not select_option(bay_set, bay_folder, driver_enum):
+            print(f"找不到bay {bay_folder}，跳过")
+            return True
 
         # 处理Model选项
-        model_options, wait_model_select = get_options(model_set, False)
-        for model_option in model_options:
-            page = Page(product_folder, version_folder, bay_folder, model_option.text.strip())
-            page_list.append(page)
+        for model_folder in get_option_labels(model_set, driver_enum):
+            page = Page(product_folder, version_folder, bay_folder, model_folder)
+            pages.append(page)
             print(page)
-        wait_and_click(model_set)
         return True  # 成功处理
-    except IndexError:
-        print(f"捕获到list index out of range异常，直接返回True, index = {k}")
-        return True  # 捕获到list index out of range异常，直接返回True
     except Exception as e:
         print(f"处理过程中发生异常：{e}，将重试...")
         return False  # 发生异常，需要重试
 
 
-def scroll(element, wait_seconds, driver_scroll):
+def scroll(element, driver_scroll):
     driver_scroll.execute_script("arguments[0].scrollIntoView({behavior: 'smooth', block: 'center'});",
                                  element)
-    time.sleep(wait_seconds)
-
-
-def download_apps(operation_system, get_version, get_model):
-    driver_new = webdriver.Chrome(service=Service(ChromeDriverManager().install()))
-    driver_new.delete_all_cookies()
-    driver_new.set_window_size(1920, 1080)
-    driver_new.get(
-        f'https://www.qnap.com/en-us/app-center?os={operation_system}'
-        f'&version={get_version}'
-        f'&model={get_model}')
-    # 遍历下载列表并下载
-    # 等待item-container中的所有li元素加载完成
-    wait_for_items = WebDriverWait(driver_new, 3)
-    items = wait_for_items.until(
-        EC.presence_of_all_elements_located((By.CSS_SELECTOR, '.items-container li')))
-    for item in items:
-        arrow = item.find_element(By.CSS_SELECTOR, 'div.arrow')
-        # 滚动到arrow元素可见
-        scroll(arrow, 2, driver_new)
-        wait_arrow = WebDriverWait(driver_new, 5)
-        try:
-            wait_arrow.until(EC.element_to_be_clickable((By.CSS_SELECTOR, 'div.arrow')))
-            wait_arrow.until(EC.visibility_of_element_located((By.CSS_SELECTOR, 'div.arrow')))
-            driver_new.execute_script("arguments[0].click();", arrow)
-        except Exception as e:
-            print('failed:  ' + item.text.strip())
-            print(e)
-            continue
-        # 等待页面加载
-        wait_for_button_container = WebDriverWait(driver_new, 5)
-        # 定位到包含下载链接的div容器
-        button_container = (wait_for_button_container
-                            .until(EC.presence_of_element_located((By.XPATH, '//div[@class="d-flex '
-                                                                             'flex-wrap '
-                                                                             'justify-content-center '
-                                                                             'qnap-bs-btn-container '
-                                                                             'dark-bg '
-                                                                             'justify-content-xl-end"]'))))
-
-        # 在容器中找到所有的a标签
-        links = button_container.find_elements(By.TAG_NAME, 'a')
-
-        # 从这些a标签中找到下载链接
-        download_link = None
-        if 'btn-bs-arrow--secondary' in links[-1].get_attribute('class'):
-            download_link = links[-1]
-
-        # 获取下载链接的URL
-        if download_link:
-            download_url = download_link.get_attribute('href')
-            # 构造下载路径
-            folder_name = page.get_file_path(download_path)
-            os.makedirs(folder_name, exist_ok=True)
-            file_name = download_url.split('/')[-1]
-            local_file_path = os.path.join(folder_name, file_name)
-
-            existing_file_path = file_name_exists(file_name, download_path)
-            if existing_file_path != "":
-                print(f"文件名 {file_name} 已存在，创建软链接至{folder_name}。")
-                try:
-                    os.symlink(existing_file_path, local_file_path)  # 创建软链接
-                except FileExistsError:
-                    pass
-            else:
-                download_file(download_url, local_file_path)
-                release_link = None
-                release_url = "None"
-                if 'btn-bs-arrow--secondary-outline' in links[0].get_attribute('class'):
-                    release_link = links[0]
-                if release_link:
-                    release_url = release_link.get_attribute('href')
-
-                save_file_name(file_name, download_path, local_file_path, release_url)  # 记录文件名、路径和release链接
-        else:
-            print("Download link not found")
-        click_close_button()
-    driver_new.quit()
+    # 等待平滑滚动结束
+    wait_for_element_stable(driver_scroll, element, 'scroll')
 
 
-if __name__ == '__main__':
+def read_app_from_modal(item, driver_new):
+    # 打开应用的弹窗，读取下载链接和release链接
+    arrow = item.find_element(By.CSS_SELECTOR, 'div.arrow')
+    # 滚动到arrow元素可见
+    scroll(arrow, driver_new)
+    wait_arrow = WebDriverWait(driver_new, 5)
+    try:
+        wait_arrow.until(EC.element_to_be_clickable((By.CSS_SELECTOR, 'div.arrow')))
+        wait_arrow.until(EC.visibility_of_element_located((By.CSS_SELECTOR, 'div.arrow')))
+        driver_new.execute_script("arguments[0].click();", arrow)
+    except Exception as e:
+        print('failed:  ' + item.text.strip())
+        print(e)
+        return None
+    # 等待页面加载
+    wait_for_button_container = WebDriverWait(driver_new, 5)
+    # 定位到包含下载链接的div容器
+    button_container = (wait_for_button_container
+                        .until(EC.presence_of_element_located((By.XPATH, '//div[@class="d-flex '
+                                                                         'flex-wrap '
+                                                                         'justify-content-center '
+                                                                         'qnap-bs-btn-container '
+                                                                         'dark-bg '
+                                                                         'justify-content-xl-end"]'))))
+
+    # 在容器中找到所有的a标签
+    links = button_container.find_elements(By.TAG_NAME, 'a')
+
+    # 从这些a标签中找到下载链接
+    app_item = None
+    if 'btn-bs-arrow--secondary' in links[-1].get_attribute('class'):
+        release_url = "None"
+        if 'btn-bs-arrow--secondary-outline' in links[0].get_attribute('class'):
+            release_url = links[0].get_attribute('href')
+        app_item = AppItem(item.text.strip(), "", links[-1].get_attribute('href'), release_url)
+    else:
+        print("Download link not found")
+    click_close_button(driver_new)
+    return app_item
+
+
+def list_apps(page, driver_new):
+    """
+    先用一次脚本调用读取页面中所有应用的链接，只有数据不在DOM中的应用才逐个打开弹窗读取。
+    """
+    with metrics.timer('page_load'):
+        driver_new.get(page.get_url())
+        # 等待item-container中的所有li元素加载完成
+        wait_for_items = WebDriverWait(driver_new, 3)
+        items = wait_for_items.until(
+            EC.presence_of_all_elements_located((By.CSS_SELECTOR, '.items-container li')))
+    with metrics.timer('link_extraction'):
+        extracted = extract_listing(driver_new)
+    if len(extracted) != len(items):
+        # 脚本执行期间列表发生了变化，全部走弹窗
+        extracted = [None] * len(items)
+
+    app_items = []
+    missing = 0
+    for item, app_item in zip(items, extracted):
+        if app_item is None:
+            missing += 1
+            with metrics.timer('modal_open'):
+                app_item = read_app_from_modal(item, driver_new)
+        if app_item is not None:
+            app_items.append(app_item)
+    if missing:
+        print(f"页面 {page} 中 {missing}/{len(items)} 个应用通过弹窗读取")
+    return app_items
+
+
+def get_local_file_path(page, download_url):
+    return os.path.join(page.get_file_path(download_path), download_url.split('/')[-1])
+
+
+_download_changed = {}
+_download_changed_lock = threading.Lock()
+
+
+def download_changed(download_url):
+    # 增量模式下，保存过校验头且服务器确认内容已变化时返回True；每个链接在一次运行中只发一次HEAD请求
+    if snapshots is None:
+        return False
+    with _download_changed_lock:
+        changed = _download_changed.get(download_url)
+    if changed is None:
+        changed = bool(snapshots.conditional_headers(download_url)) and not snapshots.is_unchanged(download_url)
+        with _download_changed_lock:
+            _download_changed[download_url] = changed
+    return changed
+
+
+class DownloadJob:
+    def __init__(self, page, download_url, release_url):
+        self.page = page
+        self.download_url = download_url
+        self.release_url = release_url
+        self.file_name = download_url.split('/')[-1]
+        self.local_file_path = get_local_file_path(page, download_url)
+        self.created_at = time.time()
 
-    if len(sys.argv) < 2:
-        print("请提供下载路径作为参数。")
-        exit(1)
+    def __str__(self) -> str:
+        return f"DownloadJob(file_name={self.file_name}, page={self.page.get_key()})"
+
+
+_file_locks = {}
+_file_locks_lock = threading.Lock()
+
+
+def get_file_lock(file_name):
+    # 同名文件同一时间只允许一个线程下载
+    with _file_locks_lock:
+        return _file_locks.setdefault(file_name, threading.Lock())
+
+
+def plan_app(page, download_url, release_url):
+    """
+    已下载过的文件直接链接到页面目录并返回None，否则返回需要执行的DownloadJob。
+    """
+    # 构造下载路径
+    folder_name = page.get_file_path(download_path)
+    os.makedirs(folder_name, exist_ok=True)
+    file_name = download_url.split('/')[-1]
+    local_file_path = os.path.join(folder_name, file_name)
+
+    existing_file_path = file_name_exists(file_name, download_path)
+    if existing_file_path != "" and not download_changed(download_url) and \
+            open_blob_store(download_path).link_existing(existing_file_path, local_file_path):
+        print(f"文件名 {file_name} 已存在，链接至{folder_name}。")
+        mark_file_done(page, download_url)
+        return None
+    return DownloadJob(page, download_url, release_url)
+
+
+def mark_file_done(page, download_url, md5="", sha256=""):
+    # 链接已有文件时从下载记录中取摘要
+    if not sha256:
+        entry = open_ledger(download_path).find_by_name(download_url.split('/')[-1])
+        if entry:
+            md5, sha256 = entry.md5, entry.sha256
+    open_catalog(download_path).record_file(download_url, get_local_file_path(page, download_url), md5, sha256)
+    if journal is not None:
+        # 下载记录是批量写入的，先落盘，断点记录才不会领先于下载记录
+        open_ledger(download_path).flush()
+        journal.file_done(page.get_key(), download_url)
+
+
+def run_download_job(job):
+    """
+    执行下载任务，返回下载的字节数。
+    """
+    blob_store = open_blob_store(download_path)
+    with get_file_lock(job.file_name):
+        # 排队期间其他线程可能已经下载了同名文件
+        entry = open_ledger(download_path).find_by_name(job.file_name)
+        if entry and entry.created_at > job.created_at and \
+                blob_store.link_existing(entry.file_path, job.local_file_path):
+            print(f"文件名 {job.file_name} 已由其他任务下载，链接至{job.local_file_path}。")
+            mark_file_done(job.page, job.download_url)
+            return 0
+        result = scheduler.download_file(job.download_url, job.local_file_path,
+                                         quarantine_dir=os.path.join(download_path, QUARANTINE_DIR_NAME))
+        if not result:
+            return 0
+        blob_store.ingest(job.local_file_path, result.sha256)  # 收入内容存储，相同内容只保存一份
+        # 记录文件名、路径、release链接和摘要
+        save_file_name(job.file_name, download_path, job.local_file_path, job.release_url, job.download_url,
+                       result.md5, result.sha256)
+        mark_file_done(job.page, job.download_url, result.md5, result.sha256)
+    if snapshots is not None:
+        snapshots.save_validators(job.download_url, result.validators)
+        # 已下载最新内容，其他页面的同一链接直接链接即可
+        with _download_changed_lock:
+            _download_changed[job.download_url] = False
+    return result.size
+
+
+def save_app(page, download_url, release_url):
+    job = plan_app(page, download_url, release_url)
+    if job is not None:
+        run_download_job(job)
+
+
+def select_apps(page, app_items):
+    """
+    返回 (需要处理的应用, 增量模式下要保存的列表快照)。
+    """
+    if snapshots is None:
+        return list(app_items), None
+
+    # 增量模式：只处理新增和变化的应用，未变化的应用仅在本地缺失或文件内容变化时处理
+    diff, apps = snapshots.diff_listing(page.get_key(), app_items)
+    summary.record(page, diff)
+    selected = diff.added + diff.changed
+    for app_item in diff.unchanged:
+        if not os.path.exists(get_local_file_path(page, app_item.download_url)) or \
+                download_changed(app_item.download_url):
+            selected.append(app_item)
+    return selected, apps
+
+
+def process_listing(page, app_items, handle_app=save_app):
+    # handle_app(page, download_url, release_url) 负责处理单个应用，默认立即下载
+    open_catalog(download_path).replace_listing(page.to_tuple(), app_items)
+    selected, apps = select_apps(page, app_items)
+    if journal is not None:
+        # 先记下需要处理的文件，中断后可以只补做未完成的部分
+        journal.save_listing(page.get_key(), page.to_tuple(),
+                             [(app_item.download_url, app_item.release_url) for app_item in selected])
+    for app_item in selected:
+        handle_app(page, app_item.download_url, app_item.release_url)
+    if apps is not None:
+        snapshots.save_listing(page.get_key(), apps)
+
+
+def download_page(pool, page, fast_path=True, handle_app=save_app):
+    if journal is not None:
+        state = journal.page_state(page.get_key())
+        if state == PAGE_DONE:
+            return
+        if state == PAGE_LISTED:
+            # 上次已列出但未下载完，只处理剩下的文件
+            for download_url, release_url in journal.pending_files(page.get_key()):
+                handle_app(page, download_url, release_url)
+            return
+    if fast_path:
+        # 先尝试直接请求列表页解析，解析不了再用浏览器
+        url = page.get_url()
+        headers = snapshots.conditional_headers(url) if snapshots is not None else None
+        with metrics.timer('listing_fetch'):
+            status_code, validators, app_items = fetch_listing(url, headers=headers)
+        if status_code == 304 and snapshots is not None:
+            summary.record_not_modified()
+            if journal is not None:
+                journal.save_listing(page.get_key(), page.to_tuple(), [])
+            return
+        if app_items is not None:
+            process_listing(page, app_items, handle_app)
+            if snapshots is not None:
+                snapshots.save_validators(url, validators)
+            return
+        print(f"页面 {page} 无法直接解析，改用浏览器")
+    try:
+        with pool.driver() as driver_new:
+            app_items = list_apps(page, driver_new)
+    except Exception as e:
+        print(f"处理页面 {page} 失败：{e}")
+        return
+    process_listing(page, app_items, handle_app)
 
-    download_path = sys.argv[1] + '/app_center_download'
 
-    if not os.path.exists(download_path):
-        print(f"下载路径 {download_path} 不存在，正在创建...")
-        os.makedirs(download_path, exist_ok=True)
-    page_list = []
+def list_page(pool, page, submit, fast_path=True):
+    # 流水线的列表阶段：需要下载的文件作为任务交给下载阶段
+    def handle_app(app_page, download_url, release_url):
+        job = plan_app(app_page, download_url, release_url)
+        if job is not None:
+            submit(job)
+
+    download_page(pool, page, fast_path, handle_app)
+
+
+def open_enumeration_page(driver_enum):
+    # 访问页面，返回 product、version、bay、model 四个下拉框
+    driver_enum.get(ENUMERATION_URL)
+    return wait_for_search_sets(driver_enum)[:4]
+
 
-    # 设置Selenium WebDriver
-    chrome_options = Options()
-    chrome_options.add_argument("--incognito")  # 使用无痕模式
-    driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=chrome_options)
-    driver.set_window_size(1920, 1080)  # 设置窗口大小为1920x1080
-    download_center_url = 'https://www.qnap.com/en-us/app-center?os=qts&version=5.2.1'
+def get_option_labels(set, driver_enum):
+    # 打开下拉框，用一次脚本读取所有选项的文字后关闭
+    open_menu(set, driver_enum)
+    labels = driver_enum.execute_script(OPTION_LABELS_SCRIPT, MENU_SELECTOR) or []
+    wait_and_click(set, driver_enum)
+    return labels
 
-    # 访问页面
-    driver.get(download_center_url)
 
-    search_sets = wait_for_search_sets()
+def select_option(set, label, driver_enum):
+    # 打开下拉框并按文字选择选项，找不到时关闭下拉框并返回False
+    open_menu(set, driver_enum)
+    if driver_enum.execute_script(SELECT_OPTION_SCRIPT, MENU_SELECTOR, label):
+        return True
+    wait_and_click(set, driver_enum)
+    return False
 
-    product_set = search_sets[0]
-    version_set = search_sets[1]
-    bay_set = search_sets[2]
-    model_set = search_sets[3]
 
-    # Product
-    product_options, wait_product_select = get_options(product_set, True)
+def list_shards(driver_enum, products=None, by_version=False):
+    """
+    返回需要遍历的分片列表 [(product, version)]，version为None表示整个product。
+    """
+    product_set, version_set, _, _ = open_enumeration_page(driver_enum)
+    product_labels = get_option_labels(product_set, driver_enum)
+    shards = []
+    for product_folder in product_labels:
+        if products is not None and product_folder not in products:
+            continue
+        if not by_version:
+            shards.append((product_folder, None))
+            continue
+        select_option(product_set, product_folder, driver_enum)
+        version_labels = get_option_labels(version_set, driver_enum)
+        shards.extend((product_folder, version_folder) for version_folder in version_labels)
+    return shards
+
+
+def enumerate_shard(pool, product_folder, version=None):
+    """
+    在独立的浏览器会话中遍历一个product（或product下的一个version）的 version → bay → model。
+    """
+    pages = []
+    with pool.driver() as driver_enum, metrics.timer('enumerate_shard'):
+        product_set, version_set, bay_set, model_set = open_enumeration_page(driver_enum)
 
-    # 依次点击选择所有product_option
-    for i in range(len(product_options)):
-        # 打开product下拉框
-        wait_and_click(product_set)
-        product_options = get_options_for_select(wait_product_select)
-        product_folder = product_options[i].text.strip()
-        wait_and_click(product_options[i])
+        # Product
+        if not select_option(product_set, product_folder, driver_enum):
+            print(f"找不到product {product_folder}，跳过")
+            return pages
 
         # Version
-        version_options, wait_version_select = get_options(version_set, True)
-        for j in range(len(version_options)):
-            wait_and_click(version_set)
-            version_options = get_options_for_select(wait_version_select)
-            version_folder = version_options[j].text.strip()
-            wait_and_click(version_options[j])
+        version_labels = get_option_labels(version_set, driver_enum)
+        if version is not None:
+            version_labels = [version_folder for version_folder in version_labels if version_folder == version]
+        for version_folder in version_labels:
+            if not select_option(version_set, version_folder, driver_enum):
+                # 否则会在上一个version的选择下遍历bay，把页面记到错误的version下
+                print(f"找不到version {product_folder} {version_folder}，跳过")
+                continue
             try:
                 # Bay
-                bay_options, wait_bay_select = get_options(bay_set, True)
+                bay_labels = get_option_labels(bay_set, driver_enum)
             except Exception as e:
                 print("get bays failed! continue...")
                 print(e)
                 continue
 
-            if len(bay_options) > 0:
-                for k in range(len(bay_options)):
-                    # 重试逻辑
-                    max_retries = 3  # 设置最大重试次数
-                    retry_count = 0
-                    while retry_count < max_retries:
-                        if process_bay_and_model(bay_set, model_set, product_folder, version_folder, wait_bay_select,
-                                                 k):
-                            break  # 如果处理成功，退出循环
-                        retry_count += 1
-                        if retry_count == max_retries:
-                            print(f"处理Bay选项 {k} 时已达到最大重试次数，放弃处理。")
-                            break  # 达到最大重试次数，退出循环
-    driver.quit()
-    time.sleep(5)
-
-    # 依次访问所有页面 遍历下载其中内容
-    for page in page_list:
-        download_apps(page.get_operation_system(), page.get_version(), page.get_model())
+            for bay_folder in bay_labels:
+                # 重试逻辑
+                max_retries = 3  # 设置最大重试次数
+                retry_count = 0
+                while retry_count < max_retries:
+                    if process_bay_and_model(bay_set, model_set, product_folder, version_folder, bay_folder,
+                                             pages, driver_enum):
+                        break  # 如果处理成功，退出循环
+                    retry_count += 1
+                    if retry_count == max_retries:
+                        print(f"处理Bay选项 {bay_folder} 时已达到最大重试次数，放弃处理。")
+                        break  # 达到最大重试次数，退出循环
+    return pages
+
+
+def iter_pages(pool, products=None, workers=1, by_version=False):
+    """
+    依次点击 product → version → bay → model 下拉框，逐个产出Page。
+    按product（by_version时按product+version）分片，每个分片在各自的浏览器会话中并行遍历，
+    哪个分片先完成就先产出其结果，并去除重复的Page。products不为None时只遍历其中列出的product。
+    """
+    with pool.driver() as driver_enum:
+        shards = list_shards(driver_enum, products, by_version)
+    print(f"共 {len(shards)} 个分片，使用 {workers} 个浏览器并行遍历")
+
+    seen = set()
+    if journal is not None:
+        # 上次已遍历完的分片直接使用记录的页面
+        done = [(product_folder, version) for product_folder, version in shards
+                if journal.is_shard_done(product_folder, version)]
+        if done:
+            print(f"{len(done)} 个分片已在上次运行中遍历完成，跳过")
+        for product_folder, version in done:
+            for page in journal.shard_pages(product_folder, version):
+                if page not in seen:
+                    seen.add(page)
+                    yield Page(*page)
+        shards = [shard for shard in shards if shard not in done]
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(enumerate_shard, pool, product_folder, version): (product_folder, version)
+                   for product_folder, version in shards}
+        for future in as_completed(futures):
+            product_folder, version = futures[future]
+            try:
+                shard_pages = future.result()
+            except Exception as e:
+                print(f"遍历分片 {product_folder} {version or ''} 失败：{e}")
+                continue
+            if journal is not None:
+                journal.save_shard(product_folder, version, [page.to_tuple() for page in shard_pages])
+            for page in shard_pages:
+                if page.to_tuple() not in seen:
+                    seen.add(page.to_tuple())
+                    yield page
+
+
+def enumerate_pages(pool, products=None, workers=1, by_version=False):
+    return list(iter_pages(pool, products, workers, by_version))
+
+
+def iter_and_cache_pages(pool, page_cache, workers, by_version):
+    # 边遍历边产出，遍历完整结束后写入页面缓存
+    pages = []
+    for page in iter_pages(pool, None, workers, by_version):
+        pages.append(page)
+        yield page
+    page_cache.replace([page.to_tuple() for page in pages])
+    page_cache.save()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', help='下载路径')
+    parser.add_argument('--workers', type=int, default=DEFAULT_POOL_SIZE, help='同时处理页面的浏览器数量')
+    parser.add_argument('--max-uses', type=int, default=DEFAULT_MAX_USES, help='每个浏览器会话使用多少次后重建')
+    parser.add_argument('--no-fast-path', action='store_true', help='不直接请求列表页，全部使用浏览器')
+    parser.add_argument('--incremental', action='store_true', help='增量抓取：只处理与上次运行相比有变化的列表和文件')
+    parser.add_argument('--refresh-pages', action='store_true', help='忽略页面缓存，重新遍历全部下拉框')
+    parser.add_argument('--refresh-product', action='append', help='只重新遍历指定product的下拉框，可多次指定')
+    parser.add_argument('--page-cache-ttl', type=float, default=DEFAULT_TTL_HOURS, help='页面缓存有效期（小时）')
+    parser.add_argument('--enum-workers', type=int, default=DEFAULT_POOL_SIZE, help='并行遍历下拉框的浏览器数量')
+    parser.add_argument('--shard-by-version', action='store_true', help='按product+version分片遍历，默认按product')
+    parser.add_argument('--pipeline', action='store_true', help='流水线模式：遍历、列表、下载同时进行')
+    parser.add_argument('--download-workers', type=int, default=DEFAULT_WORKERS, help='流水线模式下的下载线程数')
+    parser.add_argument('--page-queue-size', type=int, default=DEFAULT_PAGE_QUEUE_SIZE, help='流水线页面队列长度')
+    parser.add_argument('--resume', action='store_true', help='从上次中断处继续，跳过已完成的分片、页面和文件')
+    parser.add_argument('--host-rate', type=float, default=DEFAULT_RATE, help='每个host的初始请求速率（次/秒）')
+    parser.add_argument('--host-concurrency', type=int, default=DEFAULT_CONCURRENCY, help='每个host初始同时下载的文件数')
+    parser.add_argument('--metrics-dir', help='Prometheus textfile和JSON运行报告的输出目录，默认为下载目录')
+    parser.add_argument('--profile', action='store_true', help='按阶段用cProfile采样，结果保存在输出目录的profiles中')
+    args = parser.parse_args()
+
+    download_path = args.path + '/app_center_download'
+
+    if not os.path.exists(download_path):
+        print(f"下载路径 {download_path} 不存在，正在创建...")
+        os.makedirs(download_path, exist_ok=True)
+    snapshots = SnapshotStore(download_path) if args.incremental else None
+    summary = CrawlSummary()
+    journal = CrawlJournal(download_path)
+    if args.resume:
+        journal.print_progress()
+    else:
+        journal.reset()
+    metrics_dir = args.metrics_dir or download_path
+    scheduler.configure(args.host_rate, args.host_concurrency)
+    scheduler.install()
+    if args.profile:
+        metrics.enable_profiling(os.path.join(metrics_dir, PROFILE_DIR_NAME))
+
+    # 下拉框遍历和页面处理共用同一组常驻浏览器
+    pool_size = args.workers + args.enum_workers if args.pipeline else max(args.workers, args.enum_workers)
+    with DriverPool(size=pool_size, max_uses=args.max_uses, incognito=True) as pool:
+        page_cache = PageCache(download_path, args.page_cache_ttl)
+        full_enumeration = args.refresh_pages or not page_cache.is_fresh()
+        refresh_product = args.refresh_product
+        if refresh_product and full_enumeration:
+            # 缓存为空或已过期时，只刷新指定product会让其余product漏掉或沿用过期的列表
+            print("页面缓存为空、已过期或指定了 --refresh-pages，--refresh-product 改为完整遍历所有product")
+            refresh_product = None
+        if full_enumeration:
+            def page_source():
+                return iter_and_cache_pages(pool, page_cache, args.enum_workers, args.shard_by_version)
+        else:
+            if refresh_product:
+                # 只刷新指定product的子树，其余沿用缓存
+                refreshed = enumerate_pages(pool, set(refresh_product), args.enum_workers, args.shard_by_version)
+                for product in refresh_product:
+                    page_cache.update_product(product, [page.to_tuple() for page in refreshed
+                                                        if page.get_operation_system() == product])
+                page_cache.save()
+                print(f"已重新遍历 {', '.join(refresh_product)}，"
+                      f"其余product使用 {page_cache.age_hours():.1f} 小时前缓存的页面列表")
+            else:
+                print(f"使用 {page_cache.age_hours():.1f} 小时前缓存的页面列表，跳过下拉框遍历")
+
+            def page_source():
+                return (Page(*page) for page in page_cache.pages())
+
+        if args.pipeline:
+            # 遍历、列表、下载三个阶段同时进行
+            CrawlPipeline(page_source,
+                          lambda page, submit: list_page(pool, page, submit, not args.no_fast_path),
+                          run_download_job, args.workers, args.download_workers,
+                          page_queue_size=args.page_queue_size).run()
+        else:
+            page_list = list(page_source())
+
+            # 多个常驻浏览器并发访问所有页面 遍历下载其中内容
+            with ThreadPoolExecutor(max_workers=args.workers) as executor:
+                futures = {executor.submit(download_page, pool, page, not args.no_fast_path): page
+                           for page in page_list}
+                for future in as_completed(futures):
+                    try:
+                        future.result()
+                    except Exception as e:
+                        print(f"处理页面 {futures[future]} 失败：{e}")
+    if snapshots is not None:
+        summary.print_summary()
+    wait_stats.print_report()
+    scheduler.print_status()
+    metrics.print_report()
+    metrics.write(metrics_dir)
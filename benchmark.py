@@ -0,0 +1,203 @@
+# benchmark.py
+import argparse
+import hashlib
+import json
+import os
+import tarfile
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app_listing import fetch_listing
+from devide_qpkg import batch_extract, output_folder
+from download_list import fetch_download_list
+from downloader import download_file
+from fixture_site import add_site_arguments, site_from_args, build_qpkg
+from host_scheduler import scheduler
+from metrics import metrics
+from qpkg_archive import QpkgArchive, normalize_name, open_qpkg_index
+
+DEFAULT_WORKERS = 8
+DEFAULT_FILES = 32
+
+
+class BenchResult:
+    def __init__(self, name, count, seconds, nbytes=0, unit='页'):
+        self.name = name
+        self.count = count
+        self.seconds = seconds
+        self.nbytes = nbytes
+        self.unit = unit
+
+    def per_second(self):
+        return self.count / self.seconds if self.seconds else 0.0
+
+    def mb_per_second(self):
+        return self.nbytes / 1024 / 1024 / self.seconds if self.seconds else 0.0
+
+    def to_dict(self):
+        return {'name': self.name, 'count': self.count, 'seconds': self.seconds, 'bytes': self.nbytes,
+                'per_second': self.per_second(), 'mb_per_second': self.mb_per_second()}
+
+    def __str__(self) -> str:
+        text = f"{self.name:<20} {self.count:>6} {self.unit}  {self.seconds:>8.2f} 秒  {self.per_second():>8.1f} {self.unit}/s"
+        if self.nbytes:
+            text += f"  {self.mb_per_second():>8.1f} MB/s"
+        return text
+
+
+def timed(name, func, items, workers, unit='页'):
+    # 并发执行func(item)，func返回处理的字节数
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        nbytes = sum(executor.map(func, items))
+    return BenchResult(name, len(items), time.monotonic() - start, nbytes, unit)
+
+
+def bench_listing_http(site, workers):
+    def fetch(page):
+        product, version, _, model = page
+        status_code, _, app_items = fetch_listing(site.listing_url(product, version, model))
+        if status_code != 200 or app_items is None:
+            raise RuntimeError(f"解析列表页失败：{page}")
+        return 0
+
+    return timed('listing_http', fetch, site.pages(), workers)
+
+
+def bench_download_list_http(site, workers):
+    def fetch(item):
+        model, category = item
+        if fetch_download_list(f'{site.download_center_url()}?model={model}&category={category}') is None:
+            raise RuntimeError(f"解析下载列表失败：{item}")
+        return 0
+
+    items = [(model, category) for bay in site.bays for model in site.models(bay)
+             for category in ('firmware', 'utility')]
+    return timed('download_list_http', fetch, items, workers)
+
+
+def bench_download(site, workers, files, folder_path, scheduled=False):
+    names = sorted({app['download_url'] for page in site.pages()
+                    for app in site.list_apps(page[0], page[1], page[3])})[:files]
+    download_func = scheduler.download_file if scheduled else download_file
+
+    def download(url):
+        result = download_func(url, os.path.join(folder_path, url.split('/')[-1]))
+        if not result:
+            raise RuntimeError(f"下载失败：{url}")
+        return result.size
+
+    return timed('download_scheduled' if scheduled else 'download', download, names, workers, unit='个')
+
+
+def bench_qpkg(workers, files, folder_path, file_size):
+    """
+    生成QDK格式的安装包，每个安装包在两个型号目录下各出现一次，
+    测量批量提取和QpkgArchive读取，并与生成时的内容以及解压出的data.tar.gz逐一核对。
+    """
+    mirror_root = os.path.join(folder_path, 'mirror')
+    output_root = os.path.join(folder_path, 'extracted')
+    expected = {}
+    for i in range(files):
+        name = f'App{i:02d}'
+        data, members = build_qpkg(name, f'1.{i}.0', file_size)
+        for model in ('TS-231', 'TS-431'):
+            model_folder = os.path.join(mirror_root, 'QTS', '5.0', model)
+            os.makedirs(model_folder, exist_ok=True)
+            qpkg_file = os.path.join(model_folder, f'{name}_1.{i}.0_x86_64.qpkg')
+            with open(qpkg_file, 'wb') as file:
+                file.write(data)
+        expected[qpkg_file] = members
+    nbytes = sum(os.path.getsize(qpkg_file) for qpkg_file in expected)
+
+    start = time.monotonic()
+    if batch_extract(mirror_root, output_root, workers):
+        raise RuntimeError("批量提取失败")
+    results = [BenchResult('qpkg_extract', files, time.monotonic() - start, nbytes, unit='个')]
+
+    index = open_qpkg_index(mirror_root)
+
+    def read(qpkg_file):
+        with QpkgArchive(qpkg_file, index) as qpkg_archive:
+            for archive, members in expected[qpkg_file].items():
+                listed = qpkg_archive.members(archive)
+                if listed is None or sorted(member.name for member in listed) != \
+                        sorted(normalize_name(name) for name in members):
+                    raise RuntimeError(f"{qpkg_file} 的{archive}成员列表不一致")
+                for name, content in members.items():
+                    if qpkg_archive.read(name, archive) != content:
+                        raise RuntimeError(f"{qpkg_file} 中 {name} 的内容不一致")
+        return 0
+
+    results.append(timed('qpkg_read', read, list(expected), workers, unit='个'))
+    for qpkg_file, members in expected.items():
+        with open(qpkg_file, 'rb') as file:
+            sha256 = hashlib.sha256(file.read()).hexdigest()
+        target_folder = output_folder(output_root, qpkg_file, sha256)
+        with tarfile.open(os.path.join(target_folder, 'data.tar.gz')) as tar:
+            for name, content in members['data'].items():
+                if tar.extractfile(name).read() != content:
+                    raise RuntimeError(f"{target_folder} 中 {name} 的内容不一致")
+        for name, content in members['control'].items():
+            with open(os.path.join(target_folder, name), 'rb') as file:
+                if file.read() != content:
+                    raise RuntimeError(f"{target_folder} 中 {name} 的内容不一致")
+    return results
+
+
+def bench_browser(site, workers):
+    # 需要Chrome，按需导入
+    import appcenter_spider_pro as spider
+    from driver_pool import DriverPool
+
+    spider.APP_CENTER_URL = site.app_center_url()
+    spider.ENUMERATION_URL = f'{site.app_center_url()}?os={site.products[0]}&version={site.versions[0]}'
+    results = []
+    with DriverPool(size=workers, incognito=True) as pool:
+        start = time.monotonic()
+        pages = spider.enumerate_pages(pool, None, workers)
+        results.append(BenchResult('enumeration', len(pages), time.monotonic() - start))
+        if len(pages) != len(site.pages()):
+            print(f"遍历得到 {len(pages)} 个页面，期望 {len(site.pages())} 个")
+
+        def list_page(page):
+            with pool.driver() as driver:
+                spider.list_apps(page, driver)
+            return 0
+
+        results.append(timed('listing_browser', list_page, pages, workers))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='在离线模拟站点上测量遍历、列表和下载的吞吐')
+    add_site_arguments(parser)
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='并发数')
+    parser.add_argument('--files', type=int, default=DEFAULT_FILES, help='下载测试的文件数量')
+    parser.add_argument('--scheduled', action='store_true', help='下载经过按host的限速调度')
+    parser.add_argument('--browser', action='store_true', help='同时测量需要浏览器的下拉框遍历和弹窗列表')
+    parser.add_argument('--qpkg', action='store_true', help='同时测量QDK格式安装包的批量提取和按需读取，并核对内容')
+    parser.add_argument('--json', help='把结果写入JSON文件')
+    args = parser.parse_args()
+
+    with site_from_args(args) as site:
+        print(f"模拟站点：{site.base_url}，{len(site.pages())} 个型号页面")
+        results = [bench_listing_http(site, args.workers), bench_download_list_http(site, args.workers)]
+        with tempfile.TemporaryDirectory() as folder_path:
+            results.append(bench_download(site, args.workers, args.files, folder_path, args.scheduled))
+        if args.qpkg:
+            with tempfile.TemporaryDirectory() as folder_path:
+                results.extend(bench_qpkg(args.workers, args.files, folder_path, args.file_size))
+        if args.browser:
+            results.extend(bench_browser(site, args.workers))
+
+    print("基准测试结果：")
+    for result in results:
+        print(f"  {result}")
+    scheduler.print_status()
+    metrics.print_report()
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'site': vars(args), 'results': [result.to_dict() for result in results],
+                       'metrics': metrics.snapshot()}, file, ensure_ascii=False, indent=2)
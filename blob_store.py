@@ -0,0 +1,193 @@
+# blob_store.py
+import fcntl
+import hashlib
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+
+BLOB_DIR_NAME = '.blobs'
+BLOB_DB_NAME = 'blobs.db'
+HASH_CHUNK_SIZE = 1024 * 1024
+# linux/fs.h 中的 FICLONE，用于在 btrfs/xfs 上创建reflink
+FICLONE = 0x40049409
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS refs (
+    path TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_refs_sha256 ON refs (sha256);
+'''
+
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _reflink(src, dest):
+    with open(src, 'rb') as src_file, open(dest, 'wb') as dest_file:
+        fcntl.ioctl(dest_file.fileno(), FICLONE, src_file.fileno())
+
+
+class BlobStore:
+    """
+    按SHA-256内容寻址的文件存储。每份内容只写一次，各型号目录下的文件通过硬链接
+    （不支持时用reflink或复制）指向同一个blob；refs表记录每个路径引用的blob，
+    gc() 删除路径已不存在的引用以及引用数为0的blob。
+    """
+
+    def __init__(self, folder_path):
+        self.root = os.path.join(folder_path, BLOB_DIR_NAME)
+        os.makedirs(self.root, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(os.path.join(self.root, BLOB_DB_NAME), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+
+    def blob_path(self, sha256):
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def has(self, sha256):
+        return os.path.exists(self.blob_path(sha256))
+
+    def sha256_of(self, path):
+        row = self._conn.execute('SELECT sha256 FROM refs WHERE path = ?', (os.path.abspath(path),)).fetchone()
+        return row[0] if row else None
+
+    def put(self, src_path, sha256=None):
+        """
+        把src_path移入存储并返回其SHA-256；内容已存在时直接删除src_path。
+        """
+        sha256 = sha256 or file_sha256(src_path)
+        blob_path = self.blob_path(sha256)
+        with self._lock:
+            if os.path.exists(blob_path):
+                os.remove(src_path)
+            else:
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                shutil.move(src_path, blob_path)
+                os.chmod(blob_path, 0o444)  # blob被多处共享，设为只读
+            with self._conn:
+                self._conn.execute('INSERT OR IGNORE INTO blobs (sha256, size) VALUES (?, ?)',
+                                   (sha256, os.path.getsize(blob_path)))
+        return sha256
+
+    def link(self, sha256, dest_path):
+        """
+        让dest_path指向sha256对应的blob，并记录引用。
+        """
+        blob_path = self.blob_path(sha256)
+        dest_path = os.path.abspath(dest_path)
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        tmp_path = dest_path + '.link'
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        try:
+            os.link(blob_path, tmp_path)
+        except OSError:
+            try:
+                _reflink(blob_path, tmp_path)
+            except OSError:
+                shutil.copyfile(blob_path, tmp_path)
+        # 原子替换，旧的软链接或文件会被覆盖
+        os.replace(tmp_path, dest_path)
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO refs (path, sha256) VALUES (?, ?)', (dest_path, sha256))
+
+    def ingest(self, path, sha256=None):
+        """
+        把刚下载完成的文件收入存储，并在原位置换成指向blob的链接。
+        """
+        sha256 = self.put(path, sha256)
+        self.link(sha256, path)
+        return sha256
+
+    def link_existing(self, existing_path, dest_path):
+        """
+        把已有文件existing_path的内容链接到dest_path。
+        existing_path尚未收入存储时先收入；已不存在（如失效的软链接）时返回False。
+        """
+        sha256 = self.sha256_of(existing_path)
+        if sha256 is None or not self.has(sha256):
+            if not os.path.isfile(existing_path):
+                return False
+            real_path = os.path.realpath(existing_path)
+            sha256 = self.ingest(real_path)
+            if real_path != os.path.abspath(existing_path):
+                self.link(sha256, existing_path)
+        self.link(sha256, dest_path)
+        return True
+
+    def release(self, path):
+        path = os.path.abspath(path)
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM refs WHERE path = ?', (path,))
+        if os.path.lexists(path):
+            os.remove(path)
+
+    def gc(self, dry_run=False):
+        """
+        删除失效的引用和无人引用的blob，返回 (删除的引用数, 删除的blob数, 释放的字节数)。
+        """
+        removed_refs = 0
+        removed_blobs = 0
+        freed_bytes = 0
+        with self._lock:
+            stale = [path for path, in self._conn.execute('SELECT path FROM refs') if not os.path.exists(path)]
+            removed_refs = len(stale)
+            if not dry_run:
+                with self._conn:
+                    self._conn.executemany('DELETE FROM refs WHERE path = ?', [(path,) for path in stale])
+
+            referenced = {sha256 for sha256, in self._conn.execute('SELECT DISTINCT sha256 FROM refs')}
+            # 也会清理崩溃时已移入但未登记的blob
+            for dir_path, _, file_names in os.walk(self.root):
+                for file_name in file_names:
+                    if len(file_name) != 64 or file_name in referenced:
+                        continue
+                    blob_path = os.path.join(dir_path, file_name)
+                    removed_blobs += 1
+                    freed_bytes += os.path.getsize(blob_path)
+                    if not dry_run:
+                        os.remove(blob_path)
+                        with self._conn:
+                            self._conn.execute('DELETE FROM blobs WHERE sha256 = ?', (file_name,))
+        return removed_refs, removed_blobs, freed_bytes
+
+    def close(self):
+        self._conn.close()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def open_blob_store(folder_path) -> BlobStore:
+    key = os.path.abspath(folder_path)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = BlobStore(folder_path)
+            _stores[key] = store
+        return store
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: python blob_store.py <download_path> [--dry-run]")
+        sys.exit(1)
+
+    store = BlobStore(sys.argv[1])
+    dry_run = '--dry-run' in sys.argv[2:]
+    refs, blobs, freed = store.gc(dry_run)
+    print(f"{'(dry run) ' if dry_run else ''}删除失效引用 {refs} 个，blob {blobs} 个，释放 {freed / 1024 / 1024:.1f} MB")
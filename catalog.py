@@ -0,0 +1,271 @@
+# catalog.py
+import argparse
+import os
+import re
+import sqlite3
+import threading
+import time
+
+CATALOG_FILE_NAME = 'catalog.db'
+# 安装包文件名末尾的架构标记，较长的写在前面
+ARCHES = ('x86_64', 'x86_ce53xx', 'x86', 'arm_64', 'arm-x41', 'arm-x31', 'arm-x19', 'arm-x09', 'arm_al', 'arm64',
+          'aarch64', 'armv7', 'armv5')
+# 版本取最后一个分隔符之后的点分数字，例如 QVPN_3.1.0.0130
+VERSION_PATTERN = re.compile(r'^(?P<app>.+)[_-](?P<version>v?\d+(?:\.\d+)+[\w.\-]*)$', re.IGNORECASE)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS offers (
+    id INTEGER PRIMARY KEY,
+    category TEXT NOT NULL,
+    app TEXT NOT NULL,
+    name TEXT NOT NULL,
+    version TEXT NOT NULL,
+    version_key TEXT NOT NULL,
+    arch TEXT NOT NULL,
+    os TEXT NOT NULL,
+    os_version TEXT NOT NULL,
+    bay TEXT NOT NULL,
+    model TEXT NOT NULL,
+    url TEXT NOT NULL,
+    release_url TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    UNIQUE (model, os, os_version, bay, url)
+);
+CREATE INDEX IF NOT EXISTS idx_offers_app ON offers (app, arch, version_key);
+CREATE INDEX IF NOT EXISTS idx_offers_name ON offers (name);
+CREATE INDEX IF NOT EXISTS idx_offers_page ON offers (os, os_version, bay, model);
+CREATE INDEX IF NOT EXISTS idx_offers_model ON offers (model);
+CREATE INDEX IF NOT EXISTS idx_offers_url ON offers (url);
+CREATE TABLE IF NOT EXISTS files (
+    url TEXT PRIMARY KEY,
+    file_name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    md5 TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_files_sha256 ON files (sha256);
+CREATE INDEX IF NOT EXISTS idx_files_md5 ON files (md5);
+CREATE TABLE IF NOT EXISTS latest (
+    category TEXT NOT NULL,
+    app TEXT NOT NULL,
+    arch TEXT NOT NULL,
+    version_key TEXT NOT NULL,
+    version TEXT NOT NULL,
+    url TEXT NOT NULL,
+    release_url TEXT NOT NULL,
+    PRIMARY KEY (category, app, arch)
+);
+'''
+
+
+def parse_package_name(file_name):
+    """
+    从安装包文件名中解析 (应用, 版本, 架构)，例如 HybridBackup_3.0.1_x86_64.qpkg。
+    无法识别的部分为空字符串。
+    """
+    stem = os.path.splitext(file_name)[0]
+    arch = ""
+    for candidate in ARCHES:
+        for separator in ('_', '-'):
+            if stem.lower().endswith(separator + candidate):
+                arch = candidate
+                stem = stem[:-len(candidate) - 1]
+                break
+        if arch:
+            break
+    match = VERSION_PATTERN.match(stem)
+    if match:
+        return match.group('app'), match.group('version').lstrip('vV'), arch
+    return stem, "", arch
+
+
+def version_key(version):
+    # 数字部分补零后按字符串比较即为版本顺序
+    return '.'.join(f'{int(part):010d}' for part in re.findall(r'\d+', version))
+
+
+class Catalog:
+    """
+    镜像内容目录：offers表记录每个型号/系统版本提供的应用及链接，files表记录每个链接下载后的大小和摘要。
+    用于回答“哪些型号提供某个应用”“每个应用每种架构的最新版本”等问题，不必遍历目录。
+    latest表随写入维护每个应用每种架构的最新版本，查询时不需要扫描offers。
+    """
+
+    def __init__(self, folder_path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(folder_path, CATALOG_FILE_NAME), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+
+    def replace_listing(self, page, app_items, category='app'):
+        """
+        用一次列表的结果替换该页面的全部记录。page为 (os, os_version, bay, model)。
+        """
+        os_name, os_version, bay, model = page
+        now = time.time()
+        rows = []
+        for app_item in app_items:
+            app, version, arch = parse_package_name(app_item.download_url.split('/')[-1])
+            version = app_item.version or version
+            rows.append((category, app, app_item.name or app, version, version_key(version), arch, os_name,
+                         os_version, bay, model, app_item.download_url, app_item.release_url, now))
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM offers WHERE os = ? AND os_version = ? AND bay = ? AND model = ? '
+                               'AND category = ?', (os_name, os_version, bay, model, category))
+            self._insert_offers(rows)
+            self._refresh_latest()
+
+    def add_offer(self, category, url, bay, model, os_name="", os_version="", release_url="None", name=""):
+        app, version, arch = parse_package_name(url.split('/')[-1])
+        with self._lock, self._conn:
+            self._insert_offers([(category, app, name or app, version, version_key(version), arch, os_name,
+                                  os_version, bay, model, url, release_url, time.time())])
+
+    def _insert_offers(self, rows):
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO offers (category, app, name, version, version_key, arch, os, os_version, bay, '
+            'model, url, release_url, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        self._conn.executemany(
+            'INSERT INTO latest (category, app, arch, version_key, version, url, release_url) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (category, app, arch) DO UPDATE SET '
+            'version_key = excluded.version_key, version = excluded.version, url = excluded.url, '
+            'release_url = excluded.release_url WHERE excluded.version_key >= latest.version_key',
+            [(row[0], row[1], row[5], row[4], row[3], row[10], row[11]) for row in rows])
+
+    def _refresh_latest(self):
+        # 最新版本的链接已从所有型号中消失时，重新从offers中取该应用该架构的最新版本
+        stale = self._conn.execute('SELECT category, app, arch FROM latest WHERE NOT EXISTS '
+                                   '(SELECT 1 FROM offers WHERE offers.url = latest.url)').fetchall()
+        for key in stale:
+            self._conn.execute('DELETE FROM latest WHERE category = ? AND app = ? AND arch = ?', key)
+            self._conn.execute(
+                'INSERT INTO latest (category, app, arch, version_key, version, url, release_url) '
+                'SELECT category, app, arch, MAX(version_key), version, url, release_url FROM offers '
+                'WHERE category = ? AND app = ? AND arch = ? GROUP BY category, app, arch', key)
+
+    def record_file(self, url, file_path, md5="", sha256=""):
+        # 下载或链接完成后记录文件的大小和摘要
+        file_name = url.split('/')[-1]
+        size = os.path.getsize(file_path) if os.path.exists(file_path) else -1
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO files (url, file_name, size, md5, sha256, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (url, file_name, size, md5 or "", sha256 or "", time.time()))
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    # 查询
+
+    def models_for_app(self, app):
+        """
+        哪些型号和系统版本提供应用app（按安装包名或显示名称匹配）。
+        """
+        return self._query(
+            'SELECT DISTINCT os, os_version, bay, model, version, arch FROM offers '
+            'WHERE app = ? OR name = ? ORDER BY os, os_version, bay, model', (app, app))
+
+    def apps_for_model(self, model, os_name=None, os_version=None):
+        sql = 'SELECT DISTINCT os, os_version, app, version, arch, url FROM offers WHERE model = ?'
+        params = [model]
+        if os_name:
+            sql += ' AND os = ?'
+            params.append(os_name)
+        if os_version:
+            sql += ' AND os_version = ?'
+            params.append(os_version)
+        return self._query(sql + ' ORDER BY os, os_version, app', params)
+
+    def latest(self, app=None, arch=None, category='app'):
+        """
+        每个应用每种架构的最新版本及其链接、大小和摘要。
+        """
+        conditions = ['l.category = ?']
+        params = [category]
+        if app:
+            conditions.append('(l.app = ? OR l.app IN (SELECT app FROM offers WHERE name = ?))')
+            params += [app, app]
+        if arch is not None:
+            conditions.append('l.arch = ?')
+            params.append(arch)
+        return self._query(
+            'SELECT l.app, l.arch, l.version, l.url, f.size, f.sha256, l.release_url FROM latest l '
+            f'LEFT JOIN files f ON f.url = l.url WHERE {" AND ".join(conditions)} ORDER BY l.app, l.arch', params)
+
+    def find_by_hash(self, digest):
+        return self._query(
+            'SELECT f.url, f.file_name, f.size, f.md5, f.sha256, o.os, o.os_version, o.bay, o.model FROM files f '
+            'LEFT JOIN offers o ON o.url = f.url WHERE f.sha256 = ? OR f.md5 = ?', (digest, digest))
+
+    def stats(self):
+        return self._query(
+            'SELECT (SELECT COUNT(*) FROM offers) AS offers, (SELECT COUNT(DISTINCT app) FROM offers) AS apps, '
+            '(SELECT COUNT(DISTINCT model) FROM offers) AS models, (SELECT COUNT(*) FROM files) AS files, '
+            '(SELECT COALESCE(SUM(size), 0) FROM files WHERE size > 0) AS bytes')[0]
+
+    def close(self):
+        self._conn.close()
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def open_catalog(folder_path) -> Catalog:
+    key = os.path.abspath(folder_path)
+    with _catalogs_lock:
+        catalog = _catalogs.get(key)
+        if catalog is None:
+            catalog = Catalog(folder_path)
+            _catalogs[key] = catalog
+        return catalog
+
+
+def print_rows(rows):
+    if not rows:
+        print("没有结果")
+        return
+    columns = list(rows[0])
+    print('\t'.join(columns))
+    for row in rows:
+        print('\t'.join('' if row[column] is None else str(row[column]) for column in columns))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='查询镜像内容目录')
+    parser.add_argument('path', help='下载路径（catalog.db所在目录）')
+    commands = parser.add_subparsers(dest='command', required=True)
+    models_parser = commands.add_parser('models', help='哪些型号和系统版本提供某个应用')
+    models_parser.add_argument('app')
+    apps_parser = commands.add_parser('apps', help='某个型号提供的应用')
+    apps_parser.add_argument('model')
+    apps_parser.add_argument('--os', dest='os_name')
+    apps_parser.add_argument('--os-version')
+    latest_parser = commands.add_parser('latest', help='每个应用每种架构的最新版本')
+    latest_parser.add_argument('--app')
+    latest_parser.add_argument('--arch')
+    latest_parser.add_argument('--category', default='app')
+    hash_parser = commands.add_parser('hash', help='按SHA-256或MD5查找文件')
+    hash_parser.add_argument('digest')
+    commands.add_parser('stats', help='目录统计')
+    args = parser.parse_args()
+
+    catalog = Catalog(args.path)
+    start = time.monotonic()
+    if args.command == 'models':
+        rows = catalog.models_for_app(args.app)
+    elif args.command == 'apps':
+        rows = catalog.apps_for_model(args.model, args.os_name, args.os_version)
+    elif args.command == 'latest':
+        rows = catalog.latest(args.app, args.arch, args.category)
+    elif args.command == 'hash':
+        rows = catalog.find_by_hash(args.digest)
+    else:
+        rows = [catalog.stats()]
+    elapsed = time.monotonic() - start
+    print_rows(rows)
+    print(f"{len(rows)} 行，查询耗时 {elapsed * 1000:.1f} 毫秒")
@@ -0,0 +1,155 @@
+# crawl_journal.py
+import os
+import sqlite3
+import threading
+import time
+
+JOURNAL_FILE_NAME = 'crawl_journal.db'
+
+# 页面状态：已遍历 → 已列出需要处理的文件 → 文件全部完成
+PAGE_ENUMERATED = 'enumerated'
+PAGE_LISTED = 'listed'
+PAGE_DONE = 'done'
+FILE_PENDING = 'pending'
+FILE_DONE = 'done'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS shards (
+    shard_key TEXT PRIMARY KEY,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    page_key TEXT PRIMARY KEY,
+    shard_key TEXT NOT NULL,
+    product TEXT NOT NULL,
+    version TEXT NOT NULL,
+    bay TEXT NOT NULL,
+    model TEXT NOT NULL,
+    state TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_pages_shard ON pages (shard_key, seq);
+CREATE TABLE IF NOT EXISTS files (
+    page_key TEXT NOT NULL,
+    download_url TEXT NOT NULL,
+    release_url TEXT NOT NULL,
+    state TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (page_key, download_url)
+);
+CREATE INDEX IF NOT EXISTS idx_files_pending ON files (page_key, state);
+'''
+
+
+def shard_key(product, version=None):
+    return f"{product}/{version or ''}"
+
+
+class CrawlJournal:
+    """
+    记录抓取进度，中断后 --resume 可以跳过已完成的工作：
+    已遍历完的分片及其页面、每个页面需要处理的文件、每个文件是否已完成。
+    每次状态变化都在一个事务中提交，进程在任何时刻退出都不会留下半条记录。
+    """
+
+    def __init__(self, folder_path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(folder_path, JOURNAL_FILE_NAME), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=FULL')
+        self._conn.executescript(SCHEMA)
+
+    def reset(self):
+        with self._lock, self._conn:
+            for table in ('shards', 'pages', 'files'):
+                self._conn.execute(f'DELETE FROM {table}')
+
+    def progress(self):
+        with self._lock:
+            pages = dict(self._conn.execute('SELECT state, COUNT(*) FROM pages GROUP BY state').fetchall())
+            files = dict(self._conn.execute('SELECT state, COUNT(*) FROM files GROUP BY state').fetchall())
+            shards = self._conn.execute('SELECT COUNT(*) FROM shards').fetchone()[0]
+        return shards, pages, files
+
+    def print_progress(self):
+        shards, pages, files = self.progress()
+        print(f"断点记录：已遍历分片 {shards} 个，页面 {sum(pages.values())} 个"
+              f"（列出 {pages.get(PAGE_LISTED, 0)}，完成 {pages.get(PAGE_DONE, 0)}），"
+              f"文件完成 {files.get(FILE_DONE, 0)}，待处理 {files.get(FILE_PENDING, 0)}")
+
+    # 遍历
+
+    def is_shard_done(self, product, version=None):
+        with self._lock:
+            return self._conn.execute('SELECT 1 FROM shards WHERE shard_key = ?',
+                                      (shard_key(product, version),)).fetchone() is not None
+
+    def shard_pages(self, product, version=None):
+        with self._lock:
+            return self._conn.execute('SELECT product, version, bay, model FROM pages WHERE shard_key = ? '
+                                      'ORDER BY seq', (shard_key(product, version),)).fetchall()
+
+    def save_shard(self, product, version, pages):
+        """
+        分片遍历完成后，把其中的页面和分片完成标记在同一个事务中写入。
+        pages为 (product, version, bay, model) 的列表。
+        """
+        key = shard_key(product, version)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO pages (page_key, shard_key, product, version, bay, model, state, seq, '
+                'updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [('/'.join(page), key, *page, PAGE_ENUMERATED, seq, now) for seq, page in enumerate(pages)])
+            self._conn.execute('INSERT OR REPLACE INTO shards (shard_key, updated_at) VALUES (?, ?)', (key, now))
+
+    # 列表和下载
+
+    def page_state(self, page_key):
+        with self._lock:
+            row = self._conn.execute('SELECT state FROM pages WHERE page_key = ?', (page_key,)).fetchone()
+        return row[0] if row else None
+
+    def pending_files(self, page_key):
+        with self._lock:
+            return self._conn.execute('SELECT download_url, release_url FROM files WHERE page_key = ? AND state = ?',
+                                      (page_key, FILE_PENDING)).fetchall()
+
+    def save_listing(self, page_key, page, files):
+        """
+        记录页面需要处理的文件 [(download_url, release_url)]，没有文件时页面直接完成。
+        page为 (product, version, bay, model)。
+        """
+        now = time.time()
+        state = PAGE_LISTED if files else PAGE_DONE
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO files (page_key, download_url, release_url, state, updated_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                [(page_key, download_url, release_url, FILE_PENDING, now) for download_url, release_url in files])
+            self._upsert_page(page_key, page, state, now)
+
+    def file_done(self, page_key, download_url):
+        # 文件完成后，页面没有待处理的文件时标记为完成
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute('UPDATE files SET state = ?, updated_at = ? WHERE page_key = ? AND download_url = ?',
+                               (FILE_DONE, now, page_key, download_url))
+            pending = self._conn.execute('SELECT 1 FROM files WHERE page_key = ? AND state = ? LIMIT 1',
+                                         (page_key, FILE_PENDING)).fetchone()
+            if pending is None:
+                self._conn.execute('UPDATE pages SET state = ?, updated_at = ? WHERE page_key = ?',
+                                   (PAGE_DONE, now, page_key))
+
+    def _upsert_page(self, page_key, page, state, now):
+        updated = self._conn.execute('UPDATE pages SET state = ?, updated_at = ? WHERE page_key = ?',
+                                     (state, now, page_key)).rowcount
+        if not updated:
+            # 来自页面缓存的页面没有遍历记录
+            self._conn.execute(
+                'INSERT INTO pages (page_key, shard_key, product, version, bay, model, state, seq, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', (page_key, "", *page, state, 0, now))
+
+    def close(self):
+        self._conn.close()
@@ -1,7 +1,109 @@
+import argparse
+import mmap
 import re
+import shutil
 import sys
 import os
 import subprocess
+import tarfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from blob_store import BLOB_DIR_NAME, file_sha256, open_blob_store
+
+HEADER_SCRIPT_NAME = 'header_script.sh'
+EXIT_MARKER = b'exit 1'
+# header中记录脚本长度的变量，脚本之后是控制包和数据包
+SCRIPT_LEN_PATTERN = re.compile(rb'script_len=(\d+)')
+# 找不到script_len时只在文件开头这么多字节内寻找脚本结尾
+HEADER_SCAN_LIMIT = 1024 * 1024
+
+# header脚本中的变量赋值，例如 script_len=2863、offset=$(/usr/bin/expr $script_len + 20480)
+NUMBER_PATTERN = re.compile(r'^(\w+)=(\d+)$')
+EXPR_PATTERN = re.compile(r'^(\w+)=\$\((?:/usr/bin/)?expr \$(\w+) \+ (\d+)\)$')
+ARITH_PATTERN = re.compile(r'^(\w+)=\$\(\(\s*\$?(\w+)\s*\+\s*(\d+)\s*\)\)$')
+MKDIR_PATTERN = re.compile(r'^(?:/bin/)?mkdir -p "?\$_EXTRACT_DIR"?$')
+# dd的参数，例如 bs=$offset、skip=1、count=3478、of=$_EXTRACT_DIR/data.tar.gz
+DD_ARG_PATTERN = re.compile(r'\b(bs|skip|count|of)=(\S+)')
+TAR_COMPRESSION = {'z': 'gz', 'j': 'bz2', 'J': 'xz'}
+# 复制数据段时每次复制的字节数
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+# 与GNU tar的默认行为一致：去掉开头的/，拒绝解压到目标文件夹之外
+EXTRACT_FILTER = {'filter': 'tar'} if hasattr(tarfile, 'tar_filter') else {}
+QPKG_SUFFIX = '.qpkg'
+# 批量提取时写在输出文件夹中的源文件摘要，与源文件一致时跳过
+SOURCE_HASH_NAME = '.qpkg_sha256'
+# 计算摘要的线程数
+HASH_WORKERS = 8
+
+
+class QpkgSection:
+    """
+    header脚本中一条dd命令对应的一段数据。
+    kind为'control'时这一段是包着控制包的tar，解压到目标文件夹；为'file'时原样写到目标文件夹中的name。
+    length为None表示一直到文件结尾。
+    """
+
+    def __init__(self, kind, offset, length=None, name="", compression=""):
+        self.kind = kind
+        self.offset = offset
+        self.length = length
+        self.name = name
+        self.compression = compression
+
+    def __str__(self) -> str:
+        return f"QpkgSection(kind={self.kind}, offset={self.offset}, length={self.length}, name={self.name})"
+
+
+class QpkgLayout:
+    def __init__(self, script_len, sections):
+        self.script_len = script_len
+        self.sections = sections
+
+    def section(self, kind):
+        return next((section for section in self.sections if section.kind == kind), None)
+
+    def __str__(self) -> str:
+        sections = ', '.join(str(section) for section in self.sections)
+        return f"QpkgLayout(script_len={self.script_len}, sections=[{sections}])"
+
+
+def map_qpkg(qpkg_file):
+    """
+    以只读方式映射qpkg文件，读取哪部分才会载入哪部分，内存占用与文件大小无关。
+    """
+    with open(qpkg_file, 'rb') as file:
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def find_header_end(mapped):
+    """
+    返回header脚本的结尾位置（包括'exit 1'及其后的换行符），找不到时返回-1。
+    只在脚本所在的开头部分从后往前寻找，不会扫描后面的压缩数据。
+    """
+    match = SCRIPT_LEN_PATTERN.search(mapped, 0, min(len(mapped), HEADER_SCAN_LIMIT))
+    bound = min(len(mapped), int(match.group(1)) if match else HEADER_SCAN_LIMIT)
+    exit_index = mapped.rfind(EXIT_MARKER, 0, bound)
+    if exit_index == -1:
+        return -1
+    return min(exit_index + len(EXIT_MARKER) + 1, len(mapped))
+
+
+def read_layout(mapped):
+    """
+    直接从映射中解析header脚本的布局，不写出header_script.sh；找不到或无法解析时返回None。
+    """
+    header_end = find_header_end(mapped)
+    if header_end == -1:
+        return None
+    return parse_layout(mapped[:header_end].decode('utf-8', errors='ignore'))
+
+
+def script_section(header_script_content):
+    # 截取‘script_len’及其之后，最后一个‘offset=’之前的内容，即提取控制包和数据包的命令
+    script_len_end_index = header_script_content.find('script_len')
+    last_offset_start_index = header_script_content.rfind('offset=')
+    return header_script_content[script_len_end_index:last_offset_start_index - 1]
 
 
 def extract_header_script(qpkg_file, target_folder):
@@ -9,61 +111,361 @@ def extract_header_script(qpkg_file, target_folder):
     if not os.path.exists(target_folder):
         os.makedirs(target_folder)
 
-    # 读取qpkg文件内容
-    with open(qpkg_file, 'r', errors='ignore') as file:
-        content = file.read()
-
-    # 从后往前寻找‘exit 1’，提取header_script.sh
-    exit_index = content.rfind('exit 1')
-    if exit_index != -1:
-        # 包括 'exit 1' 在内的所有内容都是 header_script.sh
-        header_script_content = content[:exit_index + 7]
-        with open(os.path.join(target_folder, 'header_script.sh'), 'w') as header_script_file:
-            header_script_file.write(header_script_content)
-    else:
-        print("Error: 'exit 1' not found in the qpkg file.")
-        sys.exit(1)
+    try:
+        mapped = map_qpkg(qpkg_file)
+    except ValueError:
+        # 空文件无法映射
+        print(f"Error: 'exit 1' not found in {qpkg_file}.")
+        return False
 
+    with mapped:
+        # 从脚本结尾往前寻找‘exit 1’，提取header_script.sh
+        header_end = find_header_end(mapped)
+        if header_end != -1:
+            # 包括 'exit 1' 在内的所有内容都是 header_script.sh，按原始字节写出
+            with open(os.path.join(target_folder, HEADER_SCRIPT_NAME), 'wb') as header_script_file:
+                header_script_file.write(memoryview(mapped)[:header_end])
+            return True
+        print(f"Error: 'exit 1' not found in {qpkg_file}.")
+        return False
 
-def process_and_execute_header_script(qpkg_file, target_folder):
-    # 读取header_script.sh
-    with open(os.path.join(target_folder, 'header_script.sh'), 'r') as header_script_file:
-        header_script_content = header_script_file.read()
 
-    # 获取‘script_len’的开始索引
-    script_len_end_index = header_script_content.find('script_len')
+def parse_layout(header_script_content):
+    """
+    从header脚本中解析script_len、各个offset以及每条dd命令对应的数据段。
+    只认识QDK生成的dd/tar命令，遇到其他命令时返回None，由调用方改用shell执行。
+    """
+    variables = {}
 
-    # 获取最后一个‘offset=’的开始索引
-    last_offset_start_index = header_script_content.rfind('offset=')
+    def value(token):
+        token = token.strip('"{}')
+        if token.startswith('$'):
+            return variables.get(token.lstrip('${').rstrip('}'))
+        return int(token) if token.isdigit() else None
+
+    sections = []
+    for line in script_section(header_script_content).splitlines():
+        line = line.strip()
+        if line.endswith('|| exit 1'):
+            line = line[:-len('|| exit 1')].strip()
+        if not line or line.startswith('#') or MKDIR_PATTERN.match(line):
+            # 目标文件夹在提取header时已经创建
+            continue
+        match = NUMBER_PATTERN.match(line)
+        if match:
+            variables[match.group(1)] = int(match.group(2))
+            continue
+        match = EXPR_PATTERN.match(line) or ARITH_PATTERN.match(line)
+        if match:
+            base = variables.get(match.group(2))
+            if base is None:
+                return None
+            variables[match.group(1)] = base + int(match.group(3))
+            continue
+        section = parse_dd_pipeline(line, value)
+        if section is None:
+            return None
+        sections.append(section)
+
+    if 'script_len' not in variables or not sections:
+        return None
+    return QpkgLayout(variables['script_len'], sections)
+
+
+def parse_dd_pipeline(line, value):
+    """
+    解析一条从 "${0}" 读取的dd管道，返回对应的QpkgSection，无法识别时返回None。
+    """
+    commands = [command.strip() for command in line.split('|')]
+    if 'if="${0}"' not in commands[0] or not commands[0].split()[0].endswith('dd'):
+        return None
+    args = dict(DD_ARG_PATTERN.findall(commands[0]))
+    block_size = value(args.get('bs', '512'))
+    skip = value(args.get('skip', '0'))
+    if block_size is None or skip is None:
+        return None
+    offset = block_size * skip
+    length = block_size * value(args['count']) if 'count' in args and value(args['count']) is not None else None
+
+    # /bin/cat只是原样传递
+    commands = [command for command in commands[1:] if command.split()[0] not in ('cat', '/bin/cat')]
+    if not commands:
+        return None
+    program = commands[0].split()[0]
+    if program.endswith('dd') and len(commands) == 1:
+        # ... | dd bs=1024 count=3478 of=$_EXTRACT_DIR/data.tar.gz
+        args = dict(DD_ARG_PATTERN.findall(commands[0]))
+        if 'of' not in args or not args['of'].startswith('$_EXTRACT_DIR/'):
+            return None
+        if 'count' in args:
+            count_size = value(args.get('bs', '512'))
+            count = value(args['count'])
+            if count_size is None or count is None:
+                return None
+            length = count_size * count if length is None else min(length, count_size * count)
+        return QpkgSection('file', offset, length, args['of'][len('$_EXTRACT_DIR/'):])
+    if program.endswith('tar') and len(commands) == 2 and '-xO' in commands[0].split() \
+            and commands[1].split()[0].endswith('tar') and '$_EXTRACT_DIR' in commands[1]:
+        # ... | tar -xO | tar -xzv -C $_EXTRACT_DIR
+        flags = commands[1].split()[1].lstrip('-')
+        compression = next((TAR_COMPRESSION[flag] for flag in flags if flag in TAR_COMPRESSION), "")
+        return QpkgSection('control', offset, length, compression=compression)
+    return None
+
+
+def copy_range(mapped, source_fd, offset, length, target_path):
+    """
+    把qpkg文件中 [offset, offset + length) 的数据写到target_path。
+    优先在内核中复制（copy_file_range/sendfile），不经过Python的缓冲区；都不支持时从映射中分块写出。
+    """
+    end = len(mapped) if length is None else min(len(mapped), offset + length)
+    with open(target_path, 'wb') as target_file:
+        target_fd = target_file.fileno()
+        position = offset
+        for copy in (getattr(os, 'copy_file_range', None), getattr(os, 'sendfile', None)):
+            if copy is None:
+                continue
+            try:
+                while position < end:
+                    if copy is os.sendfile:
+                        copied = os.sendfile(target_fd, source_fd, position, min(COPY_CHUNK_SIZE, end - position))
+                    else:
+                        copied = copy(source_fd, target_fd, min(COPY_CHUNK_SIZE, end - position), position)
+                    if copied == 0:
+                        break
+                    position += copied
+                return position - offset
+            except OSError:
+                # 跨文件系统或文件系统不支持时换下一种方式，从已复制的位置继续
+                continue
+        view = memoryview(mapped)
+        try:
+            while position < end:
+                chunk_end = min(end, position + COPY_CHUNK_SIZE)
+                target_file.write(view[position:chunk_end])
+                position = chunk_end
+        finally:
+            view.release()
+    return position - offset
+
+
+def extract_control(mapped, section, target_folder, verbose=True):
+    # 相当于 tar -xO | tar -x -C target_folder：外层tar中的第一个文件就是控制包
+    mapped.seek(section.offset)
+    names = []
+    with tarfile.open(fileobj=mapped, mode='r|') as outer:
+        for member in outer:
+            if not member.isfile():
+                continue
+            with tarfile.open(fileobj=outer.extractfile(member), mode=f'r|{section.compression or "*"}') as inner:
+                for inner_member in inner:
+                    inner.extract(inner_member, target_folder, **EXTRACT_FILTER)
+                    names.append(inner_member.name)
+            break
+    if verbose:
+        for name in names:
+            print(name)
+    return names
+
+
+def extract_with_layout(qpkg_file, target_folder, layout, verbose=True):
+    """
+    按解析出的布局在进程内提取控制包和数据段，结果与执行header脚本相同。
+    """
+    with open(qpkg_file, 'rb') as source_file:
+        with mmap.mmap(source_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for section in layout.sections:
+                if section.kind == 'control':
+                    extract_control(mapped, section, target_folder, verbose)
+                else:
+                    copy_range(mapped, source_file.fileno(), section.offset, section.length,
+                               os.path.join(target_folder, section.name))
+    return True
+
+
+def extract_qpkg(qpkg_file, target_folder, verbose=True, shell=False):
+    """
+    提取header_script.sh，再提取控制包和数据包。header脚本无法解析或shell为True时执行脚本中的命令。
+    成功时返回True。
+    """
+    if not extract_header_script(qpkg_file, target_folder):
+        return False
+    with open(os.path.join(target_folder, HEADER_SCRIPT_NAME), 'r', errors='ignore') as header_script_file:
+        layout = None if shell else parse_layout(header_script_file.read())
+    if layout is None:
+        return process_and_execute_header_script(qpkg_file, target_folder, verbose)
+    try:
+        return extract_with_layout(qpkg_file, target_folder, layout, verbose)
+    except (OSError, tarfile.TarError) as e:
+        print(f"Error extracting {qpkg_file}:", e)
+        return False
+
+
+def process_and_execute_header_script(qpkg_file, target_folder, verbose=True):
+    # 读取header_script.sh
+    with open(os.path.join(target_folder, HEADER_SCRIPT_NAME), 'r', errors='ignore') as header_script_file:
+        header_script_content = header_script_file.read()
 
     # 截取‘script_len’及其之后，最后一个‘offset=’之前的内容
-    script_content_to_process = header_script_content[script_len_end_index:last_offset_start_index - 1]
+    script_content_to_process = script_section(header_script_content)
 
     # 替换‘“{0}”‘为qpkg文件路径，$_EXTRACT_DIR为目标文件夹
     processed_content = script_content_to_process.replace('\"${0}\"', qpkg_file).replace('$_EXTRACT_DIR', target_folder)
 
     # 执行处理后的脚本内容
-    execute_script(processed_content)
+    return execute_script(processed_content, verbose)
 
 
-def execute_script(processed_content):
+def execute_script(processed_content, verbose=True):
     # 使用bash执行处理后的脚本内容
     process = subprocess.Popen(['bash', '-c', processed_content], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     stdout, stderr = process.communicate()
     if process.returncode != 0:
         print("Error executing script:", stderr.decode())
-    else:
+        return False
+    if verbose:
         print("Script executed successfully.")
         print(stdout.decode())
+    return True
 
 
-if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python extract_header_script.py <qpkg_file> <target_folder>")
-        sys.exit(1)
+# 批量提取
+
+
+def available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def find_qpkg_files(mirror_root):
+    # 跳过.blobs、.quarantine等隐藏目录；各型号目录下的软链接和硬链接都会列出，由调用方去重
+    for dir_path, dir_names, file_names in os.walk(mirror_root):
+        dir_names[:] = sorted(name for name in dir_names if not name.startswith('.'))
+        for file_name in sorted(file_names):
+            if file_name.lower().endswith(QPKG_SUFFIX):
+                yield os.path.join(dir_path, file_name)
+
 
-    qpkg_file = sys.argv[1]
-    target_folder = sys.argv[2]
+def unique_packages(mirror_root):
+    """
+    按内容去重，返回 ({sha256: 路径}, 找到的文件数)。
+    指向同一inode的路径（软链接、blob存储的硬链接）只取一个；blob存储中登记过的路径直接使用登记的摘要，不必重新读取。
+    """
+    by_inode = {}
+    found = 0
+    for path in find_qpkg_files(mirror_root):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # 失效的软链接
+            continue
+        found += 1
+        by_inode.setdefault((stat.st_dev, stat.st_ino), path)
 
-    extract_header_script(qpkg_file, target_folder)
-    process_and_execute_header_script(qpkg_file, target_folder)
+    paths = list(by_inode.values())
+    digests = package_digests(mirror_root, paths)
+    packages = {}
+    for path in paths:
+        packages.setdefault(digests[path], path)
+    return packages, found
+
+
+def package_digests(mirror_root, paths):
+    """
+    返回 {路径: sha256}。blob存储中登记过的路径直接使用登记的摘要，其余的并发计算。
+    """
+    digests = {}
+    if os.path.exists(os.path.join(mirror_root, BLOB_DIR_NAME)):
+        blob_store = open_blob_store(mirror_root)
+        for path in paths:
+            digests[path] = blob_store.sha256_of(path)
+    unknown = [path for path in paths if not digests.get(path)]
+    with ThreadPoolExecutor(max_workers=HASH_WORKERS) as executor:
+        digests.update(zip(unknown, executor.map(file_sha256, unknown)))
+    return digests
+
+
+def output_folder(output_root, qpkg_file, sha256):
+    # 文件名加上摘要前缀，同名但内容不同的安装包不会互相覆盖
+    return os.path.join(output_root, f'{os.path.splitext(os.path.basename(qpkg_file))[0]}_{sha256[:8]}')
+
+
+def is_extracted(target_folder, sha256):
+    try:
+        with open(os.path.join(target_folder, SOURCE_HASH_NAME)) as file:
+            return file.read().strip() == sha256
+    except OSError:
+        return False
+
+
+def extract_package(qpkg_file, target_folder, sha256, shell=False):
+    """
+    在进程池中提取一个安装包：先清除上次未完成的输出，成功后写入源文件摘要。
+    """
+    if os.path.exists(target_folder):
+        shutil.rmtree(target_folder)
+    if not extract_qpkg(qpkg_file, target_folder, verbose=False, shell=shell):
+        shutil.rmtree(target_folder, ignore_errors=True)
+        return False
+    with open(os.path.join(target_folder, SOURCE_HASH_NAME), 'w') as file:
+        file.write(sha256)
+    return True
+
+
+def batch_extract(mirror_root, output_root, workers=None, shell=False):
+    """
+    提取镜像目录中的所有QPKG，相同内容只提取一次，输出已与源文件摘要一致的跳过。
+    返回失败的安装包路径列表。
+    """
+    workers = workers or available_cpus()
+    start = time.monotonic()
+    packages, found = unique_packages(mirror_root)
+    pending = {sha256: qpkg_file for sha256, qpkg_file in packages.items()
+               if not is_extracted(output_folder(output_root, qpkg_file, sha256), sha256)}
+    print(f"Found {found} QPKG files, {len(packages)} unique, {len(pending)} to extract "
+          f"({time.monotonic() - start:.2f}s to scan)")
+
+    extracted = 0
+    nbytes = 0
+    failed = []
+    start = time.monotonic()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(extract_package, qpkg_file, output_folder(output_root, qpkg_file, sha256),
+                                   sha256, shell): qpkg_file for sha256, qpkg_file in pending.items()}
+        for future in as_completed(futures):
+            qpkg_file = futures[future]
+            try:
+                ok = future.result()
+            except Exception as e:
+                print(f"Error extracting {qpkg_file}:", e)
+                ok = False
+            if ok:
+                extracted += 1
+                nbytes += os.path.getsize(qpkg_file)
+            else:
+                failed.append(qpkg_file)
+    elapsed = max(time.monotonic() - start, 1e-6)
+    print(f"Extracted {extracted} packages ({nbytes / 1024 / 1024:.1f} MB) with {workers} workers in {elapsed:.2f}s: "
+          f"{extracted / elapsed:.1f} files/s, {nbytes / 1024 / 1024 / elapsed:.1f} MB/s; "
+          f"skipped {len(packages) - len(pending)}, failed {len(failed)}")
+    for qpkg_file in failed:
+        print(f"  failed: {qpkg_file}")
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Extract the control and data archives of a QPKG file')
+    parser.add_argument('qpkg_file', help='QPKG file, or a mirror folder to extract every QPKG in it')
+    parser.add_argument('target_folder', help='output folder; one subfolder per package in batch mode')
+    parser.add_argument('--shell', action='store_true', help='run the dd/tar commands of the header script with bash')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='processes used in batch mode (default: available CPU cores)')
+    args = parser.parse_args()
+
+    if os.path.isdir(args.qpkg_file):
+        if batch_extract(args.qpkg_file, args.target_folder, args.workers, args.shell):
+            sys.exit(1)
+    elif not extract_qpkg(args.qpkg_file, args.target_folder, shell=args.shell):
+        sys.exit(1)
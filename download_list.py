@@ -0,0 +1,54 @@
+# download_list.py
+import requests
+from lxml import html as lxml_html
+
+from downloader import get_session, DEFAULT_TIMEOUT
+
+# 每行的MD5显示在label后面的input中
+MD5_XPATH = './/label[normalize-space(text())="MD5"]/following::input[1]/@value'
+
+
+class DownloadEntry:
+    def __init__(self, href: str, md5: str = None):
+        self.href = href
+        self.md5 = md5
+
+    def __str__(self) -> str:
+        return f"DownloadEntry(href={self.href}, md5={self.md5})"
+
+
+def parse_download_list(html):
+    """
+    从下载中心页面中解析 div#download_list 的每一行，每行取第一个下载链接和MD5。
+    页面中没有下载列表（例如列表由脚本渲染）时返回None。
+    """
+    if not html:
+        return None
+    root = lxml_html.fromstring(html)
+    rows = root.xpath('//div[@id="download_list"]//tr')
+    if not rows:
+        return None
+    entries = []
+    for tr in rows:
+        hrefs = [href for href in tr.xpath('.//a/@href') if href]
+        if not hrefs:
+            continue
+        md5_values = tr.xpath(MD5_XPATH)
+        entries.append(DownloadEntry(hrefs[0], md5_values[0] if md5_values else None))
+    return entries
+
+
+def fetch_download_list(url, session=None):
+    """
+    请求下载中心页面并解析下载列表，请求失败或无法解析时返回None。
+    """
+    session = session or get_session()
+    try:
+        with session.get(url, timeout=DEFAULT_TIMEOUT) as resp:
+            if resp.status_code != 200:
+                print(f"获取下载列表失败：{url} 返回 {resp.status_code}")
+                return None
+            return parse_download_list(resp.content)
+    except requests.RequestException as e:
+        print(f"获取下载列表失败：{e}")
+        return None
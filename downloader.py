@@ -0,0 +1,403 @@
+# downloader.py
+import contextvars
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import metrics
+
+# 每个分段的大小，文件小于两个分段时直接单流下载
+DEFAULT_SEGMENT_SIZE = 16 * 1024 * 1024
+# 同一文件并发下载的分段数
+DEFAULT_WORKERS = 4
+# 单流下载及分段写入时的缓冲区大小
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+DEFAULT_TIMEOUT = 30
+# 共享Session的连接池大小
+POOL_CONNECTIONS = 16
+POOL_MAXSIZE = 64
+# 单个分段失败后的重试次数
+SEGMENT_RETRIES = 3
+# 分段每写入多少字节记录一次断点
+JOURNAL_INTERVAL = 4 * 1024 * 1024
+PART_SUFFIX = '.part'
+JOURNAL_SUFFIX = '.journal'
+QUARANTINE_DIR_NAME = '.quarantine'
+# 计算摘要时为乱序分段缓存的最大字节数
+HASH_BUFFER_LIMIT = 64 * 1024 * 1024
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    返回进程内共享的 Session，复用 TCP/TLS 连接。
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+        return _session
+
+
+def get_validators(headers):
+    # 用于条件请求的 ETag / Last-Modified
+    return {'etag': headers.get('ETag', ""), 'last_modified': headers.get('Last-Modified', "")}
+
+
+def probe(url, session=None):
+    """
+    探测服务器是否支持 Range 请求。
+    返回 (最终URL, 文件大小, 是否支持Range, 缓存校验头)，大小未知时为 -1。
+    """
+    session = session or get_session()
+    try:
+        with session.head(url, allow_redirects=True, timeout=DEFAULT_TIMEOUT) as resp:
+            if resp.status_code == 200:
+                size = int(resp.headers.get('Content-Length', -1))
+                accept_ranges = resp.headers.get('Accept-Ranges', '').lower() == 'bytes'
+                if size > 0 and accept_ranges:
+                    return resp.url, size, True, get_validators(resp.headers)
+    except (requests.RequestException, ValueError):
+        pass
+
+    # 部分CDN不响应HEAD或不返回Accept-Ranges，用一个字节的Range请求再确认一次
+    try:
+        with session.get(url, headers={'Range': 'bytes=0-0'}, stream=True, timeout=DEFAULT_TIMEOUT) as resp:
+            content_range = resp.headers.get('Content-Range', '')
+            if resp.status_code == 206 and '/' in content_range:
+                total = content_range.rsplit('/', 1)[1]
+                if total.isdigit():
+                    return resp.url, int(total), True, get_validators(resp.headers)
+            if resp.status_code == 200:
+                return resp.url, int(resp.headers.get('Content-Length', -1)), False, get_validators(resp.headers)
+    except (requests.RequestException, ValueError):
+        pass
+    return url, -1, False, get_validators({})
+
+
+def if_range_value(validators):
+    # If-Range 只接受强ETag或Last-Modified，两者都没有时无法做条件续传
+    etag = validators.get('etag', "")
+    if etag and not etag.startswith('W/'):
+        return etag
+    return validators.get('last_modified', "")
+
+
+class ContentChanged(IOError):
+    """
+    带 If-Range 的分段请求返回了200：服务端文件已更换，已下载的部分作废。
+    """
+
+
+def split_ranges(size, segment_size):
+    # 按segment_size切分为闭区间 [start, end]
+    return [(start, min(start + segment_size, size) - 1) for start in range(0, size, segment_size)]
+
+
+class PartJournal:
+    """
+    .part 文件旁的日志，记录已经落盘的字节区间，重启后只请求缺失部分。
+    """
+
+    def __init__(self, journal_path, url="", size=-1, done=None, validators=None):
+        self.journal_path = journal_path
+        self.url = url
+        self.size = size
+        self.done = done if done is not None else []
+        self.validators = validators or {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, journal_path):
+        try:
+            with open(journal_path, 'r') as file:
+                data = json.load(file)
+            return cls(journal_path, data.get('url', ""), data.get('size', -1),
+                       [tuple(r) for r in data.get('done', [])], data.get('validators'))
+        except (OSError, ValueError):
+            return None
+
+    def add(self, start, end):
+        with self._lock:
+            ranges = sorted(self.done + [(start, end)])
+            merged = [ranges[0]]
+            for s, e in ranges[1:]:
+                last_s, last_e = merged[-1]
+                if s <= last_e + 1:
+                    merged[-1] = (last_s, max(last_e, e))
+                else:
+                    merged.append((s, e))
+            self.done = merged
+            self._save()
+
+    def missing(self):
+        # 返回尚未完成的区间
+        with self._lock:
+            gaps = []
+            pos = 0
+            for s, e in self.done:
+                if s > pos:
+                    gaps.append((pos, s - 1))
+                pos = max(pos, e + 1)
+            if pos < self.size:
+                gaps.append((pos, self.size - 1))
+            return gaps
+
+    def completed_bytes(self):
+        return sum(e - s + 1 for s, e in self.done)
+
+    def _save(self):
+        # 先写临时文件再替换，保证日志本身不会写坏
+        tmp_path = self.journal_path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump({'url': self.url, 'size': self.size, 'done': self.done, 'validators': self.validators}, file)
+        os.replace(tmp_path, self.journal_path)
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def remove(self):
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+
+class StreamHasher:
+    """
+    在写入的同时按文件顺序计算MD5和SHA-256。分段下载时乱序到达的数据先缓存，
+    接上当前位置后再计算；超出缓存上限或续传前已存在的部分在finish()时从磁盘补读。
+    """
+
+    def __init__(self, buffer_limit=HASH_BUFFER_LIMIT):
+        self.md5 = hashlib.md5()
+        self.sha256 = hashlib.sha256()
+        self.offset = 0
+        self.buffer_limit = buffer_limit
+        self._pending = {}
+        self._pending_bytes = 0
+        self._lock = threading.Lock()
+
+    def feed(self, pos, data):
+        with self._lock:
+            if pos == self.offset:
+                self._update(data)
+                # 接上之后把已缓存的后续数据也计算掉
+                while self.offset in self._pending:
+                    data = self._pending.pop(self.offset)
+                    self._pending_bytes -= len(data)
+                    self._update(data)
+            elif pos > self.offset and self._pending_bytes + len(data) <= self.buffer_limit:
+                self._pending[pos] = data
+                self._pending_bytes += len(data)
+
+    def _update(self, data):
+        self.md5.update(data)
+        self.sha256.update(data)
+        self.offset += len(data)
+
+    def finish(self, path, chunk_size=DEFAULT_CHUNK_SIZE):
+        with self._lock:
+            self._pending.clear()
+            self._pending_bytes = 0
+            with open(path, 'rb') as file:
+                file.seek(self.offset)
+                for chunk in iter(lambda: file.read(chunk_size), b''):
+                    self._update(chunk)
+            return self.md5.hexdigest(), self.sha256.hexdigest()
+
+
+class DownloadResult:
+    def __init__(self, ok=False, size=0, md5="", sha256="", validators=None):
+        self.ok = ok
+        self.size = size
+        self.md5 = md5
+        self.sha256 = sha256
+        self.validators = validators or {}
+
+    def __bool__(self):
+        return self.ok
+
+    def __str__(self) -> str:
+        return f"DownloadResult(ok={self.ok}, size={self.size}, md5={self.md5})"
+
+
+def _download_segment(session, url, part_path, start, end, chunk_size, journal, hasher):
+    pos = start
+    if_range = if_range_value(journal.validators)
+    for attempt in range(SEGMENT_RETRIES):
+        try:
+            # 重试时从已写入的位置继续，不重复下载
+            headers = {'Range': f'bytes={pos}-{end}'}
+            if if_range:
+                headers['If-Range'] = if_range
+            with session.get(url, headers=headers, stream=True, timeout=DEFAULT_TIMEOUT) as resp:
+                if resp.status_code == 200 and if_range:
+                    raise ContentChanged(f"分段 {start}-{end} 的校验头已变化，服务端返回了完整内容")
+                if resp.status_code != 206:
+                    raise IOError(f"分段请求未返回206，状态码：{resp.status_code}")
+                with open(part_path, 'r+b') as file:
+                    file.seek(pos)
+                    committed = pos
+                    for chunk in resp.iter_content(chunk_size=chunk_size):
+                        chunk = chunk[:end + 1 - pos]
+                        file.write(chunk)
+                        hasher.feed(pos, chunk)
+                        pos += len(chunk)
+                        if pos - committed >= JOURNAL_INTERVAL or pos > end:
+                            # 数据落盘后再写日志，日志中的区间一定是完整的
+                            file.flush()
+                            os.fsync(file.fileno())
+                            journal.add(committed, pos - 1)
+                            committed = pos
+                        if pos > end:
+                            break
+                if pos <= end:
+                    raise IOError(f"分段 {start}-{end} 提前结束于 {pos}")
+                return
+        except ContentChanged:
+            raise
+        except (requests.RequestException, IOError) as e:
+            if attempt == SEGMENT_RETRIES - 1:
+                raise
+            metrics.inc('retries')
+            print(f"分段 {start}-{end} 下载失败：{e}，将重试...")
+
+
+def download_segmented(url, part_path, journal, hasher, segment_size=DEFAULT_SEGMENT_SIZE, workers=DEFAULT_WORKERS,
+                       chunk_size=DEFAULT_CHUNK_SIZE, session=None):
+    session = session or get_session()
+    # 预分配文件，各分段直接写入自己的偏移位置
+    if not os.path.exists(part_path) or os.path.getsize(part_path) != journal.size:
+        with open(part_path, 'wb') as file:
+            file.truncate(journal.size)
+        journal.done = []
+        journal.save()
+    pieces = []
+    for gap_start, gap_end in journal.missing():
+        pieces.extend((gap_start + s, gap_start + e) for s, e in split_ranges(gap_end - gap_start + 1, segment_size))
+    if not pieces:
+        return
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(pieces)))) as executor:
+        # 分段在调用方的上下文中运行，上下文变量（如按次记录的限流标记）对分段请求同样可见
+        futures = [executor.submit(contextvars.copy_context().run, _download_segment, session, url, part_path,
+                                   start, end, chunk_size, journal, hasher)
+                   for start, end in pieces]
+        for future in futures:
+            future.result()
+
+
+def download_stream(url, part_path, hasher, chunk_size=DEFAULT_CHUNK_SIZE, session=None):
+    session = session or get_session()
+    with session.get(url, stream=True, timeout=DEFAULT_TIMEOUT) as resp:
+        if resp.status_code != 200:
+            return resp.status_code
+        with open(part_path, 'wb') as file:
+            pos = 0
+            for chunk in resp.iter_content(chunk_size=chunk_size):
+                file.write(chunk)
+                hasher.feed(pos, chunk)
+                pos += len(chunk)
+        return resp.status_code
+
+
+def _open_journal(url, part_path, size, validators):
+    journal_path = part_path + JOURNAL_SUFFIX
+    journal = PartJournal.load(journal_path)
+    # 文件大小或 ETag/Last-Modified 变化说明服务端已换了内容，旧的部分文件作废
+    if journal is not None and journal.validators != validators:
+        print(f"{url} 的校验头已变化，丢弃旧的部分文件")
+        discard_part(part_path)
+        journal = None
+    if journal is None or journal.size != size or not os.path.exists(part_path):
+        journal = PartJournal(journal_path, url, size, validators=validators)
+    elif journal.done:
+        print(f"从断点继续下载，已完成 {journal.completed_bytes()}/{size} 字节")
+    return journal
+
+
+def download_file(url, local_path, segment_size=DEFAULT_SEGMENT_SIZE, workers=DEFAULT_WORKERS,
+                  chunk_size=DEFAULT_CHUNK_SIZE, session=None, expected_md5=None, quarantine_dir=None):
+    """
+    下载url到local_path。服务器支持Range且文件足够大时分段并发下载，否则使用大缓冲区单流下载。
+    数据先写入 .part 文件，校验大小（及 expected_md5）通过后才原子地重命名为 local_path；
+    中断后再次调用会根据日志只下载缺失的区间。MD5/SHA-256在写入时同步计算，
+    校验失败的文件移入quarantine_dir（默认为目标目录下的 .quarantine）。
+    返回DownloadResult，成功时为真值并带有文件的摘要。
+    """
+    session = session or get_session()
+    part_path = local_path + PART_SUFFIX
+    start = time.monotonic()
+    # 下载途中服务端换了文件时，丢弃已下载的部分从头再来一次
+    for attempt in range(2):
+        with metrics.timer('download_probe'):
+            final_url, size, accept_ranges, validators = probe(url, session)
+        journal = None
+        hasher = StreamHasher()
+        try:
+            if accept_ranges and size > 0:
+                journal = _open_journal(url, part_path, size, validators)
+                download_segmented(final_url, part_path, journal, hasher, segment_size, workers, chunk_size,
+                                   session)
+            else:
+                status_code = download_stream(final_url, part_path, hasher, chunk_size, session)
+                if status_code != 200:
+                    print(f"下载失败，状态码：{status_code}")
+                    metrics.inc('download_failures')
+                    return DownloadResult()
+            break
+        except ContentChanged as e:
+            print(f"{e}，丢弃 {part_path} 重新下载")
+            discard_part(part_path)
+            if attempt == 1:
+                metrics.inc('download_failures')
+                return DownloadResult()
+        except (requests.RequestException, IOError) as e:
+            print(f"下载失败：{e}")
+            metrics.inc('download_failures')
+            return DownloadResult()
+
+    actual_size = os.path.getsize(part_path)
+    if size >= 0 and actual_size != size:
+        print(f"文件大小不符：{actual_size} != {size}，丢弃 {part_path}")
+        discard_part(part_path)
+        metrics.inc('download_failures')
+        return DownloadResult()
+    md5_value, sha256_value = hasher.finish(part_path, chunk_size)
+    if expected_md5 and md5_value != expected_md5.strip().lower():
+        quarantine_path = quarantine(part_path, local_path, md5_value, quarantine_dir)
+        print(f"MD5校验失败：期望 {expected_md5}，实际 {md5_value}，已隔离至 {quarantine_path}")
+        metrics.inc('md5_mismatches')
+        return DownloadResult(size=actual_size, md5=md5_value, sha256=sha256_value)
+
+    os.replace(part_path, local_path)
+    if journal:
+        journal.remove()
+    metrics.record_download(time.monotonic() - start, actual_size)
+    print(f"文件已下载至：{local_path}")
+    return DownloadResult(True, actual_size, md5_value, sha256_value, validators)
+
+
+def quarantine(part_path, local_path, md5_value, quarantine_dir=None):
+    quarantine_dir = quarantine_dir or os.path.join(os.path.dirname(local_path), QUARANTINE_DIR_NAME)
+    os.makedirs(quarantine_dir, exist_ok=True)
+    quarantine_path = os.path.join(quarantine_dir, f"{os.path.basename(local_path)}.{md5_value}")
+    os.replace(part_path, quarantine_path)
+    discard_part(part_path)
+    return quarantine_path
+
+
+def discard_part(part_path):
+    for path in (part_path, part_path + JOURNAL_SUFFIX):
+        if os.path.exists(path):
+            os.remove(path)
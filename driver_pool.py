@@ -0,0 +1,162 @@
+# driver_pool.py
+import queue
+import threading
+from contextlib import contextmanager
+
+from selenium import webdriver
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+from webdriver_manager.chrome import ChromeDriverManager
+
+DEFAULT_POOL_SIZE = 4
+# 每个浏览器会话使用多少次后重建
+DEFAULT_MAX_USES = 50
+
+# 清理页面状态：本地存储、会话存储，并关闭可能残留的模态框
+RESET_SCRIPT = '''
+try { window.localStorage.clear(); } catch (e) {}
+try { window.sessionStorage.clear(); } catch (e) {}
+document.querySelectorAll('div.modal.fade.show button[type="button"]').forEach(function (b) { b.click(); });
+'''
+
+_driver_path = None
+_driver_path_lock = threading.Lock()
+
+
+def get_driver_path():
+    # ChromeDriverManager().install() 会检查版本并可能联网，整个进程只调用一次
+    global _driver_path
+    with _driver_path_lock:
+        if _driver_path is None:
+            _driver_path = ChromeDriverManager().install()
+        return _driver_path
+
+
+def new_driver(incognito=False):
+    chrome_options = Options()
+    if incognito:
+        chrome_options.add_argument("--incognito")  # 使用无痕模式
+    driver = webdriver.Chrome(service=Service(get_driver_path()), options=chrome_options)
+    driver.set_window_size(1920, 1080)  # 设置窗口大小为1920x1080
+    return driver
+
+
+class PooledDriver:
+    def __init__(self, driver):
+        self.driver = driver
+        self.uses = 0
+
+
+class DriverPool:
+    """
+    常驻的 Chrome 会话池。会话借出前做健康检查，归还时清理 cookie、存储和模态框，
+    使用次数达到 max_uses、浏览器本身出错或归还时清理失败才重建；等待超时等页面层面的异常不影响会话。
+    """
+
+    def __init__(self, size=DEFAULT_POOL_SIZE, max_uses=DEFAULT_MAX_USES, incognito=False):
+        self.size = size
+        self.max_uses = max_uses
+        self.incognito = incognito
+        self._idle = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _create(self):
+        return PooledDriver(new_driver(self.incognito))
+
+    def acquire(self) -> PooledDriver:
+        while True:
+            try:
+                item = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_create = self._created < self.size
+                    if can_create:
+                        self._created += 1
+                if can_create:
+                    try:
+                        return self._create()
+                    except Exception:
+                        with self._lock:
+                            self._created -= 1
+                        raise
+                # 其他线程丢弃会话后会腾出名额，所以不能无限期阻塞
+                try:
+                    item = self._idle.get(timeout=1)
+                except queue.Empty:
+                    continue
+            if self.is_healthy(item):
+                return item
+            self._discard(item)
+
+    def release(self, item: PooledDriver, healthy=True):
+        item.uses += 1
+        if self._closed or not healthy or item.uses >= self.max_uses or not self.reset(item):
+            self._discard(item)
+            return
+        self._idle.put(item)
+
+    @contextmanager
+    def driver(self):
+        item = self.acquire()
+        healthy = True
+        try:
+            yield item.driver
+        except TimeoutException:
+            # 空页面等待超时很常见，会话本身没有问题
+            raise
+        except WebDriverException:
+            healthy = False
+            raise
+        finally:
+            self.release(item, healthy)
+
+    @staticmethod
+    def is_healthy(item: PooledDriver):
+        try:
+            return item.driver.execute_script("return 1;") == 1
+        except Exception:
+            return False
+
+    @staticmethod
+    def reset(item: PooledDriver):
+        driver = item.driver
+        try:
+            driver.execute_script(RESET_SCRIPT)
+            driver.delete_all_cookies()
+            # 只保留一个窗口
+            handles = driver.window_handles
+            for handle in handles[1:]:
+                driver.switch_to.window(handle)
+                driver.close()
+            driver.switch_to.window(handles[0])
+            driver.get('about:blank')
+            return True
+        except Exception as e:
+            print(f"重置浏览器会话失败：{e}")
+            return False
+
+    def _discard(self, item: PooledDriver):
+        with self._lock:
+            self._created -= 1
+        try:
+            item.driver.quit()
+        except Exception:
+            pass
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                item = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(item)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,531 @@
+# fixture_site.py
+import argparse
+import hashlib
+import html
+import io
+import json
+import re
+import tarfile
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, quote
+
+DEFAULT_PORT = 8800
+DEFAULT_FILE_SIZE = 4 * 1024 * 1024
+# 每次写出的块大小，限速按块计算
+WRITE_CHUNK_SIZE = 64 * 1024
+CONTENT_BLOCK_SIZE = 64 * 1024
+BUTTON_CONTAINER_CLASS = 'd-flex flex-wrap justify-content-center qnap-bs-btn-container dark-bg justify-content-xl-end'
+LAST_MODIFIED = formatdate(0, usegmt=True)
+# QDK生成的header脚本：控制包是外层tar中的control.tar.gz，由 tar -xO | tar -xzv 解压
+QPKG_HEADER_SCRIPT = '''#!/bin/sh
+#================================================================
+# Copyright (C) 2008 QNAP Systems, Inc.
+#================================================================
+_EXTRACT_DIR="/share/.qpkg_tmp/{name}"
+/bin/mkdir -p $_EXTRACT_DIR || exit 1
+script_len={script_len}
+/bin/dd if="${{0}}" bs=$script_len skip=1 | /bin/tar -xO | /bin/tar -xzv -C $_EXTRACT_DIR || exit 1
+offset=$(/usr/bin/expr $script_len + {control_len})
+/bin/dd if="${{0}}" bs=$offset skip=1 | /bin/cat | /bin/dd bs=1024 count={data_blocks} of=$_EXTRACT_DIR/data.tar.gz || exit 1
+offset=$(/usr/bin/expr $offset + {data_len})
+/bin/dd if="${{0}}" bs=$offset skip=1 | /bin/cat | /bin/dd bs=1024 count=0 of=$_EXTRACT_DIR/extra.tar.gz || exit 1
+exit 1
+'''
+
+# 应用中心下拉框：模拟react-select，点击控件展开 div.css-13gtfdj-menu，再次点击收起
+APP_CENTER_SCRIPT = '''
+var tree = JSON.parse(document.getElementById('tree').textContent);
+var levels = document.querySelectorAll('div.css-xn98a3');
+var values = [null, null, null, null];
+var openLevel = -1;
+
+function choices(level) {
+    var node = tree;
+    for (var i = 0; i < level; i++) {
+        var keys = Object.keys(node);
+        node = node[values[i] !== null && node[values[i]] !== undefined ? values[i] : keys[0]];
+    }
+    return Array.isArray(node) ? node : Object.keys(node);
+}
+
+function closeMenu() {
+    var menu = document.querySelector('div.css-13gtfdj-menu');
+    if (menu) {
+        menu.remove();
+    }
+    openLevel = -1;
+}
+
+function openMenu(level) {
+    closeMenu();
+    var menu = document.createElement('div');
+    menu.className = 'css-13gtfdj-menu';
+    var list = document.createElement('div');
+    list.className = 'css-uvrstl';
+    choices(level).forEach(function (label) {
+        var option = document.createElement('div');
+        option.setAttribute('role', 'option');
+        option.textContent = label;
+        option.addEventListener('click', function (event) {
+            event.stopPropagation();
+            values[level] = label;
+            for (var i = level + 1; i < values.length; i++) {
+                values[i] = null;
+                levels[i].querySelector('span').textContent = '';
+            }
+            levels[level].querySelector('span').textContent = label;
+            closeMenu();
+        });
+        list.appendChild(option);
+    });
+    menu.appendChild(list);
+    var rect = levels[level].getBoundingClientRect();
+    menu.style.left = rect.left + 'px';
+    menu.style.top = (rect.bottom + window.scrollY) + 'px';
+    document.body.appendChild(menu);
+    openLevel = level;
+}
+
+levels.forEach(function (control, level) {
+    control.addEventListener('click', function () {
+        if (openLevel === level) {
+            closeMenu();
+        } else {
+            setTimeout(function () { openMenu(level); }, MENU_DELAY);
+        }
+    });
+});
+'''
+
+# 应用列表页：数据不在DOM中的应用点击箭头后才在弹窗中渲染按钮区
+LISTING_SCRIPT = '''
+function closeModal() {
+    var modal = document.querySelector('div.modal.fade.show');
+    if (modal) {
+        modal.remove();
+    }
+}
+
+document.querySelectorAll('.items-container li').forEach(function (li, index) {
+    li.querySelector('div.arrow').addEventListener('click', function () {
+        closeModal();
+        setTimeout(function () {
+            var app = APPS[index];
+            var modal = document.createElement('div');
+            modal.className = 'modal fade show';
+            var container = document.createElement('div');
+            container.className = BUTTON_CONTAINER_CLASS;
+            var release = document.createElement('a');
+            release.className = 'btn-bs-arrow--secondary-outline';
+            release.href = app.release_url;
+            release.textContent = 'Release Notes';
+            var download = document.createElement('a');
+            download.className = 'btn-bs-arrow--secondary';
+            download.href = app.download_url;
+            download.textContent = 'Download';
+            container.appendChild(release);
+            container.appendChild(download);
+            var close = document.createElement('button');
+            close.type = 'button';
+            close.textContent = 'Close';
+            close.addEventListener('click', closeModal);
+            modal.appendChild(container);
+            modal.appendChild(close);
+            document.body.appendChild(modal);
+        }, MODAL_DELAY);
+    });
+});
+'''
+
+# 下载中心：选择bay后填充 select#model-select
+DOWNLOAD_CENTER_SCRIPT = '''
+var models = JSON.parse(document.getElementById('models').textContent);
+var selects = document.querySelectorAll('#download_center div.com-select-set select');
+selects[1].addEventListener('change', function () {
+    var modelSelect = selects[2];
+    while (modelSelect.options.length > 1) {
+        modelSelect.remove(1);
+    }
+    (models[selects[1].value] || []).forEach(function (model) {
+        var option = document.createElement('option');
+        option.value = model;
+        option.textContent = model;
+        modelSelect.appendChild(option);
+    });
+});
+'''
+
+PAGE_STYLE = '''
+div.css-xn98a3 { display: inline-block; min-width: 160px; min-height: 24px; border: 1px solid #999; margin: 4px; }
+div.css-13gtfdj-menu { position: absolute; background: #fff; border: 1px solid #999; z-index: 10; }
+div.css-13gtfdj-menu div[role="option"] { padding: 2px 8px; }
+.items-container li { margin: 8px 0; }
+div.arrow { display: inline-block; width: 16px; height: 16px; background: #333; }
+div.modal.fade.show { position: fixed; top: 20%; left: 20%; background: #fff; border: 1px solid #333; padding: 16px; }
+div.inline-buttons { display: none; }
+'''
+
+
+def _page(title, body, script="", constants=None):
+    definitions = ''.join(f'var {name} = {json.dumps(value)};\n' for name, value in (constants or {}).items())
+    return (f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>{html.escape(title)}</title>'
+            f'<style>{PAGE_STYLE}</style></head><body>{body}'
+            f'<script>{definitions}{script}</script></body></html>')
+
+
+def _tar_bytes(members, mode='w'):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode=mode) as tar:
+        for name, data in members:
+            tarinfo = tarfile.TarInfo(name)
+            tarinfo.size = len(data)
+            tarinfo.mode = 0o755 if name.endswith('.sh') else 0o644
+            tar.addfile(tarinfo, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def build_qpkg(name, version, data_size=DEFAULT_FILE_SIZE):
+    """
+    生成与QDK格式相同的安装包：header脚本 + 外层tar（包着control.tar.gz）+ data.tar.gz，
+    各段按QDK的方式补齐到10240和1024字节。返回 (安装包内容, {归档: {成员名: 内容}})。
+    """
+    seed = hashlib.sha256(f'{name}_{version}'.encode('utf-8')).digest()
+    control_members = {
+        './qpkg.cfg': (f'QPKG_NAME="{name}"\nQPKG_DISPLAY_NAME="{name}"\nQPKG_VER="{version}"\n'
+                       f'QPKG_AUTHOR="QNAP Systems, Inc."\nQPKG_REQUIRE="Python >= 3.6"\n'
+                       f'QTS_MINI_VERSION="4.3.0"\nQPKG_SERVICE_PORT="8{len(name):03d}"\n').encode('utf-8'),
+        f'./{name}.gif': b'GIF89a' + seed,
+        './package_routines': b'# package routines\n',
+    }
+    data_members = {
+        './blob.bin': (seed * (data_size // len(seed) + 1))[:data_size],
+        './README': f'{name} {version}\n'.encode('utf-8'),
+        f'./{name}.sh': b'#!/bin/sh\n',
+    }
+    control = _tar_bytes([('control.tar.gz', _tar_bytes(control_members.items(), 'w:gz'))])
+    control = control.ljust((len(control) + 10239) // 10240 * 10240, b'\0')
+    data = _tar_bytes(data_members.items(), 'w:gz')
+    data = data.ljust((len(data) + 1023) // 1024 * 1024, b'\0')
+
+    # script_len是脚本自身的长度，反复代入直到不再变化
+    script = b''
+    script_len = 0
+    while len(script) != script_len or not script:
+        script_len = len(script)
+        script = QPKG_HEADER_SCRIPT.format(name=name, script_len=script_len, control_len=len(control),
+                                           data_blocks=len(data) // 1024, data_len=len(data)).encode('utf-8')
+    return script + control + data, {'control': control_members, 'data': data_members}
+
+
+def _data_script(element_id, data):
+    # </ 会提前结束script标签
+    payload = json.dumps(data).replace('</', '<\\/')
+    return f'<script type="application/json" id="{element_id}">{payload}</script>'
+
+
+class FixtureSite:
+    """
+    离线模拟的QNAP站点，复现爬虫依赖的DOM结构：
+    应用中心的 div.css-xn98a3 下拉框、div.css-13gtfdj-menu 菜单、.items-container li 和弹窗按钮区，
+    下载中心的 #download_center 下拉框和 div#download_list。
+    所有内容由参数确定性生成；/files/ 下的文件支持Range、HEAD和条件请求，可设置延迟和带宽。
+
+    - latency：每个请求响应前的延迟（秒）
+    - bandwidth：每个连接的带宽（字节/秒），0表示不限速
+    - inline_ratio：应用列表中按钮区直接渲染在DOM中的比例，其余应用需要打开弹窗
+    """
+
+    def __init__(self, products=2, versions=2, bays=3, models=3, apps=8, file_size=DEFAULT_FILE_SIZE, latency=0.0,
+                 bandwidth=0, inline_ratio=1.0, menu_delay=0, modal_delay=0):
+        self.products = [f'qts{i}' if i else 'qts' for i in range(products)]
+        self.versions = [f'5.{i}.0' for i in range(versions)]
+        self.bays = [f'{2 * (i + 1)}-Bay' for i in range(bays)]
+        self.models_per_bay = models
+        self.apps = apps
+        self.file_size = file_size
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.inline_ratio = inline_ratio
+        self.menu_delay = menu_delay
+        self.modal_delay = modal_delay
+        self.base_url = ""
+        self._server = None
+        self._thread = None
+        self._md5_cache = {}
+        self._md5_lock = threading.Lock()
+        self.requests = 0
+        self.bytes_sent = 0
+        self._stats_lock = threading.Lock()
+
+    # 站点数据
+
+    def models(self, bay):
+        return [f'TS-{bay.split("-")[0]}{i:02d}' for i in range(self.models_per_bay)]
+
+    def tree(self):
+        return {product: {version: {bay: self.models(bay) for bay in self.bays} for version in self.versions}
+                for product in self.products}
+
+    def pages(self):
+        return [(product, version, bay, model) for product in self.products for version in self.versions
+                for bay in self.bays for model in self.models(bay)]
+
+    def app_center_url(self):
+        return f'{self.base_url}/en-us/app-center'
+
+    def download_center_url(self):
+        return f'{self.base_url}/en-us/download'
+
+    def listing_url(self, product, version, model):
+        return f'{self.app_center_url()}?os={product}&version={version}&model={model}'
+
+    def file_url(self, name):
+        return f'{self.base_url}/files/{quote(name)}'
+
+    def list_apps(self, product, version, model):
+        # 同一应用在各型号间共享安装包，每个型号另有一个专属应用
+        apps = []
+        for i in range(self.apps):
+            name = f'App{i:02d}' if i else f'{model}Tool'
+            file_name = f'{name}_{product}_{version}.qpkg'
+            apps.append({'name': name, 'version': f'1.{i}.0', 'download_url': self.file_url(file_name),
+                         'release_url': f'{self.base_url}/release/{name}'})
+        return apps
+
+    def download_entries(self, model, category):
+        if category == 'firmware':
+            names = [f'{model}_firmware.img']
+        elif category == 'utility':
+            # 工具对所有型号相同
+            names = ['QfinderPro.exe', 'Qsync.exe']
+        else:
+            names = []
+        return [(name, self.file_md5(name)) for name in names]
+
+    # 文件内容
+
+    def _block(self, name):
+        seed = hashlib.sha256(name.encode('utf-8')).digest()
+        return (seed * (CONTENT_BLOCK_SIZE // len(seed) + 1))[:CONTENT_BLOCK_SIZE]
+
+    def read_file(self, name, start, end):
+        # 内容由文件名确定，按块重复
+        block = self._block(name)
+        pos = start
+        while pos <= end:
+            offset = pos % CONTENT_BLOCK_SIZE
+            length = min(CONTENT_BLOCK_SIZE - offset, end - pos + 1, WRITE_CHUNK_SIZE)
+            yield block[offset:offset + length]
+            pos += length
+
+    def file_md5(self, name):
+        with self._md5_lock:
+            md5_value = self._md5_cache.get(name)
+        if md5_value is None:
+            md5 = hashlib.md5()
+            for chunk in self.read_file(name, 0, self.file_size - 1):
+                md5.update(chunk)
+            md5_value = md5.hexdigest()
+            with self._md5_lock:
+                self._md5_cache[name] = md5_value
+        return md5_value
+
+    # 页面
+
+    def render_app_center(self, query):
+        if 'model' in query:
+            return self.render_listing(query.get('os', [''])[0], query.get('version', [''])[0], query['model'][0])
+        controls = ''.join(f'<div class="css-xn98a3" aria-hidden="true" tabindex="0" data-level="{name}">'
+                           f'<span></span></div>' for name in ('product', 'version', 'bay', 'model'))
+        return _page('App Center', f'<div class="search-sets">{controls}</div>{_data_script("tree", self.tree())}',
+                     APP_CENTER_SCRIPT, {'MENU_DELAY': self.menu_delay})
+
+    def render_listing(self, product, version, model):
+        apps = self.list_apps(product, version, model)
+        inline_count = round(len(apps) * self.inline_ratio)
+        items = []
+        for i, app in enumerate(apps):
+            buttons = ""
+            if i < inline_count:
+                buttons = (f'<div class="qnap-bs-btn-container inline-buttons">'
+                           f'<a class="btn-bs-arrow--secondary-outline" href="{html.escape(app["release_url"])}">'
+                           f'Release Notes</a><a class="btn-bs-arrow--secondary" '
+                           f'href="{html.escape(app["download_url"])}">Download</a></div>')
+            items.append(f'<li><span class="app-name">{html.escape(app["name"])}</span> '
+                         f'<span class="app-version">{html.escape(app["version"])}</span>'
+                         f'<div class="arrow"></div>{buttons}</li>')
+        # 弹窗数据只放在脚本变量中，不出现在 application/json 里，直接解析HTML时拿不到
+        return _page(f'{model} Apps', f'<ul class="items-container">{"".join(items)}</ul>', LISTING_SCRIPT,
+                     {'APPS': apps, 'MODAL_DELAY': self.modal_delay, 'BUTTON_CONTAINER_CLASS': BUTTON_CONTAINER_CLASS})
+
+    def render_download_center(self, query):
+        if 'model' in query:
+            return self.render_download_list(query['model'][0], query.get('category', [''])[0])
+        bays = ''.join(f'<option value="{bay}">{bay}</option>' for bay in self.bays)
+        body = (f'<div id="download_center">'
+                f'<div class="com-select-set"><select><option>Choose</option><option value="nas">NAS</option>'
+                f'</select></div>'
+                f'<div class="com-select-set"><select><option>Choose</option>{bays}</select></div>'
+                f'<div class="com-select-set"><select id="model-select"><option>Choose</option></select></div>'
+                f'</div>{_data_script("models", {bay: self.models(bay) for bay in self.bays})}')
+        return _page('Download Center', body, DOWNLOAD_CENTER_SCRIPT)
+
+    def render_download_list(self, model, category):
+        host = urlparse(self.base_url).netloc
+        rows = ''.join(f'<tr><td>{html.escape(name)}</td><td><a href="//{host}/files/{quote(name)}">Download</a>'
+                       f'</td><td><label>MD5</label><input type="text" readonly value="{md5_value}"></td></tr>'
+                       for name, md5_value in self.download_entries(model, category))
+        return _page(f'{model} {category}', f'<div id="download_list"><table><tbody>{rows}</tbody></table></div>')
+
+    # 服务器
+
+    def record(self, nbytes):
+        with self._stats_lock:
+            self.requests += 1
+            self.bytes_sent += nbytes
+
+    def start(self, host='127.0.0.1', port=0):
+        self._server = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._server.daemon_threads = True
+        self.base_url = f'http://{host}:{self._server.server_address[1]}'
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fixture-site', daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        if self._server is None:
+            self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def _make_handler(site: FixtureSite):
+    class FixtureHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_HEAD(self):
+            self.handle_request(head=True)
+
+        def do_GET(self):
+            self.handle_request(head=False)
+
+        def handle_request(self, head):
+            if site.latency:
+                time.sleep(site.latency)
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            if url.path.startswith('/files/'):
+                self.send_file(url.path[len('/files/'):], head)
+            elif url.path == '/en-us/app-center':
+                self.send_html(site.render_app_center(query), head)
+            elif url.path == '/en-us/download':
+                self.send_html(site.render_download_center(query), head)
+            elif url.path.startswith('/release/'):
+                self.send_html(_page('Release Notes', '<p>release notes</p>'), head)
+            else:
+                self.send_error(404)
+
+        def send_html(self, text, head):
+            data = text.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            if not head:
+                self.wfile.write(data)
+            site.record(0 if head else len(data))
+
+        def send_file(self, name, head):
+            size = site.file_size
+            etag = f'"{site.file_md5(name)}"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                site.record(0)
+                return
+            start, end = 0, size - 1
+            match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+            if match:
+                start = int(match.group(1))
+                end = min(int(match.group(2) or size - 1), size - 1)
+                if start > end:
+                    self.send_response(416)
+                    self.send_header('Content-Range', f'bytes */{size}')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+            else:
+                self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(end - start + 1))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', LAST_MODIFIED)
+            self.end_headers()
+            if head:
+                site.record(0)
+                return
+            sent = 0
+            try:
+                for chunk in site.read_file(name, start, end):
+                    self.wfile.write(chunk)
+                    sent += len(chunk)
+                    if site.bandwidth:
+                        time.sleep(len(chunk) / site.bandwidth)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            site.record(sent)
+
+    return FixtureHandler
+
+
+def add_site_arguments(parser):
+    parser.add_argument('--products', type=int, default=2, help='product数量')
+    parser.add_argument('--versions', type=int, default=2, help='每个product的version数量')
+    parser.add_argument('--bays', type=int, default=3, help='bay数量')
+    parser.add_argument('--models', type=int, default=3, help='每个bay的型号数量')
+    parser.add_argument('--apps', type=int, default=8, help='每个型号的应用数量')
+    parser.add_argument('--file-size', type=int, default=DEFAULT_FILE_SIZE, help='每个文件的大小（字节）')
+    parser.add_argument('--latency', type=float, default=0.0, help='每个请求的延迟（秒）')
+    parser.add_argument('--bandwidth', type=float, default=0, help='每个连接的带宽（字节/秒），0为不限速')
+    parser.add_argument('--inline-ratio', type=float, default=1.0, help='按钮区直接在列表页DOM中的应用比例')
+    parser.add_argument('--menu-delay', type=int, default=0, help='下拉菜单展开的延迟（毫秒）')
+    parser.add_argument('--modal-delay', type=int, default=0, help='弹窗渲染的延迟（毫秒）')
+
+
+def site_from_args(args):
+    return FixtureSite(args.products, args.versions, args.bays, args.models, args.apps, args.file_size, args.latency,
+                       args.bandwidth, args.inline_ratio, args.menu_delay, args.modal_delay)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='离线模拟的QNAP站点')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='监听端口')
+    add_site_arguments(parser)
+    args = parser.parse_args()
+
+    site = site_from_args(args)
+    site.start(port=args.port)
+    print(f"模拟站点已启动：{site.app_center_url()}  {site.download_center_url()}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        site.stop()
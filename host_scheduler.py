@@ -0,0 +1,302 @@
+# host_scheduler.py
+import threading
+import time
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+from requests.adapters import HTTPAdapter
+
+from downloader import get_session, download_file, POOL_CONNECTIONS, POOL_MAXSIZE
+from metrics import metrics
+
+# 每个host的初始请求速率（次/秒）和突发量
+DEFAULT_RATE = 10.0
+DEFAULT_BURST = 20
+MIN_RATE = 0.5
+MAX_RATE = 200.0
+# 每个健康响应增加的速率
+RATE_INCREASE = 0.2
+# 每个host同时下载的文件数：初始值和上下限
+DEFAULT_CONCURRENCY = 4
+MIN_CONCURRENCY = 1
+MAX_CONCURRENCY = 32
+# 乘性减小的系数，以及两次减小之间的最短间隔（秒），避免同一批响应连续减半
+DECREASE_FACTOR = 0.5
+DECREASE_COOLDOWN = 2.0
+# 没有Retry-After时的退避时间（秒）
+DEFAULT_BACKOFF = 5.0
+MAX_BACKOFF = 300.0
+# 响应延迟的平滑系数；平滑后的延迟超过基线的多少倍视为服务端变慢
+LATENCY_ALPHA = 0.2
+LATENCY_FACTOR = 3.0
+MIN_LATENCY_SAMPLES = 5
+THROTTLE_STATUS_CODES = (429, 503)
+# 被限流后整个文件的重试次数
+DOWNLOAD_RETRIES = 3
+
+# 当前这次download_file调用是否收到过429/503。分段线程通过复制的上下文共享同一个Event，
+# 其他线程的下载被限流不会影响本次调用的重试判断
+_call_throttled = ContextVar('call_throttled', default=None)
+
+
+def parse_retry_after(value):
+    """
+    解析Retry-After头，返回需要等待的秒数；无法解析时返回None。
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class HostLimiter:
+    """
+    单个host的限速状态：令牌桶限制请求速率，AIMD调整同时下载的文件数。
+    响应健康时速率和并发数缓慢增加；遇到429/503或延迟明显升高时减半，并按Retry-After暂停请求。
+    """
+
+    def __init__(self, host, rate=DEFAULT_RATE, concurrency=DEFAULT_CONCURRENCY, max_concurrency=MAX_CONCURRENCY):
+        self.host = host
+        self.bucket = TokenBucket(rate)
+        self.limit = float(concurrency)
+        self.max_concurrency = max_concurrency
+        self.active = 0
+        self.blocked_until = 0.0
+        self.latency = None
+        self.baseline = None
+        self.samples = 0
+        self.requests = 0
+        self.throttled = 0
+        self.bytes = 0
+        self.started_at = time.monotonic()
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.active >= max(MIN_CONCURRENCY, int(self.limit)):
+                self._cond.wait()
+            self.active += 1
+
+    def release(self, nbytes=0):
+        with self._cond:
+            self.active -= 1
+            self.bytes += nbytes
+            self._cond.notify_all()
+        self.publish()
+
+    def wait_turn(self):
+        # 被限流时先等到Retry-After到期，再取令牌
+        while True:
+            with self._cond:
+                wait = self.blocked_until - time.monotonic()
+            if wait <= 0:
+                break
+            time.sleep(wait)
+        self.bucket.acquire()
+
+    def on_response(self, status_code, latency, retry_after=None):
+        with self._cond:
+            self.requests += 1
+            if status_code in THROTTLE_STATUS_CODES:
+                self.throttled += 1
+                backoff = parse_retry_after(retry_after)
+                if backoff is None:
+                    backoff = min(MAX_BACKOFF, DEFAULT_BACKOFF * (self.throttled if self._recently_decreased() else 1))
+                self.blocked_until = max(self.blocked_until, time.monotonic() + min(backoff, MAX_BACKOFF))
+                self._decrease()
+                metrics.inc('throttled')
+                print(f"{self.host} 返回 {status_code}，暂停 {backoff:.1f} 秒，并发降至 {int(self.limit)}")
+            elif status_code < 500:
+                self._observe_latency(latency)
+            else:
+                self._decrease()
+        self.publish()
+
+    def on_error(self):
+        with self._cond:
+            self.requests += 1
+            self._decrease()
+        self.publish()
+
+    def _observe_latency(self, latency):
+        self.samples += 1
+        self.latency = latency if self.latency is None else \
+            LATENCY_ALPHA * latency + (1 - LATENCY_ALPHA) * self.latency
+        if self.samples < MIN_LATENCY_SAMPLES:
+            return
+        if self.baseline is None or self.latency < self.baseline:
+            self.baseline = self.latency
+        if self.latency > self.baseline * LATENCY_FACTOR:
+            self._decrease()
+            return
+        # 加性增加：并发数大约每一轮请求加一
+        self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+        self.bucket.rate = min(MAX_RATE, self.bucket.rate + RATE_INCREASE)
+        self._cond.notify_all()
+
+    def _recently_decreased(self):
+        return time.monotonic() - self._last_decrease < DECREASE_COOLDOWN
+
+    def _decrease(self):
+        if self._recently_decreased():
+            return
+        self._last_decrease = time.monotonic()
+        self.limit = max(MIN_CONCURRENCY, self.limit * DECREASE_FACTOR)
+        self.bucket.rate = max(MIN_RATE, self.bucket.rate * DECREASE_FACTOR)
+        # 慢下来之后的延迟作为新的基线
+        self.baseline = self.latency
+
+    def throughput(self):
+        elapsed = max(time.monotonic() - self.started_at, 1e-6)
+        return self.bytes / 1024 / 1024 / elapsed
+
+    def snapshot(self):
+        with self._cond:
+            return {'host': self.host, 'concurrency_limit': int(self.limit), 'active': self.active,
+                    'rate_limit': self.bucket.rate, 'requests': self.requests, 'throttled': self.throttled,
+                    'latency': self.latency or 0.0, 'bytes': self.bytes, 'mb_per_second': self.throughput(),
+                    'blocked_for': max(0.0, self.blocked_until - time.monotonic())}
+
+    def publish(self):
+        snapshot = self.snapshot()
+        metrics.set_gauge('host_concurrency_limit', snapshot['concurrency_limit'], host=self.host)
+        metrics.set_gauge('host_rate_limit', round(snapshot['rate_limit'], 3), host=self.host)
+        metrics.set_gauge('host_mb_per_second', round(snapshot['mb_per_second'], 3), host=self.host)
+
+    def __str__(self) -> str:
+        s = self.snapshot()
+        return (f"{s['host']}: 并发 {s['active']}/{s['concurrency_limit']}，速率 {s['rate_limit']:.1f} 次/s，"
+                f"请求 {s['requests']}，限流 {s['throttled']}，延迟 {s['latency'] * 1000:.0f} 毫秒，"
+                f"{s['mb_per_second']:.2f} MB/s")
+
+
+class ThrottledAdapter(HTTPAdapter):
+    """
+    发送前按host取令牌，收到响应后把状态码和延迟反馈给对应的HostLimiter。
+    """
+
+    def __init__(self, scheduler, **kwargs):
+        self.scheduler = scheduler
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        limiter = self.scheduler.limiter(urlparse(request.url).netloc)
+        limiter.wait_turn()
+        start = time.monotonic()
+        try:
+            resp = super().send(request, **kwargs)
+        except Exception:
+            limiter.on_error()
+            raise
+        limiter.on_response(resp.status_code, time.monotonic() - start, resp.headers.get('Retry-After'))
+        throttled = _call_throttled.get()
+        if throttled is not None and resp.status_code in THROTTLE_STATUS_CODES:
+            throttled.set()
+        return resp
+
+
+class HostScheduler:
+    """
+    下载调度：每个host一个HostLimiter。install() 在共享Session上挂载ThrottledAdapter，
+    之后经由该Session的所有请求（列表页、探测、分段）都受对应host的速率限制；
+    download_file() 另外按host限制同时下载的文件数，被限流导致失败时等待后重试。
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, concurrency=DEFAULT_CONCURRENCY, max_concurrency=MAX_CONCURRENCY):
+        self.rate = rate
+        self.concurrency = concurrency
+        self.max_concurrency = max_concurrency
+        self._limiters = {}
+        self._lock = threading.Lock()
+        self._installed = False
+
+    def configure(self, rate=None, concurrency=None, max_concurrency=None):
+        # 只影响之后新建的HostLimiter，应在开始请求前调用
+        self.rate = rate or self.rate
+        self.concurrency = concurrency or self.concurrency
+        self.max_concurrency = max_concurrency or self.max_concurrency
+
+    def install(self, session=None):
+        with self._lock:
+            if self._installed and session is None:
+                return
+            adapter = ThrottledAdapter(self, pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+            session = session or get_session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._installed = True
+
+    def limiter(self, host) -> HostLimiter:
+        with self._lock:
+            limiter = self._limiters.get(host)
+            if limiter is None:
+                limiter = self._limiters[host] = HostLimiter(host, self.rate, self.concurrency,
+                                                             self.max_concurrency)
+            return limiter
+
+    def download_file(self, url, local_path, **kwargs):
+        """
+        与downloader.download_file参数相同，按host排队后下载。
+        """
+        self.install()
+        limiter = self.limiter(urlparse(url).netloc)
+        for attempt in range(DOWNLOAD_RETRIES):
+            throttled = threading.Event()
+            token = _call_throttled.set(throttled)
+            limiter.acquire()
+            result = None
+            try:
+                result = download_file(url, local_path, **kwargs)
+            finally:
+                limiter.release(result.size if result else 0)
+                _call_throttled.reset(token)
+            if result or not throttled.is_set() or attempt == DOWNLOAD_RETRIES - 1:
+                return result
+            # 失败是因为被限流，等限流解除后从断点继续
+            print(f"{url} 下载时被限流，稍后重试...")
+        return result
+
+    def snapshot(self):
+        with self._lock:
+            limiters = list(self._limiters.values())
+        return [limiter.snapshot() for limiter in limiters]
+
+    def print_status(self):
+        with self._lock:
+            limiters = list(self._limiters.values())
+        if not limiters:
+            return
+        print("各host限速状态：")
+        for limiter in limiters:
+            print(f"  {limiter}")
+
+
+scheduler = HostScheduler()
@@ -0,0 +1,213 @@
+# ledger.py
+import atexit
+import os
+import sqlite3
+import threading
+import time
+
+# 每累计多少条新记录提交一次
+DEFAULT_BATCH_SIZE = 50
+# 距上次提交超过多少秒时，即使未满一批也提交
+DEFAULT_FLUSH_INTERVAL = 5
+LEDGER_FILE_NAME = 'ledger.db'
+
+# 旧版本使用的纯文本记录文件，首次打开时导入
+LEGACY_APP_CENTER_RECORD = 'record_app_center.txt'
+LEGACY_DOWNLOAD_CENTER_RECORD = 'record.txt'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    file_name TEXT NOT NULL,
+    file_path TEXT NOT NULL DEFAULT '',
+    url TEXT NOT NULL DEFAULT '',
+    md5 TEXT NOT NULL DEFAULT '',
+    release_url TEXT NOT NULL DEFAULT '',
+    created_at REAL NOT NULL,
+    sha256 TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_entries_file_name ON entries (file_name);
+CREATE INDEX IF NOT EXISTS idx_entries_md5 ON entries (md5);
+CREATE INDEX IF NOT EXISTS idx_entries_url ON entries (url);
+'''
+
+# 旧版本数据库缺少的列：(列名, 定义)
+MIGRATIONS = [
+    ('sha256', "TEXT NOT NULL DEFAULT ''"),
+]
+
+
+class LedgerEntry:
+    def __init__(self, file_name, file_path="", url="", md5="", release_url="", created_at=0.0, sha256=""):
+        self.file_name = file_name
+        self.file_path = file_path
+        self.url = url
+        self.md5 = md5
+        self.release_url = release_url
+        self.created_at = created_at
+        self.sha256 = sha256
+
+    def __str__(self) -> str:
+        return f"LedgerEntry(file_name={self.file_name}, file_path={self.file_path}, md5={self.md5})"
+
+
+class Ledger:
+    """
+    下载记录。数据保存在 SQLite 中，启动时整体载入内存索引，
+    按文件名、MD5、URL 查询均为 O(1)；新记录按批提交，已提交的记录在进程崩溃后不会丢失。
+    """
+
+    def __init__(self, folder_path, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.folder_path = folder_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._lock = threading.RLock()
+        self._pending = []
+        self._last_flush = time.monotonic()
+
+        self._by_name = {}
+        self._by_md5 = {}
+        self._by_url = {}
+        self._by_sha256 = {}
+        self._md5_names = set()
+
+        os.makedirs(folder_path, exist_ok=True)
+        db_path = os.path.join(folder_path, LEDGER_FILE_NAME)
+        is_new = not os.path.exists(db_path)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+
+        if is_new:
+            self._import_legacy_records()
+        self._load()
+
+    def _migrate(self):
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(entries)')}
+        with self._conn:
+            for name, definition in MIGRATIONS:
+                if name not in columns:
+                    self._conn.execute(f'ALTER TABLE entries ADD COLUMN {name} {definition}')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_entries_sha256 ON entries (sha256)')
+
+    def _load(self):
+        cursor = self._conn.execute(
+            'SELECT file_name, file_path, url, md5, release_url, created_at, sha256 FROM entries ORDER BY id')
+        for row in cursor:
+            self._index(LedgerEntry(*row))
+
+    def _index(self, entry: LedgerEntry):
+        # 同一键有多条记录时以最新的为准（例如文件失效后重新下载）
+        self._by_name[entry.file_name] = entry
+        if entry.md5:
+            self._by_md5[entry.md5] = entry
+            self._md5_names.add((entry.md5, entry.file_name))
+        if entry.url:
+            self._by_url[entry.url] = entry
+        if entry.sha256:
+            self._by_sha256[entry.sha256] = entry
+
+    def _import_legacy_records(self):
+        entries = []
+        app_center_record = os.path.join(self.folder_path, LEGACY_APP_CENTER_RECORD)
+        if os.path.exists(app_center_record):
+            with open(app_center_record, 'r') as file:
+                for line in file:
+                    parts = line.strip().split('|')
+                    if not parts[0]:
+                        continue
+                    file_path = parts[1] if len(parts) > 1 else ""
+                    release_url = parts[2] if len(parts) > 2 else ""
+                    entries.append(LedgerEntry(parts[0], file_path=file_path, release_url=release_url))
+
+        download_center_record = os.path.join(self.folder_path, LEGACY_DOWNLOAD_CENTER_RECORD)
+        if os.path.exists(download_center_record):
+            with open(download_center_record, 'r') as file:
+                for line in file:
+                    md5_value, _, file_name = line.strip().partition(':')
+                    if file_name:
+                        entries.append(LedgerEntry(file_name, md5=md5_value))
+
+        if entries:
+            print(f"从旧记录文件导入 {len(entries)} 条记录到 {LEDGER_FILE_NAME}")
+            self._write(entries)
+
+    def _write(self, entries):
+        with self._conn:
+            self._conn.executemany(
+                'INSERT INTO entries (file_name, file_path, url, md5, release_url, created_at, sha256) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(e.file_name, e.file_path, e.url, e.md5, e.release_url, e.created_at or time.time(), e.sha256)
+                 for e in entries])
+
+    def find_by_name(self, file_name):
+        return self._by_name.get(file_name)
+
+    def find_by_md5(self, md5_value):
+        return self._by_md5.get(md5_value)
+
+    def find_by_url(self, url):
+        return self._by_url.get(url)
+
+    def find_by_sha256(self, sha256):
+        return self._by_sha256.get(sha256)
+
+    def has_md5(self, md5_value, file_name):
+        return (md5_value, file_name) in self._md5_names
+
+    def add(self, file_name, file_path="", url="", md5="", release_url="", sha256=""):
+        entry = LedgerEntry(file_name, file_path=file_path, url=url, md5=md5 or "", release_url=release_url,
+                            created_at=time.time(), sha256=sha256 or "")
+        with self._lock:
+            self._index(entry)
+            self._pending.append(entry)
+            if len(self._pending) >= self.batch_size or \
+                    time.monotonic() - self._last_flush >= self.flush_interval:
+                self.flush()
+        return entry
+
+    def flush(self):
+        with self._lock:
+            if self._pending and self._conn is not None:
+                self._write(self._pending)
+                self._pending = []
+            self._last_flush = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def __len__(self):
+        return len(self._by_name)
+
+
+_ledgers = {}
+_ledgers_lock = threading.Lock()
+
+
+def open_ledger(folder_path) -> Ledger:
+    """
+    返回 folder_path 对应的共享 Ledger，同一目录在进程内只打开一次。
+    """
+    key = os.path.abspath(folder_path)
+    with _ledgers_lock:
+        ledger = _ledgers.get(key)
+        if ledger is None:
+            ledger = Ledger(folder_path)
+            _ledgers[key] = ledger
+        return ledger
+
+
+def flush_all():
+    with _ledgers_lock:
+        for ledger in _ledgers.values():
+            ledger.flush()
+
+
+# 正常退出或 Ctrl+C 时把未满一批的记录写入磁盘
+atexit.register(flush_all)
@@ -0,0 +1,224 @@
+# metrics.py
+import cProfile
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+PROMETHEUS_FILE_NAME = 'crawl.prom'
+REPORT_FILE_NAME = 'crawl_report.json'
+PROFILE_DIR_NAME = 'profiles'
+METRIC_PREFIX = 'qnap_crawl'
+# 阶段耗时直方图的桶（秒）
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+# 单个文件下载速度直方图的桶（MB/s）
+THROUGHPUT_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 20, 50, 100, 200)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self):
+        # Prometheus的桶是累计的
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def to_dict(self):
+        return {'count': self.count, 'sum': self.sum, 'max': self.max,
+                'mean': self.sum / self.count if self.count else 0.0,
+                'buckets': {str(bound): count for bound, count in self.cumulative()}}
+
+
+class Metrics:
+    """
+    按阶段记录耗时直方图和计数器，运行结束后写成Prometheus textfile和JSON报告。
+    开启profiling后，每个阶段的计时区间同时用cProfile采样，按阶段各保存一个 .prof 文件。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._throughput = Histogram(THROUGHPUT_BUCKETS)
+        self._counters = {}
+        self._gauges = {}
+        self.started_at = time.time()
+        self.profile_dir = None
+        self._profiles = {}
+        self._local = threading.local()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def record_download(self, seconds, nbytes):
+        self.observe('download', seconds)
+        self.inc('downloads')
+        self.inc('download_bytes', nbytes)
+        if seconds > 0:
+            with self._lock:
+                self._throughput.observe(nbytes / seconds / 1024 / 1024)
+
+    @contextmanager
+    def timer(self, stage):
+        profiler = self._start_profile(stage)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.monotonic() - start)
+            if profiler is not None:
+                profiler.disable()
+                self._local.profiling = False
+
+    def enable_profiling(self, profile_dir):
+        os.makedirs(profile_dir, exist_ok=True)
+        self.profile_dir = profile_dir
+
+    def _start_profile(self, stage):
+        # 同一线程中嵌套的阶段只采样最外层
+        if self.profile_dir is None or getattr(self._local, 'profiling', False):
+            return None
+        with self._lock:
+            profilers = self._profiles.setdefault(stage, {})
+            profiler = profilers.get(threading.get_ident())
+            if profiler is None:
+                profiler = profilers[threading.get_ident()] = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # 其他线程已经在采样（Python 3.12起同一时间只允许一个profiler）
+            return None
+        self._local.profiling = True
+        return profiler
+
+    def dump_profiles(self):
+        if self.profile_dir is None:
+            return []
+        paths = []
+        with self._lock:
+            profiles = {stage: list(profilers.values()) for stage, profilers in self._profiles.items()}
+        for stage, profilers in profiles.items():
+            for i, profiler in enumerate(profilers):
+                path = os.path.join(self.profile_dir, f"{stage}.{i}.prof")
+                profiler.dump_stats(path)
+                paths.append(path)
+        return paths
+
+    def snapshot(self):
+        elapsed = time.time() - self.started_at
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = [{'name': name, 'labels': dict(labels), 'value': value}
+                      for (name, labels), value in sorted(self._gauges.items())]
+            download_seconds = self._stages['download'].sum if 'download' in self._stages else 0.0
+            return {
+                'started_at': self.started_at,
+                'elapsed_seconds': elapsed,
+                'counters': counters,
+                'gauges': gauges,
+                'stages': {stage: histogram.to_dict() for stage, histogram in self._stages.items()},
+                'download_mb_per_second': self._throughput.to_dict(),
+                # 整体速度按运行时间计算，包含并发下载的效果
+                'overall_mb_per_second': counters.get('download_bytes', 0) / 1024 / 1024 / elapsed if elapsed else 0.0,
+                'download_seconds': download_seconds,
+            }
+
+    def write_json(self, path):
+        _write_atomic(path, json.dumps(self.snapshot(), ensure_ascii=False, indent=2))
+
+    def write_prometheus(self, path):
+        snapshot = self.snapshot()
+        lines = [f'# HELP {METRIC_PREFIX}_stage_seconds 各阶段耗时',
+                 f'# TYPE {METRIC_PREFIX}_stage_seconds histogram']
+        for stage, data in sorted(snapshot['stages'].items()):
+            lines.extend(_histogram_lines(f'{METRIC_PREFIX}_stage_seconds', data, f'stage="{stage}"'))
+        lines += [f'# HELP {METRIC_PREFIX}_download_mb_per_second 单个文件下载速度',
+                  f'# TYPE {METRIC_PREFIX}_download_mb_per_second histogram']
+        lines.extend(_histogram_lines(f'{METRIC_PREFIX}_download_mb_per_second', snapshot['download_mb_per_second']))
+        for name, value in sorted(snapshot['counters'].items()):
+            lines += [f'# TYPE {METRIC_PREFIX}_{name}_total counter', f'{METRIC_PREFIX}_{name}_total {value}']
+        typed = set()
+        for gauge in snapshot['gauges']:
+            name = f"{METRIC_PREFIX}_{gauge['name']}"
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} gauge')
+            labels = ','.join(f'{key}="{value}"' for key, value in gauge['labels'].items())
+            lines.append(f"{name}{{{labels}}} {gauge['value']}" if labels else f"{name} {gauge['value']}")
+        lines += [f'# TYPE {METRIC_PREFIX}_elapsed_seconds gauge',
+                  f'{METRIC_PREFIX}_elapsed_seconds {snapshot["elapsed_seconds"]:.3f}',
+                  f'# TYPE {METRIC_PREFIX}_last_run_timestamp_seconds gauge',
+                  f'{METRIC_PREFIX}_last_run_timestamp_seconds {time.time():.0f}']
+        _write_atomic(path, '\n'.join(lines) + '\n')
+
+    def write(self, folder_path):
+        """
+        在folder_path中写入Prometheus textfile和JSON报告，并保存profile。
+        """
+        os.makedirs(folder_path, exist_ok=True)
+        self.write_prometheus(os.path.join(folder_path, PROMETHEUS_FILE_NAME))
+        self.write_json(os.path.join(folder_path, REPORT_FILE_NAME))
+        for path in self.dump_profiles():
+            print(f"profile已保存至：{path}")
+
+    def print_report(self):
+        snapshot = self.snapshot()
+        print(f"运行 {snapshot['elapsed_seconds']:.1f} 秒，各阶段耗时：")
+        for stage, data in sorted(snapshot['stages'].items(), key=lambda kv: -kv[1]['sum']):
+            print(f"  {stage}: {data['count']} 次，共 {data['sum']:.1f} 秒，平均 {data['mean'] * 1000:.0f} 毫秒，"
+                  f"最长 {data['max']:.1f} 秒")
+        counters = snapshot['counters']
+        if counters.get('download_bytes'):
+            print(f"下载 {counters.get('downloads', 0)} 个文件，{counters['download_bytes'] / 1024 / 1024:.1f} MB，"
+                  f"整体 {snapshot['overall_mb_per_second']:.2f} MB/s，重试 {counters.get('retries', 0)} 次")
+
+
+def _histogram_lines(name, data, labels=""):
+    prefix = labels + ',' if labels else ""
+    lines = [f'{name}_bucket{{{prefix}le="{bound}"}} {count}' for bound, count in data['buckets'].items()]
+    lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {data["count"]}')
+    suffix = f'{{{labels}}}' if labels else ""
+    lines.append(f'{name}_sum{suffix} {data["sum"]:.6f}')
+    lines.append(f'{name}_count{suffix} {data["count"]}')
+    return lines
+
+
+def _write_atomic(path, text):
+    # textfile collector可能随时读取，先写临时文件再替换
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        file.write(text)
+    os.replace(tmp_path, path)
+
+
+metrics = Metrics()
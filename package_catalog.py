@@ -0,0 +1,306 @@
+# package_catalog.py
+import argparse
+import os
+import re
+import sqlite3
+import tarfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from catalog import parse_package_name, version_key, print_rows
+from devide_qpkg import find_qpkg_files, package_digests
+from qpkg_archive import QpkgArchive, CONTROL, open_qpkg_index
+
+PACKAGE_CATALOG_FILE_NAME = 'package_catalog.db'
+QPKG_CFG_NAME = 'qpkg.cfg'
+DEFAULT_WORKERS = 8
+# qpkg.cfg中的 KEY="value" 行
+CFG_LINE_PATTERN = re.compile(r'^\s*(?:export\s+)?([A-Za-z_]\w*)=(.*)$')
+# 不同版本的QDK对最低、最高固件版本用过不同的变量名
+FW_MIN_KEYS = ('QTS_MINI_VERSION', 'QTS_MIN_VERSION', 'QPKG_FW_VER_MIN')
+FW_MAX_KEYS = ('QTS_MAX_VERSION', 'QPKG_FW_VER_MAX')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sources_sha256 ON sources (sha256);
+CREATE TABLE IF NOT EXISTS packages (
+    sha256 TEXT PRIMARY KEY,
+    file_name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    display_name TEXT NOT NULL,
+    version TEXT NOT NULL,
+    version_key TEXT NOT NULL,
+    arch TEXT NOT NULL,
+    author TEXT NOT NULL,
+    require TEXT NOT NULL,
+    conflict TEXT NOT NULL,
+    fw_min TEXT NOT NULL,
+    fw_min_key TEXT NOT NULL,
+    fw_max TEXT NOT NULL,
+    error TEXT NOT NULL,
+    indexed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_packages_name ON packages (name, version_key);
+CREATE INDEX IF NOT EXISTS idx_packages_arch ON packages (arch);
+CREATE INDEX IF NOT EXISTS idx_packages_fw_min ON packages (fw_min_key);
+CREATE TABLE IF NOT EXISTS fields (
+    sha256 TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (sha256, key)
+);
+CREATE INDEX IF NOT EXISTS idx_fields_key ON fields (key, value);
+'''
+
+
+def parse_qpkg_cfg(content):
+    """
+    解析qpkg.cfg中的 KEY="value" 赋值，忽略注释和其他命令。同一个变量赋值多次时取最后一次。
+    """
+    fields = {}
+    for line in content.splitlines():
+        match = CFG_LINE_PATTERN.match(line)
+        if not match:
+            continue
+        value = match.group(2).strip()
+        if value[:1] in ('"', "'"):
+            end = value.find(value[0], 1)
+            value = value[1:end] if end != -1 else value[1:]
+        else:
+            value = value.split('#', 1)[0].strip()
+        fields[match.group(1)] = value
+    return fields
+
+
+def first_field(fields, keys):
+    return next((fields[key] for key in keys if fields.get(key)), "")
+
+
+def read_package_info(qpkg_file, index=None):
+    """
+    从安装包的控制包中读取qpkg.cfg，返回 (字段, 错误信息)。只解压控制包，不读取数据包。
+    """
+    try:
+        with QpkgArchive(qpkg_file, index) as qpkg_archive:
+            if qpkg_archive.stream(CONTROL) is None:
+                return {}, "无法定位控制包"
+            content = qpkg_archive.read(QPKG_CFG_NAME, CONTROL)
+    except (OSError, ValueError, EOFError, tarfile.TarError, zlib.error) as e:
+        return {}, f"读取失败：{e}"
+    if content is None:
+        return {}, f"控制包中没有{QPKG_CFG_NAME}"
+    return parse_qpkg_cfg(content.decode('utf-8', errors='ignore')), ""
+
+
+class PackageCatalog:
+    """
+    安装包元数据目录：packages表按内容（SHA-256）保存每个安装包qpkg.cfg中的常用字段，fields表保存全部字段，
+    sources表记录镜像中每个路径的大小、修改时间和摘要。
+    update() 只读取大小或修改时间变化过的路径，内容已登记过的只更新路径，不再读取安装包。
+    """
+
+    def __init__(self, folder_path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(folder_path, PACKAGE_CATALOG_FILE_NAME), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+
+    def update(self, mirror_root, workers=DEFAULT_WORKERS, retry_errors=False):
+        """
+        扫描镜像目录并更新目录，返回 (扫描的文件数, 变化的文件数, 新读取的安装包数, 删除的路径数)。
+        读取失败的安装包默认不再重试，retry_errors为True时即使文件没有变化也重新读取。
+        """
+        with self._lock:
+            known = {path: (size, mtime_ns) for path, size, mtime_ns in
+                     self._conn.execute('SELECT path, size, mtime_ns FROM sources')}
+        seen = set()
+        changed = {}
+        for path in find_qpkg_files(mirror_root):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # 失效的软链接
+                continue
+            relative_path = os.path.relpath(path, mirror_root)
+            seen.add(relative_path)
+            if known.get(relative_path) != (stat.st_size, stat.st_mtime_ns):
+                changed[path] = (relative_path, stat.st_size, stat.st_mtime_ns)
+
+        digests = package_digests(mirror_root, list(changed))
+        with self._lock:
+            indexed = {sha256 for sha256, in self._conn.execute(
+                'SELECT sha256 FROM packages' + (" WHERE error = ''" if retry_errors else ''))}
+            failed = self._conn.execute(
+                'SELECT s.path, s.sha256 FROM sources s JOIN packages p ON p.sha256 = s.sha256 '
+                "WHERE p.error != ''").fetchall() if retry_errors else []
+        new_packages = {}
+        for path, sha256 in digests.items():
+            if sha256 not in indexed:
+                new_packages.setdefault(sha256, path)
+        for relative_path, sha256 in failed:
+            # 没有变化的路径摘要不变，直接按登记的摘要重试
+            path = os.path.join(mirror_root, relative_path)
+            if relative_path in seen and path not in changed:
+                new_packages.setdefault(sha256, path)
+
+        index = open_qpkg_index(mirror_root)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            infos = list(executor.map(lambda path: read_package_info(path, index), new_packages.values()))
+
+        now = time.time()
+        removed = [(path,) for path in known if path not in seen]
+        with self._lock, self._conn:
+            for (sha256, path), (fields, error) in zip(new_packages.items(), infos):
+                self._insert_package(sha256, path, fields, error, now)
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO sources (path, size, mtime_ns, sha256, updated_at) VALUES (?, ?, ?, ?, ?)',
+                [(relative_path, size, mtime_ns, digests[path], now)
+                 for path, (relative_path, size, mtime_ns) in changed.items()])
+            self._conn.executemany('DELETE FROM sources WHERE path = ?', removed)
+            # 镜像中已没有任何路径引用的安装包
+            self._conn.execute('DELETE FROM fields WHERE sha256 NOT IN (SELECT sha256 FROM sources)')
+            self._conn.execute('DELETE FROM packages WHERE sha256 NOT IN (SELECT sha256 FROM sources)')
+        return len(seen), len(changed), len(new_packages), len(removed)
+
+    def _insert_package(self, sha256, path, fields, error, now):
+        file_name = os.path.basename(path)
+        name_from_file, version_from_file, arch = parse_package_name(file_name)
+        version = fields.get('QPKG_VER') or version_from_file
+        fw_min = first_field(fields, FW_MIN_KEYS)
+        self._conn.execute(
+            'INSERT OR REPLACE INTO packages (sha256, file_name, size, name, display_name, version, version_key, '
+            'arch, author, require, conflict, fw_min, fw_min_key, fw_max, error, indexed_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (sha256, file_name, os.path.getsize(path), fields.get('QPKG_NAME') or name_from_file,
+             fields.get('QPKG_DISPLAY_NAME', ""), version, version_key(version), arch,
+             fields.get('QPKG_AUTHOR', ""), fields.get('QPKG_REQUIRE', ""), fields.get('QPKG_CONFLICT', ""),
+             fw_min, version_key(fw_min), first_field(fields, FW_MAX_KEYS), error, now))
+        self._conn.execute('DELETE FROM fields WHERE sha256 = ?', (sha256,))
+        self._conn.executemany('INSERT INTO fields (sha256, key, value) VALUES (?, ?, ?)',
+                               [(sha256, key, value) for key, value in fields.items()])
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    # 查询
+
+    def find(self, name=None, arch=None, requires=None, fw_min_above=None, fw_min_below=None):
+        """
+        按名称、架构、依赖（QPKG_REQUIRE中包含的文字）和最低固件版本范围查找安装包，按名称和版本排序。
+        """
+        conditions = ['1 = 1']
+        params = []
+        if name:
+            conditions.append('(name = ? OR display_name = ?)')
+            params += [name, name]
+        if arch is not None:
+            conditions.append('arch = ?')
+            params.append(arch)
+        if requires:
+            conditions.append('require LIKE ?')
+            params.append(f'%{requires}%')
+        if fw_min_above:
+            conditions.append('fw_min_key > ?')
+            params.append(version_key(fw_min_above))
+        if fw_min_below:
+            conditions.append("fw_min_key != '' AND fw_min_key < ?")
+            params.append(version_key(fw_min_below))
+        return self._query(
+            'SELECT name, version, arch, fw_min, fw_max, require, file_name, sha256 FROM packages '
+            f'WHERE {" AND ".join(conditions)} ORDER BY name, version_key, arch', params)
+
+    def field(self, key, value=None):
+        """
+        按qpkg.cfg中的任意字段查找，例如 QPKG_SERVICE_PORT。
+        """
+        sql = ('SELECT p.name, p.version, p.arch, f.value, p.file_name FROM fields f '
+               'JOIN packages p ON p.sha256 = f.sha256 WHERE f.key = ?')
+        params = [key]
+        if value is not None:
+            sql += ' AND f.value = ?'
+            params.append(value)
+        return self._query(sql + ' ORDER BY p.name, p.version_key', params)
+
+    def paths(self, sha256):
+        return self._query('SELECT path, size, mtime_ns FROM sources WHERE sha256 = ? ORDER BY path', (sha256,))
+
+    def errors(self):
+        return self._query("SELECT file_name, error, sha256 FROM packages WHERE error != '' ORDER BY file_name")
+
+    def stats(self):
+        return self._query(
+            'SELECT (SELECT COUNT(*) FROM sources) AS paths, (SELECT COUNT(*) FROM packages) AS packages, '
+            '(SELECT COUNT(DISTINCT name) FROM packages) AS names, '
+            "(SELECT COUNT(*) FROM packages WHERE error != '') AS errors")[0]
+
+    def close(self):
+        self._conn.close()
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def open_package_catalog(folder_path) -> PackageCatalog:
+    key = os.path.abspath(folder_path)
+    with _catalogs_lock:
+        catalog = _catalogs.get(key)
+        if catalog is None:
+            catalog = PackageCatalog(folder_path)
+            _catalogs[key] = catalog
+        return catalog
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='从镜像中的QPKG读取qpkg.cfg，建立可查询的安装包元数据目录')
+    parser.add_argument('path', help='镜像目录（package_catalog.db所在目录）')
+    commands = parser.add_subparsers(dest='command', required=True)
+    update_parser = commands.add_parser('update', help='增量更新目录，只读取新增或变化的安装包')
+    update_parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='并发读取的安装包数')
+    update_parser.add_argument('--retry-errors', action='store_true', help='重新读取之前读取失败的安装包')
+    find_parser = commands.add_parser('find', help='按名称、架构、依赖或最低固件版本查找')
+    find_parser.add_argument('--name')
+    find_parser.add_argument('--arch')
+    find_parser.add_argument('--requires', help='QPKG_REQUIRE中包含的文字')
+    find_parser.add_argument('--fw-min-above', help='最低固件版本高于该版本')
+    find_parser.add_argument('--fw-min-below', help='最低固件版本低于该版本')
+    field_parser = commands.add_parser('field', help='按qpkg.cfg中的任意字段查找')
+    field_parser.add_argument('key')
+    field_parser.add_argument('value', nargs='?')
+    commands.add_parser('errors', help='无法读取qpkg.cfg的安装包')
+    commands.add_parser('stats', help='目录统计')
+    args = parser.parse_args()
+
+    catalog = PackageCatalog(args.path)
+    start = time.monotonic()
+    if args.command == 'update':
+        scanned, changed, read, removed = catalog.update(args.path, args.workers, args.retry_errors)
+        print(f"扫描 {scanned} 个文件，变化 {changed} 个，读取 {read} 个安装包，删除 {removed} 个路径，"
+              f"用时 {time.monotonic() - start:.2f} 秒")
+        errors = catalog.stats()['errors']
+        if errors:
+            print(f"{errors} 个安装包读取失败（errors 查看），可使用 update --retry-errors 重新读取")
+    else:
+        if args.command == 'find':
+            rows = catalog.find(args.name, args.arch, args.requires, args.fw_min_above, args.fw_min_below)
+        elif args.command == 'field':
+            rows = catalog.field(args.key, args.value)
+        elif args.command == 'errors':
+            rows = catalog.errors()
+        else:
+            rows = [catalog.stats()]
+        elapsed = time.monotonic() - start
+        print_rows(rows)
+        print(f"{len(rows)} 行，查询耗时 {elapsed * 1000:.1f} 毫秒")
@@ -0,0 +1,67 @@
+# page_cache.py
+import json
+import os
+import time
+
+CACHE_FILE_NAME = 'page_cache.json'
+# 缓存格式变化时递增，旧版本的缓存直接作废
+CACHE_VERSION = 1
+DEFAULT_TTL_HOURS = 24 * 7
+
+
+class PageCache:
+    """
+    缓存下拉框遍历得到的 (product, version, bay, model) 列表，按product分组保存。
+    整体在ttl内有效；单个product可以单独刷新。
+    """
+
+    def __init__(self, folder_path, ttl_hours=DEFAULT_TTL_HOURS):
+        self.cache_path = os.path.join(folder_path, CACHE_FILE_NAME)
+        self.ttl = ttl_hours * 3600
+        self.created_at = 0
+        self._products = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.cache_path, 'r') as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return
+        if data.get('version') != CACHE_VERSION:
+            print(f"页面缓存版本 {data.get('version')} 已过期，忽略")
+            return
+        self.created_at = data.get('created_at', 0)
+        self._products = {product: entry for product, entry in data.get('products', {}).items()}
+
+    def save(self):
+        tmp_path = self.cache_path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump({'version': CACHE_VERSION, 'created_at': self.created_at, 'products': self._products}, file,
+                      ensure_ascii=False)
+        os.replace(tmp_path, self.cache_path)
+
+    def is_fresh(self):
+        return bool(self._products) and time.time() - self.created_at < self.ttl
+
+    def age_hours(self):
+        return (time.time() - self.created_at) / 3600
+
+    def products(self):
+        return list(self._products)
+
+    def pages(self):
+        return [tuple(page) for entry in self._products.values() for page in entry['pages']]
+
+    def update_product(self, product, pages):
+        if not self._products:
+            # 空缓存从这次刷新开始计时
+            self.created_at = time.time()
+        self._products[product] = {'updated_at': time.time(), 'pages': [list(page) for page in pages]}
+
+    def replace(self, pages):
+        # 完整遍历的结果，同时刷新整体的创建时间
+        self._products = {}
+        for page in pages:
+            self._products.setdefault(page[0], {'updated_at': time.time(), 'pages': []})['pages'].append(list(page))
+        self.created_at = time.time()
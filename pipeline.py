@@ -0,0 +1,134 @@
+# pipeline.py
+import queue
+import threading
+import time
+
+DEFAULT_PAGE_QUEUE_SIZE = 64
+DEFAULT_JOB_QUEUE_SIZE = 256
+DEFAULT_REPORT_INTERVAL = 10
+
+# 队列结束标记
+_DONE = object()
+
+
+class StageStats:
+    def __init__(self, name):
+        self.name = name
+        self.processed = 0
+        self.errors = 0
+        self.bytes = 0
+        self.started_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, count=1, nbytes=0, error=False):
+        with self._lock:
+            self.processed += count
+            self.bytes += nbytes
+            if error:
+                self.errors += 1
+
+    def rate(self):
+        elapsed = max(time.monotonic() - self.started_at, 1e-6)
+        return self.processed / elapsed, self.bytes / elapsed
+
+    def __str__(self) -> str:
+        per_second, bytes_per_second = self.rate()
+        text = f"{self.name} {self.processed} ({per_second:.2f}/s"
+        if self.bytes:
+            text += f", {bytes_per_second / 1024 / 1024:.1f} MB/s"
+        return text + (f", 失败 {self.errors})" if self.errors else ")")
+
+
+class CrawlPipeline:
+    """
+    三段流水线：producer 产生页面放入有界队列，列表工作线程把页面转换为下载任务，
+    下载工作线程执行下载任务，三个阶段同时进行。运行期间定时打印队列深度和各阶段吞吐。
+
+    - producer()：返回可迭代的页面
+    - list_page(page, submit)：处理一个页面，对每个需要下载的文件调用submit(job)
+    - download_job(job)：执行下载，返回下载的字节数
+    """
+
+    def __init__(self, producer, list_page, download_job, list_workers, download_workers,
+                 page_queue_size=DEFAULT_PAGE_QUEUE_SIZE, job_queue_size=DEFAULT_JOB_QUEUE_SIZE,
+                 report_interval=DEFAULT_REPORT_INTERVAL):
+        self.producer = producer
+        self.list_page = list_page
+        self.download_job = download_job
+        self.list_workers = list_workers
+        self.download_workers = download_workers
+        self.page_queue = queue.Queue(maxsize=page_queue_size)
+        self.job_queue = queue.Queue(maxsize=job_queue_size)
+        self.report_interval = report_interval
+        self.enumerate_stats = StageStats('遍历')
+        self.list_stats = StageStats('列表')
+        self.download_stats = StageStats('下载')
+        self._list_done = threading.Semaphore(0)
+        self._stopped = threading.Event()
+
+    def _produce(self):
+        try:
+            for page in self.producer():
+                self.page_queue.put(page)
+                self.enumerate_stats.record()
+        except Exception as e:
+            print(f"页面遍历失败：{e}")
+            self.enumerate_stats.record(0, error=True)
+        finally:
+            for _ in range(self.list_workers):
+                self.page_queue.put(_DONE)
+
+    def _list(self):
+        while True:
+            page = self.page_queue.get()
+            if page is _DONE:
+                break
+            try:
+                self.list_page(page, self.job_queue.put)
+                self.list_stats.record()
+            except Exception as e:
+                print(f"处理页面 {page} 失败：{e}")
+                self.list_stats.record(error=True)
+        self._list_done.release()
+
+    def _download(self):
+        while True:
+            job = self.job_queue.get()
+            if job is _DONE:
+                break
+            try:
+                self.download_stats.record(nbytes=self.download_job(job) or 0)
+            except Exception as e:
+                print(f"下载任务 {job} 失败：{e}")
+                self.download_stats.record(error=True)
+
+    def _close_jobs(self):
+        # 所有列表线程结束后再通知下载线程退出
+        for _ in range(self.list_workers):
+            self._list_done.acquire()
+        for _ in range(self.download_workers):
+            self.job_queue.put(_DONE)
+
+    def _report(self):
+        while not self._stopped.wait(self.report_interval):
+            self.print_status()
+
+    def print_status(self):
+        print(f"[pipeline] 页面队列 {self.page_queue.qsize()}/{self.page_queue.maxsize}，"
+              f"下载队列 {self.job_queue.qsize()}/{self.job_queue.maxsize} | "
+              f"{self.enumerate_stats} | {self.list_stats} | {self.download_stats}")
+
+    def run(self):
+        threads = [threading.Thread(target=self._produce, name='pipeline-produce')]
+        threads += [threading.Thread(target=self._list, name=f'pipeline-list-{i}') for i in range(self.list_workers)]
+        threads += [threading.Thread(target=self._download, name=f'pipeline-download-{i}')
+                    for i in range(self.download_workers)]
+        threads.append(threading.Thread(target=self._close_jobs, name='pipeline-close'))
+        reporter = threading.Thread(target=self._report, name='pipeline-report', daemon=True)
+        reporter.start()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self._stopped.set()
+        self.print_status()
@@ -0,0 +1,496 @@
+# qpkg_archive.py
+import argparse
+import bz2
+import hashlib
+import lzma
+import os
+import sqlite3
+import sys
+import tarfile
+import threading
+import time
+import zlib
+
+from blob_store import BLOB_DIR_NAME
+from catalog import CATALOG_FILE_NAME
+from devide_qpkg import QpkgSection, map_qpkg, find_header_end, read_layout
+
+INDEX_FILE_NAME = 'qpkg_index.db'
+CONTROL = 'control'
+DATA = 'data'
+# 指纹取header和文件末尾这么多字节，不必读取整个安装包
+FINGERPRINT_TAIL_SIZE = 64 * 1024
+# 每次送入解压器的压缩数据量，以及未压缩时每次返回的数据量
+INPUT_CHUNK_SIZE = 64 * 1024
+READ_CHUNK_SIZE = 1024 * 1024
+# gzip每解压这么多字节在内存中保存一次解压器状态
+CHECKPOINT_INTERVAL = 8 * 1024 * 1024
+# 压缩包中不超过这个大小的成员，第一次读取后按sha256把内容存入索引，之后的进程不必再解压
+CACHED_MEMBER_SIZE = 1024 * 1024
+# 镜像根目录（下载路径）中的文件，用来从安装包路径向上找到镜像根目录
+MIRROR_ROOT_MARKERS = (INDEX_FILE_NAME, CATALOG_FILE_NAME, BLOB_DIR_NAME)
+MAGIC_NUMBERS = ((b'\x1f\x8b', 'gz'), (b'BZh', 'bz2'), (b'\xfd7zXZ\x00', 'xz'), (b"7z\xbc\xaf\x27\x1c", '7z'))
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS streams (
+    fingerprint TEXT NOT NULL,
+    archive TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    compression TEXT NOT NULL,
+    indexed_at REAL NOT NULL,
+    PRIMARY KEY (fingerprint, archive)
+);
+CREATE TABLE IF NOT EXISTS members (
+    fingerprint TEXT NOT NULL,
+    archive TEXT NOT NULL,
+    name TEXT NOT NULL,
+    type TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    mode INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    linkname TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    sha256 TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (fingerprint, archive, name)
+);
+CREATE TABLE IF NOT EXISTS contents (
+    sha256 TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+);
+'''
+
+# 旧版本数据库members表缺少的列：(列名, 定义)
+MIGRATIONS = [
+    ('sha256', "TEXT NOT NULL DEFAULT ''"),
+]
+
+
+def normalize_name(name):
+    # tar中的成员名通常以./开头，查找时忽略
+    while name.startswith('./'):
+        name = name[2:]
+    return name.lstrip('/')
+
+
+def detect_compression(data):
+    for magic, compression in MAGIC_NUMBERS:
+        if data.startswith(magic):
+            return compression
+    return ""
+
+
+def new_decompressor(compression):
+    if compression == 'gz':
+        return zlib.decompressobj(zlib.MAX_WBITS | 16)
+    if compression == 'bz2':
+        return bz2.BZ2Decompressor()
+    if compression == 'xz':
+        return lzma.LZMADecompressor()
+    return None
+
+
+def iter_stream(mapped, stream, start=0, checkpoints=None):
+    """
+    从解压后的位置start开始逐块返回一段tar数据。
+    checkpoints为gzip解压器检查点列表 [(解压后位置, 压缩数据位置, 解压器)]：从start之前最近的检查点开始解压，
+    途中每隔CHECKPOINT_INTERVAL字节补充一个检查点。
+    """
+    end = len(mapped) if stream.length is None else min(len(mapped), stream.offset + stream.length)
+    if not stream.compression:
+        position = stream.offset + start
+        while position < end:
+            yield mapped[position:min(end, position + READ_CHUNK_SIZE)]
+            position += READ_CHUNK_SIZE
+        return
+
+    out_position, in_position, decompressor = 0, stream.offset, None
+    if checkpoints:
+        usable = [checkpoint for checkpoint in checkpoints if checkpoint[0] <= start]
+        if usable:
+            out_position, in_position, decompressor = usable[-1]
+            decompressor = decompressor.copy()
+    decompressor = decompressor or new_decompressor(stream.compression)
+    while in_position < end and not decompressor.eof:
+        chunk_end = min(end, in_position + INPUT_CHUNK_SIZE)
+        data = decompressor.decompress(mapped[in_position:chunk_end])
+        in_position = chunk_end
+        if out_position + len(data) > start:
+            yield data[max(0, start - out_position):]
+        out_position += len(data)
+        # 只有zlib的解压器可以复制
+        if checkpoints is not None and stream.compression == 'gz' and \
+                out_position - (checkpoints[-1][0] if checkpoints else 0) >= CHECKPOINT_INTERVAL:
+            checkpoints.append((out_position, in_position, decompressor.copy()))
+
+
+class ChunkReader:
+    """
+    把按块返回数据的生成器包装成只能顺序读取的文件对象，供tarfile以流模式解析。
+    """
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._buffer = bytearray()
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+class QpkgMember:
+    def __init__(self, archive, name, type, size, offset, mode=0o644, mtime=0.0, linkname="", sha256=""):
+        self.archive = archive
+        self.name = name
+        self.type = type
+        self.size = size
+        # 成员数据在解压后的tar流中的位置
+        self.offset = offset
+        self.mode = mode
+        self.mtime = mtime
+        self.linkname = linkname
+        # 内容已缓存在索引中时为其sha256
+        self.sha256 = sha256
+
+    def isfile(self):
+        return self.type == 'file'
+
+    def to_row(self):
+        return (self.archive, self.name, self.type, self.size, self.offset, self.mode, self.mtime, self.linkname,
+                self.sha256)
+
+    def __str__(self) -> str:
+        return f"QpkgMember(archive={self.archive}, name={self.name}, type={self.type}, size={self.size})"
+
+
+def member_type(tarinfo):
+    if tarinfo.isfile():
+        return 'file'
+    if tarinfo.isdir():
+        return 'dir'
+    if tarinfo.issym():
+        return 'symlink'
+    if tarinfo.islnk():
+        return 'hardlink'
+    return 'other'
+
+
+class QpkgIndex:
+    """
+    按安装包指纹保存控制包和数据包的位置、压缩方式以及每个成员在解压后tar流中的偏移。
+    同一个安装包再次打开时不必重新解析header和遍历tar。读取过的小成员的内容按sha256保存在contents表中，
+    不同版本中相同的文件（如图标）只存一份。
+    """
+
+    def __init__(self, folder_path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(folder_path, INDEX_FILE_NAME), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(members)')}
+        with self._conn:
+            for name, definition in MIGRATIONS:
+                if name not in columns:
+                    self._conn.execute(f'ALTER TABLE members ADD COLUMN {name} {definition}')
+
+    def load_stream(self, fingerprint, archive):
+        with self._lock:
+            row = self._conn.execute('SELECT offset, length, compression FROM streams WHERE fingerprint = ? '
+                                     'AND archive = ?', (fingerprint, archive)).fetchone()
+        if row is None:
+            return None
+        offset, length, compression = row
+        return QpkgSection(archive, offset, length, compression=compression)
+
+    def load_members(self, fingerprint, archive):
+        with self._lock:
+            if self._conn.execute('SELECT 1 FROM streams WHERE fingerprint = ? AND archive = ?',
+                                  (fingerprint, archive)).fetchone() is None:
+                return None
+            rows = self._conn.execute('SELECT archive, name, type, size, offset, mode, mtime, linkname, sha256 '
+                                      'FROM members WHERE fingerprint = ? AND archive = ? ORDER BY seq',
+                                      (fingerprint, archive)).fetchall()
+        return [QpkgMember(*row) for row in rows]
+
+    def save(self, fingerprint, archive, stream, members):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM members WHERE fingerprint = ? AND archive = ?', (fingerprint, archive))
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO members (fingerprint, archive, name, type, size, offset, mode, mtime, '
+                'linkname, sha256, seq) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(fingerprint, *member.to_row(), seq) for seq, member in enumerate(members)])
+            self._conn.execute(
+                'INSERT OR REPLACE INTO streams (fingerprint, archive, offset, length, compression, indexed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (fingerprint, archive, stream.offset, stream.length, stream.compression, time.time()))
+
+    def load_content(self, sha256):
+        with self._lock:
+            row = self._conn.execute('SELECT data FROM contents WHERE sha256 = ?', (sha256,)).fetchone()
+        return None if row is None else bytes(row[0])
+
+    def save_content(self, fingerprint, member, data):
+        sha256 = hashlib.sha256(data).hexdigest()
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR IGNORE INTO contents (sha256, data) VALUES (?, ?)', (sha256, data))
+            self._conn.execute('UPDATE members SET sha256 = ? WHERE fingerprint = ? AND archive = ? AND name = ?',
+                               (sha256, fingerprint, member.archive, member.name))
+        member.sha256 = sha256
+
+    def close(self):
+        self._conn.close()
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def find_mirror_root(qpkg_file):
+    """
+    从安装包所在目录向上寻找镜像根目录，索引放在那里，不会分散到各型号目录中。
+    不在镜像中的安装包使用其所在目录。
+    """
+    folder_path = os.path.dirname(os.path.abspath(qpkg_file))
+    candidate = folder_path
+    while True:
+        if any(os.path.exists(os.path.join(candidate, marker)) for marker in MIRROR_ROOT_MARKERS):
+            return candidate
+        parent = os.path.dirname(candidate)
+        if parent == candidate:
+            return folder_path
+        candidate = parent
+
+
+def open_qpkg_index(folder_path) -> QpkgIndex:
+    key = os.path.abspath(folder_path)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = QpkgIndex(folder_path)
+            _indexes[key] = index
+        return index
+
+
+class QpkgArchive:
+    """
+    不解压整个安装包，按需读取控制包和数据包中的成员。
+    打开时只映射文件，用到时才解析header；成员列表遍历一次后写入QpkgIndex，
+    之后读取单个成员时直接定位：未压缩的tar从映射中直接切出，gzip从内存中最近的检查点继续解压，
+    并在成员结束处停止，不会解压后面的数据。
+    检查点只在当前进程内有效（zlib的解压器状态无法保存到磁盘），新进程读取压缩包中的成员仍要从头解压到该成员；
+    不超过CACHED_MEMBER_SIZE的成员第一次读取后内容存入索引，之后任何进程都直接从索引返回。
+    """
+
+    def __init__(self, qpkg_file, index=None):
+        self.qpkg_file = qpkg_file
+        self.index = index
+        self._mapped = None
+        self._fingerprint = None
+        self._layout = None
+        self._streams = {}
+        self._members = {}
+        self._checkpoints = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def mapped(self):
+        if self._mapped is None:
+            self._mapped = map_qpkg(self.qpkg_file)
+        return self._mapped
+
+    @property
+    def fingerprint(self):
+        """
+        由文件大小、header脚本和文件末尾计算，与路径无关，软链接、硬链接和复制的文件共用索引。
+        """
+        if self._fingerprint is None:
+            mapped = self.mapped
+            sha256 = hashlib.sha256(str(len(mapped)).encode())
+            sha256.update(mapped[:max(find_header_end(mapped), 0)])
+            sha256.update(mapped[max(0, len(mapped) - FINGERPRINT_TAIL_SIZE):])
+            self._fingerprint = sha256.hexdigest()
+        return self._fingerprint
+
+    @property
+    def layout(self):
+        if self._layout is None:
+            self._layout = read_layout(self.mapped)
+        return self._layout
+
+    def stream(self, archive):
+        """
+        返回控制包或数据包的tar数据在文件中的位置，无法定位或格式不支持（如7z）时返回None。
+        """
+        if archive in self._streams:
+            return self._streams[archive]
+        stream = self.index.load_stream(self.fingerprint, archive) if self.index else None
+        if stream is None:
+            stream = self._locate_stream(archive)
+        self._streams[archive] = stream
+        return stream
+
+    def _locate_stream(self, archive):
+        layout = self.layout
+        if layout is None:
+            return None
+        if archive == CONTROL:
+            section = layout.section('control')
+            if section is None:
+                return None
+            # 控制包是外层tar中的第一个文件；section.compression是里层控制包的压缩方式，外层tar不压缩
+            outer_stream = QpkgSection(CONTROL, section.offset, section.length)
+            with tarfile.open(fileobj=ChunkReader(iter_stream(self.mapped, outer_stream)), mode='r|') as outer:
+                member = next((member for member in outer if member.isfile()), None)
+            if member is None:
+                return None
+            offset, length = section.offset + member.offset_data, member.size
+        else:
+            section = next((section for section in layout.sections
+                            if section.kind == 'file' and section.name.startswith('data')), None)
+            if section is None:
+                return None
+            offset, length = section.offset, section.length
+        compression = detect_compression(self.mapped[offset:offset + 8])
+        if compression == '7z':
+            return None
+        return QpkgSection(archive, offset, length, compression=compression)
+
+    def members(self, archive=CONTROL):
+        """
+        列出控制包或数据包的成员，无法读取时返回None。
+        """
+        if archive in self._members:
+            return self._members[archive]
+        members = self.index.load_members(self.fingerprint, archive) if self.index else None
+        if members is None:
+            stream = self.stream(archive)
+            if stream is None:
+                return None
+            members = []
+            checkpoints = self._checkpoints.setdefault(archive, [])
+            with tarfile.open(fileobj=ChunkReader(iter_stream(self.mapped, stream, 0, checkpoints)),
+                              mode='r|') as tar:
+                for tarinfo in tar:
+                    members.append(QpkgMember(archive, normalize_name(tarinfo.name), member_type(tarinfo),
+                                              tarinfo.size, tarinfo.offset_data, tarinfo.mode, tarinfo.mtime,
+                                              tarinfo.linkname))
+            if self.index:
+                self.index.save(self.fingerprint, archive, stream, members)
+        self._members[archive] = members
+        return members
+
+    def getmember(self, name, archive=None):
+        """
+        按名称查找成员，archive为None时先找控制包再找数据包。
+        """
+        name = normalize_name(name)
+        for candidate in ((archive,) if archive else (CONTROL, DATA)):
+            for member in self.members(candidate) or ():
+                if member.name == name:
+                    return member
+        return None
+
+    def iter_member(self, member):
+        # 逐块返回成员的内容
+        if member.sha256 and self.index:
+            data = self.index.load_content(member.sha256)
+            if data is not None:
+                yield data
+                return
+        stream = self.stream(member.archive)
+        # 未压缩的tar直接从映射中切出，不需要缓存
+        cached = [] if self.index and stream.compression and member.size <= CACHED_MEMBER_SIZE else None
+        remaining = member.size
+        checkpoints = self._checkpoints.setdefault(member.archive, [])
+        for chunk in iter_stream(self.mapped, stream, member.offset, checkpoints):
+            chunk = chunk[:remaining]
+            if cached is not None:
+                cached.append(chunk)
+            yield chunk
+            remaining -= len(chunk)
+            if remaining <= 0:
+                break
+        if cached is not None and remaining <= 0:
+            self.index.save_content(self.fingerprint, member, b''.join(cached))
+
+    def read(self, name, archive=None):
+        """
+        读取一个成员的全部内容，适合qpkg.cfg、图标等小文件；找不到时返回None。
+        """
+        member = self.getmember(name, archive)
+        if member is None or not member.isfile():
+            return None
+        return b''.join(self.iter_member(member))
+
+    def extract(self, name, target_path, archive=None):
+        member = self.getmember(name, archive)
+        if member is None or not member.isfile():
+            return False
+        with open(target_path, 'wb') as file:
+            for chunk in self.iter_member(member):
+                file.write(chunk)
+        return True
+
+    def close(self):
+        if self._mapped is not None:
+            self._mapped.close()
+            self._mapped = None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='不解压整个安装包，列出或读取QPKG中的文件')
+    parser.add_argument('qpkg_file')
+    parser.add_argument('--index', help='成员索引（qpkg_index.db）所在目录，默认为安装包所在的镜像根目录')
+    commands = parser.add_subparsers(dest='command', required=True)
+    list_parser = commands.add_parser('list', help='列出控制包或数据包的成员')
+    list_parser.add_argument('--archive', choices=(CONTROL, DATA), default=None, help='默认两者都列出')
+    cat_parser = commands.add_parser('cat', help='把一个成员的内容写到标准输出')
+    cat_parser.add_argument('name')
+    extract_parser = commands.add_parser('extract', help='把一个成员写到文件')
+    extract_parser.add_argument('name')
+    extract_parser.add_argument('target_path')
+    args = parser.parse_args()
+
+    index = open_qpkg_index(args.index or find_mirror_root(args.qpkg_file))
+    start = time.monotonic()
+    with QpkgArchive(args.qpkg_file, index) as qpkg_archive:
+        # 索引中已有位置时不需要解析header
+        if qpkg_archive.stream(CONTROL) is None and qpkg_archive.stream(DATA) is None:
+            print(f"无法解析 {args.qpkg_file} 的header")
+            sys.exit(1)
+        if args.command == 'list':
+            for archive in ((args.archive,) if args.archive else (CONTROL, DATA)):
+                members = qpkg_archive.members(archive)
+                if members is None:
+                    print(f"{archive}: 无法读取")
+                    continue
+                for member in members:
+                    print(f"{archive}\t{member.type}\t{member.size}\t{member.name}")
+        else:
+            member = qpkg_archive.getmember(args.name)
+            if member is None or not member.isfile():
+                print(f"找不到文件 {args.name}")
+                sys.exit(1)
+            if args.command == 'cat':
+                for chunk in qpkg_archive.iter_member(member):
+                    sys.stdout.buffer.write(chunk)
+            else:
+                qpkg_archive.extract(args.name, args.target_path)
+    print(f"用时 {(time.monotonic() - start) * 1000:.1f} 毫秒", file=sys.stderr)
@@ -0,0 +1,162 @@
+# snapshot.py
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import requests
+
+from downloader import get_session, get_validators, DEFAULT_TIMEOUT
+
+SNAPSHOT_FILE_NAME = 'snapshots.db'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS listings (
+    page_key TEXT PRIMARY KEY,
+    apps TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS validators (
+    url TEXT PRIMARY KEY,
+    etag TEXT NOT NULL DEFAULT '',
+    last_modified TEXT NOT NULL DEFAULT '',
+    updated_at REAL NOT NULL
+);
+'''
+
+
+def app_key(app_item):
+    # 没有名称时用安装包文件名区分应用
+    return app_item.name or app_item.download_url.split('/')[-1]
+
+
+class ListingDiff:
+    def __init__(self, added=None, changed=None, removed=None, unchanged=None):
+        self.added = added or []
+        self.changed = changed or []
+        self.removed = removed or []
+        self.unchanged = unchanged or []
+
+    def has_changes(self):
+        return bool(self.added or self.changed or self.removed)
+
+
+class SnapshotStore:
+    """
+    增量抓取的状态：每个型号上次的应用列表，以及每个URL的 ETag/Last-Modified。
+    """
+
+    def __init__(self, folder_path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(folder_path, SNAPSHOT_FILE_NAME), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+
+    def conditional_headers(self, url):
+        with self._lock:
+            row = self._conn.execute('SELECT etag, last_modified FROM validators WHERE url = ?', (url,)).fetchone()
+        headers = {}
+        if row and row[0]:
+            headers['If-None-Match'] = row[0]
+        if row and row[1]:
+            headers['If-Modified-Since'] = row[1]
+        return headers
+
+    def save_validators(self, url, validators):
+        if not validators.get('etag') and not validators.get('last_modified'):
+            return
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO validators (url, etag, last_modified, updated_at) VALUES (?, ?, ?, ?)',
+                (url, validators.get('etag', ""), validators.get('last_modified', ""), time.time()))
+
+    def is_unchanged(self, url, session=None):
+        """
+        对url发送条件HEAD请求。服务器返回304时为True；
+        没有保存过校验头或请求失败时返回False，由调用方按已变化处理。
+        """
+        headers = self.conditional_headers(url)
+        if not headers:
+            return False
+        session = session or get_session()
+        try:
+            with session.head(url, headers=headers, allow_redirects=True, timeout=DEFAULT_TIMEOUT) as resp:
+                if resp.status_code == 304:
+                    return True
+                if resp.status_code == 200:
+                    # 校验头与上次相同的服务器也视为未变化（不支持条件请求的情况）
+                    validators = get_validators(resp.headers)
+                    return headers.get('If-None-Match', "") == validators['etag'] and \
+                        headers.get('If-Modified-Since', "") == validators['last_modified']
+        except requests.RequestException:
+            pass
+        return False
+
+    def listing(self, page_key):
+        with self._lock:
+            row = self._conn.execute('SELECT apps FROM listings WHERE page_key = ?', (page_key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def diff_listing(self, page_key, app_items):
+        previous = self.listing(page_key) or {}
+        diff = ListingDiff()
+        current = {}
+        for app_item in app_items:
+            key = app_key(app_item)
+            current[key] = {'version': app_item.version, 'download_url': app_item.download_url,
+                            'release_url': app_item.release_url}
+            if key not in previous:
+                diff.added.append(app_item)
+            elif previous[key]['download_url'] != app_item.download_url or \
+                    previous[key]['version'] != app_item.version:
+                diff.changed.append(app_item)
+            else:
+                diff.unchanged.append(app_item)
+        diff.removed = [key for key in previous if key not in current]
+        return diff, current
+
+    def save_listing(self, page_key, apps):
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO listings (page_key, apps, updated_at) VALUES (?, ?, ?)',
+                               (page_key, json.dumps(apps, ensure_ascii=False), time.time()))
+
+    def close(self):
+        self._conn.close()
+
+
+class CrawlSummary:
+    """
+    汇总本次运行中各型号应用列表的新增、变化和删除情况。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.not_modified_pages = 0
+        self.changed_pages = 0
+        self.unchanged_pages = 0
+        self.added = []
+        self.changed = []
+        self.removed = []
+
+    def record_not_modified(self):
+        with self._lock:
+            self.not_modified_pages += 1
+
+    def record(self, page, diff: ListingDiff):
+        with self._lock:
+            if not diff.has_changes():
+                self.unchanged_pages += 1
+                return
+            self.changed_pages += 1
+            self.added.extend((str(page), app_key(app_item)) for app_item in diff.added)
+            self.changed.extend((str(page), app_key(app_item)) for app_item in diff.changed)
+            self.removed.extend((str(page), key) for key in diff.removed)
+
+    def print_summary(self):
+        print(f"增量抓取完成：{self.not_modified_pages} 个页面未修改(304)，{self.unchanged_pages} 个页面内容未变，"
+              f"{self.changed_pages} 个页面有变化")
+        for title, entries in (('新增', self.added), ('变化', self.changed), ('删除', self.removed)):
+            print(f"{title}应用 {len(entries)} 个")
+            for page, key in entries:
+                print(f"  {key}  @ {page}")
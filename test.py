@@ -1,16 +1,38 @@
+import argparse
 import os
-import time
-from urllib.parse import urlparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse, urljoin
 
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from sphinx.util import requests
 from webdriver_manager.chrome import ChromeDriverManager
 from bs4 import BeautifulSoup
-import sys
+
+from downloader import QUARANTINE_DIR_NAME
+from download_list import fetch_download_list
+from ledger import open_ledger
+from blob_store import open_blob_store
+from waits import wait_for_dom_quiet, wait_for_network_idle, wait_until, wait_stats
+from metrics import metrics, PROFILE_DIR_NAME
+from host_scheduler import scheduler, DEFAULT_RATE, DEFAULT_CONCURRENCY
+from catalog import open_catalog
+
+DOWNLOAD_CENTER_URL = 'https://www.qnap.com/en-us/download'
+CATEGORIES = ('firmware', 'utility')
+DEFAULT_WORKERS = 16
+
+_md5_locks = {}
+_md5_locks_lock = threading.Lock()
+
+
+def get_md5_lock(md5_value):
+    # 相同MD5的文件同一时间只允许一个线程下载
+    with _md5_locks_lock:
+        return _md5_locks.setdefault(md5_value, threading.Lock())
 
 
 class Model:
@@ -33,8 +55,54 @@ class Model:
     def download_utility(self, base_url) -> None:
         url = f"{base_url}?model={self._name}&category=utility"
 
+    def get_url(self, base_url, category) -> str:
+        return f"{base_url}?model={self._name}&category={category}"
+
+    def crawl(self, base_url, download_path, category, session=None) -> bool:
+        """
+        直接请求下载列表页并下载其中的文件。页面中没有下载列表时返回False，由调用方改用浏览器。
+        """
+        with metrics.timer('download_list_fetch'):
+            entries = fetch_download_list(self.get_url(base_url, category), session)
+        if entries is None:
+            return False
+        for entry in entries:
+            self.save_entry(entry.href, entry.md5, category, download_path)
+        return True
+
+    def save_entry(self, href, md5_value, category, download_path) -> None:
+        # 构造下载路径
+        folder_name = f"{download_path}/{self._bay}/{self._name}/{category}"
+        os.makedirs(folder_name, exist_ok=True)
+        file_name = os.path.basename(urlparse(href).path)
+        local_file_path = os.path.join(folder_name, file_name)
+
+        catalog = open_catalog(download_path)
+        catalog.add_offer(category, href, self._bay, self._name)
+        if not md5_value:
+            print(f"文件 {file_name} 没有MD5值，跳过下载。")
+            return
+        with get_md5_lock(md5_value):
+            # 检查MD5码是否已存在
+            blob_store = open_blob_store(download_path)
+            existing = open_ledger(download_path).find_by_md5(md5_value)
+            if existing and blob_store.link_existing(existing.file_path, local_file_path):
+                print(f"MD5值 {md5_value} 已存在，链接至 {local_file_path}，跳过下载。")
+                catalog.record_file(href, local_file_path, md5_value, existing.sha256)
+            elif not self.md5_exists(md5_value, file_name, download_path):
+                # 下载文件，校验通过后收入内容存储并保存MD5码到下载记录
+                result = self.download_file(href, local_file_path, md5_value,
+                                            os.path.join(download_path, QUARANTINE_DIR_NAME))
+                if result:
+                    blob_store.ingest(local_file_path, result.sha256)
+                    self.save_md5(md5_value, file_name, download_path, local_file_path, href, result.sha256)
+                    catalog.record_file(href, local_file_path, md5_value, result.sha256)
+            else:
+                print(f"MD5值 {md5_value} 和文件名 {file_name} 已存在，跳过下载。")
+
     def download_firmware_or_utility(self, base_url, driver, download_path, category) -> None:
-        url = f"{base_url}?model={self._name}&category={category}"
+        # 浏览器方式，用于页面中的下载列表由脚本渲染的情况
+        url = self.get_url(base_url, category)
         try:
             # 获取当前页面的窗口句柄
             current_window_handle = driver.current_window_handle
@@ -43,12 +111,13 @@ class Model:
             driver.execute_script("window.open('');")
             driver.switch_to.window(driver.window_handles[-1])  # 切换到新窗口
 
-            driver.get(url)
+            with metrics.timer('page_load'):
+                driver.get(url)
 
-            # 等待页面加载完成，确保download_list里的tr元素可见
-            WebDriverWait(driver, 10).until(
-                EC.presence_of_all_elements_located((By.CSS_SELECTOR, "div#download_list tr"))
-            )
+                # 等待页面加载完成，确保download_list里的tr元素可见
+                WebDriverWait(driver, 10).until(
+                    EC.presence_of_all_elements_located((By.CSS_SELECTOR, "div#download_list tr"))
+                )
 
             # 获取页面源代码
             html = driver.page_source
@@ -67,22 +136,8 @@ class Model:
                     for link in download_links:
                         href = link.get('href')
                         if href:
-                            # 构造下载路径
-                            folder_name = f"{download_path}/{self._bay}/{self._name}/{self.get_category(driver.current_url)}"
-                            os.makedirs(folder_name, exist_ok=True)
-                            file_name = os.path.basename(urlparse(href).path)
-                            download_url = href
-                            local_file_path = os.path.join(folder_name, file_name)
-
-                            # 检查MD5码是否已存在
-                            md5_value = self.get_md5(tr)
-                            if md5_value and not self.md5_exists(md5_value, file_name, download_path):
-                                # 下载文件
-                                self.download_file(download_url, local_file_path)
-                                # 保存MD5码到record.txt
-                                self.save_md5(md5_value, file_name, download_path)
-                            else:
-                                print(f"MD5值 {md5_value} 和文件名 {file_name} 已存在，跳过下载。")
+                            self.save_entry(href, self.get_md5(tr), self.get_category(driver.current_url),
+                                            download_path)
                             break  # 成功一次后即停止
 
             # 关闭新窗口并切换回原来的窗口
@@ -109,30 +164,21 @@ class Model:
             return md5_value
         return None
 
-    def save_md5(self, md5_value, file_name, folder_path):
-        record_file_path = os.path.join(folder_path, 'record.txt')
-        with open(record_file_path, 'a') as file:
-            file.write(f"{md5_value}:{file_name}\n")
+    def save_md5(self, md5_value, file_name, folder_path, file_path="", url="", sha256=""):
+        open_ledger(folder_path).add(file_name, file_path=file_path, url=url, md5=md5_value, sha256=sha256)
 
     def md5_exists(self, md5_value, file_name, folder_path):
-        record_file_path = os.path.join(folder_path, 'record.txt')
-        if os.path.exists(record_file_path):
-            with open(record_file_path, 'r') as file:
-                for line in file:
-                    record_md5, record_file_name = line.strip().split(':')
-                    if record_md5 == md5_value and record_file_name == file_name:
-                        return True
-        return False
-
-    def download_file(self, url, local_path):
-        response = requests.get('https:' + url, stream=True)
-        if response.status_code == 200:
-            with open(local_path, 'wb') as file:
-                for chunk in response.iter_content(chunk_size=1024):
-                    file.write(chunk)
-            print(f"文件已下载至：{local_path}")
-        else:
-            print(f"下载失败，状态码：{response.status_code}")
+        # 记录的文件已被删除（或blob已被回收）时视为不存在，重新下载
+        ledger = open_ledger(folder_path)
+        if not ledger.has_md5(md5_value, file_name):
+            return False
+        entry = ledger.find_by_md5(md5_value)
+        return entry is not None and os.path.exists(entry.file_path)
+
+    def download_file(self, url, local_path, md5_value=None, quarantine_dir=None):
+        # 下载链接不带协议（//host/path），按下载中心的协议补全
+        return scheduler.download_file(urljoin(DOWNLOAD_CENTER_URL, url), local_path, expected_md5=md5_value,
+                                       quarantine_dir=quarantine_dir)
 
     def get_download_list(self, driver, url):
         # 使用driver打开新的窗口或标签页
@@ -152,12 +198,41 @@ class Model:
         return download_list
 
 
-if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print("请提供下载路径作为参数。")
-        exit(1)
+def crawl_models(model_list, download_path, workers):
+    """
+    并发请求所有型号的下载列表页，返回需要用浏览器处理的 [(model, category)]。
+    """
+    fallback = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(model.crawl, DOWNLOAD_CENTER_URL, download_path, category): (model, category)
+                   for model in model_list for category in CATEGORIES}
+        for future in as_completed(futures):
+            model, category = futures[future]
+            try:
+                if not future.result():
+                    fallback.append((model, category))
+            except Exception as e:
+                print(f"处理 {model} {category} 发生错误：{e}")
+    return fallback
 
-    download_path = sys.argv[1]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', help='下载路径')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='同时处理的型号页面数量')
+    parser.add_argument('--browser', action='store_true', help='全部使用浏览器打开下载列表页')
+    parser.add_argument('--host-rate', type=float, default=DEFAULT_RATE, help='每个host的初始请求速率（次/秒）')
+    parser.add_argument('--host-concurrency', type=int, default=DEFAULT_CONCURRENCY, help='每个host初始同时下载的文件数')
+    parser.add_argument('--metrics-dir', help='Prometheus textfile和JSON运行报告的输出目录，默认为下载路径')
+    parser.add_argument('--profile', action='store_true', help='按阶段用cProfile采样，结果保存在输出目录的profiles中')
+    args = parser.parse_args()
+
+    download_path = args.path
+    metrics_dir = args.metrics_dir or download_path
+    scheduler.configure(args.host_rate, args.host_concurrency)
+    scheduler.install()
+    if args.profile:
+        metrics.enable_profiling(os.path.join(metrics_dir, PROFILE_DIR_NAME))
 
     if not os.path.exists(download_path):
         print(f"下载路径 {download_path} 不存在，正在创建...")
@@ -168,14 +243,15 @@ if __name__ == '__main__':
 
     model_list = []  # 用于存放model
 
-    download_center_url = 'https://www.qnap.com/en-us/download'
     # 访问页面
-    driver.get(download_center_url)
+    driver.get(DOWNLOAD_CENTER_URL)
 
-    time.sleep(5)  # 等待5秒，确保页面加载完成
+    # 等待页面加载完成
+    wait_for_network_idle(driver, 'page_load')
 
     # 查找下载中心的容器
-    download_center_div = driver.find_element(By.ID, 'download_center')
+    download_center_div = wait_until(driver, EC.presence_of_element_located((By.ID, 'download_center')),
+                                     'download_center')
 
     # 查找所有的com-select-set元素
     com_select_sets = download_center_div.find_elements(By.CSS_SELECTOR, 'div.com-select-set')
@@ -188,7 +264,8 @@ if __name__ == '__main__':
         first_option = product_type_select.find_elements(By.TAG_NAME, 'option')[1]
         first_option.click()
 
-        time.sleep(2)
+        # 等待Bay下拉框的选项更新完成
+        wait_for_dom_quiet(driver, 'product_type_select')
 
         # Bay
         bay_select_div = com_select_sets[1]
@@ -210,14 +287,23 @@ if __name__ == '__main__':
             model_select_options = model_select.find_elements(By.TAG_NAME, 'option')
             del model_select_options[0]  # 去除choose
 
-            # Check & Download
             for model_option in model_select_options:
                 model = Model(bay_option.text.strip(), model_option.text.strip())
                 print(model)
                 model_list.append(model)
 
-                model.download_firmware_or_utility(download_center_url, driver, download_path, 'firmware')
-                model.download_firmware_or_utility(download_center_url, driver, download_path, 'utility')
-                # model.download_document(download_center_url)
+    # Check & Download：浏览器只用于读取下拉框，下载列表页直接并发请求
+    if args.browser:
+        fallback = [(model, category) for model in model_list for category in CATEGORIES]
+    else:
+        fallback = crawl_models(model_list, download_path, args.workers)
+        if fallback:
+            print(f"{len(fallback)} 个页面无法直接解析，改用浏览器")
+    for model, category in fallback:
+        model.download_firmware_or_utility(DOWNLOAD_CENTER_URL, driver, download_path, category)
 
     driver.quit()
+    wait_stats.print_report()
+    scheduler.print_status()
+    metrics.print_report()
+    metrics.write(metrics_dir)
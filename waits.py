@@ -0,0 +1,187 @@
+# waits.py
+import threading
+import time
+from collections import deque
+
+from selenium.common.exceptions import TimeoutException, StaleElementReferenceException
+from selenium.webdriver.support.ui import WebDriverWait
+
+from metrics import metrics
+
+# 自适应超时：取最近若干次耗时的分位数乘以系数，再限制在上下限之间
+LATENCY_WINDOW = 50
+LATENCY_PERCENTILE = 0.95
+TIMEOUT_FACTOR = 3
+MIN_TIMEOUT = 1
+MAX_TIMEOUT = 30
+DEFAULT_TIMEOUT = 10
+POLL_FREQUENCY = 0.05
+# DOM多久没有变化视为稳定（毫秒）
+DOM_QUIET_MS = 300
+# 没有进行中的请求多久视为网络空闲（毫秒）
+NETWORK_IDLE_MS = 500
+
+# 在页面中记录最近一次DOM变化时间和进行中的fetch/XHR请求数，每个文档只安装一次
+INSTALL_SCRIPT = '''
+if (!window.__qnapWait) {
+    var w = window.__qnapWait = {inflight: 0, lastMutation: performance.now(), lastNetwork: performance.now()};
+    new MutationObserver(function () { w.lastMutation = performance.now(); })
+        .observe(document, {subtree: true, childList: true, attributes: true, characterData: true});
+    var done = function () { w.inflight--; w.lastNetwork = performance.now(); };
+    if (window.fetch) {
+        var originalFetch = window.fetch;
+        window.fetch = function () {
+            w.inflight++;
+            w.lastNetwork = performance.now();
+            return originalFetch.apply(this, arguments).finally(done);
+        };
+    }
+    var originalSend = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function () {
+        w.inflight++;
+        w.lastNetwork = performance.now();
+        this.addEventListener('loadend', done);
+        return originalSend.apply(this, arguments);
+    };
+}
+return true;
+'''
+DOM_QUIET_SCRIPT = 'return !!window.__qnapWait && performance.now() - window.__qnapWait.lastMutation >= arguments[0];'
+NETWORK_IDLE_SCRIPT = '''
+var w = window.__qnapWait;
+return document.readyState === 'complete' && !!w && w.inflight <= 0 && performance.now() - w.lastNetwork >= arguments[0];
+'''
+RECT_SCRIPT = '''
+var r = arguments[0].getBoundingClientRect();
+return [r.left, r.top, r.width, r.height].join(',');
+'''
+
+
+class WaitStats:
+    """
+    按阶段统计等待次数、总耗时、超时次数。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def record(self, stage, elapsed, timed_out=False):
+        with self._lock:
+            count, total, timeouts = self._stages.get(stage, (0, 0.0, 0))
+            self._stages[stage] = (count + 1, total + elapsed, timeouts + (1 if timed_out else 0))
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._stages)
+
+    def print_report(self):
+        stages = self.snapshot()
+        if not stages:
+            return
+        print("等待耗时统计：")
+        for stage, (count, total, timeouts) in sorted(stages.items(), key=lambda kv: -kv[1][1]):
+            print(f"  {stage}: {count} 次，共 {total:.1f} 秒，平均 {total / count * 1000:.0f} 毫秒，超时 {timeouts} 次")
+
+
+class AdaptiveTimeout:
+    def __init__(self, initial=DEFAULT_TIMEOUT, minimum=MIN_TIMEOUT, maximum=MAX_TIMEOUT):
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self._samples = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    def observe(self, elapsed):
+        with self._lock:
+            self._samples.append(elapsed)
+
+    def get(self):
+        with self._lock:
+            # 样本太少时使用初始值
+            if len(self._samples) < 5:
+                return self.initial
+            ordered = sorted(self._samples)
+        percentile = ordered[min(len(ordered) - 1, int(len(ordered) * LATENCY_PERCENTILE))]
+        return max(self.minimum, min(self.maximum, percentile * TIMEOUT_FACTOR))
+
+
+wait_stats = WaitStats()
+_timeouts = {}
+_timeouts_lock = threading.Lock()
+
+
+def get_timeout(stage, initial=DEFAULT_TIMEOUT):
+    with _timeouts_lock:
+        timeout = _timeouts.get(stage)
+        if timeout is None:
+            timeout = _timeouts[stage] = AdaptiveTimeout(initial)
+        return timeout
+
+
+def wait_until(driver, condition, stage, initial_timeout=DEFAULT_TIMEOUT, raise_on_timeout=True):
+    """
+    使用按阶段自适应的超时等待condition成立，并记录等待耗时。
+    raise_on_timeout为False时超时只记录，不抛异常，返回None。
+    """
+    adaptive = get_timeout(stage, initial_timeout)
+    start = time.monotonic()
+    try:
+        result = WebDriverWait(driver, adaptive.get(), poll_frequency=POLL_FREQUENCY).until(condition)
+    except TimeoutException:
+        # 超时也是一个样本（实际耗时至少为整个超时时间），否则超时越多学到的超时反而越短
+        elapsed = time.monotonic() - start
+        adaptive.observe(elapsed)
+        wait_stats.record(stage, elapsed, timed_out=True)
+        metrics.inc('wait_timeouts')
+        if raise_on_timeout:
+            raise
+        return None
+    elapsed = time.monotonic() - start
+    adaptive.observe(elapsed)
+    wait_stats.record(stage, elapsed)
+    metrics.observe(f'wait_{stage}', elapsed)
+    return result
+
+
+def install(driver):
+    driver.execute_script(INSTALL_SCRIPT)
+
+
+def wait_for_dom_quiet(driver, stage, quiet_ms=DOM_QUIET_MS):
+    # 等待DOM在quiet_ms毫秒内没有任何变化，替代点击后的固定sleep
+    install(driver)
+    return wait_until(driver, lambda d: d.execute_script(DOM_QUIET_SCRIPT, quiet_ms), stage,
+                      raise_on_timeout=False)
+
+
+def wait_for_network_idle(driver, stage, idle_ms=NETWORK_IDLE_MS):
+    # 等待页面加载完成且没有进行中的fetch/XHR请求，替代打开页面后的固定sleep
+    install(driver)
+    return wait_until(driver, lambda d: d.execute_script(NETWORK_IDLE_SCRIPT, idle_ms), stage,
+                      raise_on_timeout=False)
+
+
+class element_stable:
+    """
+    等待元素的位置和大小在连续几次轮询中不再变化，例如平滑滚动结束。
+    """
+
+    def __init__(self, element, samples=3):
+        self.element = element
+        self.samples = samples
+        self._history = []
+
+    def __call__(self, driver):
+        try:
+            rect = driver.execute_script(RECT_SCRIPT, self.element)
+        except StaleElementReferenceException:
+            return False
+        self._history.append(rect)
+        recent = self._history[-self.samples:]
+        return len(recent) == self.samples and len(set(recent)) == 1 and self.element
+
+
+def wait_for_element_stable(driver, element, stage):
+    return wait_until(driver, element_stable(element), stage, raise_on_timeout=False)
+